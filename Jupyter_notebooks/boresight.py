@@ -0,0 +1,224 @@
+# code for reading PARGE ground control point sets (boresight/*.gcs) and evaluating
+# roll, pitch and heading boresight offsets against their ground control points
+#
+# A .gcs file is a PARGE status saved as an IDL save file. Besides the project settings it holds the
+# ground control points (pixel, line, easting, northing, elevation, active flag), the position (UTM)
+# and attitude (radians) of every scan line and the sensor model (across- and along-track view angle
+# of every pixel). The ray of each GCP's pixel is cast from the position of its scan line with the
+# attitude plus the candidate offsets and intersected with the horizontal plane at the GCP elevation;
+# the residual is the distance of that point to the GCP. PARGE's roll and across-track view angles are
+# positive to the left, as in the NAV and sensor model files (see geometry.nav_attitude_matrices and
+# geometry.sensor_look_vectors).
+# Fitted offsets match the ones set in PARGE for the Husky calibration flights to a few hundredths of
+# a degree. All offsets and angles are in degrees.
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.io import readsav
+
+import geometry
+import navfile
+
+boresight_dir = Path(__file__).resolve().parent.parent / 'boresight'
+
+# ground control points; pixel and line are 0-based, inactive GCPs are switched off in PARGE
+gcp_dtype = np.dtype([('pixel', '<i4'), ('line', '<i4'), ('easting', '<f8'), ('northing', '<f8'),
+                      ('elevation', '<f8'), ('active', '?')])
+
+# position (UTM, m) and attitude (degrees) of the scan lines
+line_dtype = np.dtype([('easting', '<f8'), ('northing', '<f8'), ('elevation', '<f8'),
+                       ('roll', '<f8'), ('pitch', '<f8'), ('heading', '<f8')])
+
+# roll, pitch and heading offsets evaluated at a time in grid_search, per worker task
+grid_chunk = 4096
+
+
+class GCPSet:
+    """Ground control points, scan line positions and attitude, and sensor model of a PARGE status"""
+
+    def __init__(self, gcps: np.ndarray, lines: np.ndarray, vinkelx: np.ndarray, vinkely: np.ndarray,
+                 name: str = '', coord: str = ''):
+        self.gcps = gcps
+        self.lines = lines
+        self.vinkelx = vinkelx
+        self.vinkely = vinkely
+        self.name = name
+        self.coord = coord
+
+    def __len__(self):
+        return len(self.gcps)
+
+    def __repr__(self):
+        return (f"GCPSet({self.name!r}, {len(self)} GCPs ({self.gcps['active'].sum()} active), "
+                f"{len(self.lines)} lines x {len(self.vinkelx)} pixels)")
+
+    def active(self) -> 'GCPSet':
+        """The same set with the active GCPs only"""
+        return GCPSet(self.gcps[self.gcps['active']], self.lines, self.vinkelx, self.vinkely, self.name, self.coord)
+
+    def with_nav(self, navdata: np.ndarray) -> 'GCPSet':
+        """
+        The same set with the roll, pitch and heading of NAV data (navfile.nav_dtype,
+        one row per scan line, e.g. from navfile.read_nav) instead of the attitude in
+        the .gcs file. The positions are kept.
+        """
+        if len(navdata) != len(self.lines):
+            raise ValueError(f"NAV data has {len(navdata)} lines, the GCP set {len(self.lines)}")
+        lines = self.lines.copy()
+        for name in ('roll', 'pitch', 'heading'):
+            lines[name] = navdata[name]
+        return GCPSet(self.gcps, lines, self.vinkelx, self.vinkely, self.name, self.coord)
+
+    def with_sensormodel(self, fp) -> 'GCPSet':
+        """The same set with the view angles of a sensor model file (sensormodel/*_FOVexp*.txt)"""
+        vinkelx, vinkely = geometry.read_sensormodel(fp)
+        if len(vinkelx) != len(self.vinkelx):
+            raise ValueError(f"{Path(fp).name} has {len(vinkelx)} pixels, the GCP set {len(self.vinkelx)}")
+        return GCPSet(self.gcps, self.lines, vinkelx, vinkely, self.name, self.coord)
+
+
+def _text(value) -> str:
+    return value.decode('latin-1') if isinstance(value, bytes) else str(value)
+
+
+def read_gcs(fp) -> GCPSet:
+    """
+    Take path of a PARGE .gcs file, return its GCPSet. GCP rows with
+    pixel and line 0 (PARGE's placeholder when no GCPs are set) are dropped.
+    """
+    status = readsav(str(fp))
+    table = np.atleast_2d(status['gcparr'])
+    table = table[(table[:, 0] != 0) | (table[:, 1] != 0)]
+    gcps = np.empty(len(table), dtype=gcp_dtype)
+    for idx, name in enumerate(gcp_dtype.names):
+        gcps[name] = table[:, idx]
+    lines = np.empty(len(status['navarr']), dtype=line_dtype)
+    for idx, name in enumerate(('easting', 'northing', 'elevation')):
+        lines[name] = status['navarr'][:, idx]
+    for name, key in (('roll', 'rollarr'), ('pitch', 'pitcharr'), ('heading', 'headarr')):
+        lines[name] = np.degrees(status[key][:, 0])
+    sensarr = status['sensarr']
+    return GCPSet(gcps, lines, sensarr[:, 1].copy(), sensarr[:, 2].copy(),
+                  name=Path(_text(status['image'][0]['NAME']).replace('\\', '/')).name,
+                  coord=_text(status['result'][0]['COORD']))
+
+
+def ground_points(gcpset: GCPSet, offsets=(0.0, 0.0, 0.0)) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Easting and northing where the rays of the GCP pixels meet the plane at
+    the GCP elevation, for roll, pitch and heading offsets of shape (..., 3).
+    Returns two arrays of shape (..., GCPs): all offsets in one evaluation.
+    """
+    offsets = np.asarray(offsets, dtype=float)[..., np.newaxis, :]
+    gcps, lines = gcpset.gcps, gcpset.lines[gcpset.gcps['line']]
+    rotations = geometry.nav_attitude_matrices(lines['roll'] + offsets[..., 0], lines['pitch'] + offsets[..., 1],
+                                               lines['heading'] + offsets[..., 2])
+    vectors = geometry.sensor_look_vectors(gcpset.vinkelx[gcps['pixel']], gcpset.vinkely[gcps['pixel']])
+    north, east, down = np.moveaxis(np.einsum('...ij,...j->...i', rotations, vectors), -1, 0)
+    distance = (lines['elevation'] - gcps['elevation']) / down
+    return lines['easting'] + distance * east, lines['northing'] + distance * north
+
+
+def residuals(gcpset: GCPSet, offsets=(0.0, 0.0, 0.0)) -> np.ndarray:
+    """Easting and northing residuals (m), shape (..., GCPs, 2), for offsets of shape (..., 3)"""
+    easting, northing = ground_points(gcpset, offsets)
+    return np.stack([easting - gcpset.gcps['easting'], northing - gcpset.gcps['northing']], axis=-1)
+
+
+def rms_error(gcpset: GCPSet, offsets=(0.0, 0.0, 0.0)) -> np.ndarray:
+    """Root mean square distance (m) of the ground points to the GCPs, shape (...) for offsets (..., 3)"""
+    return np.sqrt((residuals(gcpset, offsets) ** 2).sum(axis=-1).mean(axis=-1))
+
+
+def fit_offsets(gcpset: GCPSet, start=(0.0, 0.0, 0.0), iterations: int = 20, tolerance: float = 1e-6,
+                step: float = 1e-4) -> Tuple[np.ndarray, float]:
+    """
+    Least-squares roll, pitch and heading offsets (Gauss-Newton). The offsets
+    and the forward differences of the Jacobian are evaluated in one call of
+    residuals per iteration. Returns the offsets and their RMS error (m).
+    """
+    offsets = np.asarray(start, dtype=float)
+    trials = np.vstack([np.zeros(3), np.eye(3) * step])
+    for _ in range(iterations):
+        values = residuals(gcpset, offsets + trials).reshape(4, -1)
+        jacobian = ((values[1:] - values[0]) / step).T
+        update = np.linalg.lstsq(jacobian, -values[0], rcond=None)[0]
+        offsets = offsets + update
+        if np.abs(update).max() < tolerance:
+            break
+    return offsets, float(rms_error(gcpset, offsets))
+
+
+def offset_grid(roll: Sequence[float], pitch: Sequence[float], heading: Sequence[float]) -> np.ndarray:
+    """All combinations of the roll, pitch and heading offsets, shape (roll, pitch, heading, 3)"""
+    return np.stack(np.meshgrid(roll, pitch, heading, indexing='ij'), axis=-1)
+
+
+def _grid_rms(args):
+    return rms_error(*args)
+
+
+def grid_search(gcpset: GCPSet, roll: Sequence[float], pitch: Sequence[float], heading: Sequence[float],
+                workers: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    RMS error (m) of all combinations of the roll, pitch and heading offsets,
+    evaluated grid_chunk combinations at a time in a process pool (workers=1:
+    in this process). Returns the RMS array (roll, pitch, heading) and the
+    offsets with the smallest RMS.
+    """
+    grid = offset_grid(roll, pitch, heading)
+    candidates = grid.reshape(-1, 3)
+    chunks = [(gcpset, candidates[start:start + grid_chunk]) for start in range(0, len(candidates), grid_chunk)]
+    if workers == 1:
+        values = [_grid_rms(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            values = list(pool.map(_grid_rms, chunks))
+    rms = np.concatenate(values).reshape(grid.shape[:-1])
+    return rms, grid[np.unravel_index(np.argmin(rms), rms.shape)]
+
+
+def load_gcpset(fp, navpath=None, sensormodelpath=None, active_only: bool = True,
+                swaplatlon: bool = False) -> GCPSet:
+    """
+    read_gcs, optionally with the attitude of a NAV file and the view angles
+    of a sensor model file, with the active GCPs only unless active_only is False
+    """
+    gcpset = read_gcs(fp)
+    if navpath is not None:
+        gcpset = gcpset.with_nav(navfile.read_nav(navpath, swaplatlon=swaplatlon))
+    if sensormodelpath is not None:
+        gcpset = gcpset.with_sensormodel(sensormodelpath)
+    return gcpset.active() if active_only else gcpset
+
+
+def evaluate_gcs(fp, navpath=None, sensormodelpath=None, active_only: bool = True, swaplatlon: bool = False) -> dict:
+    """
+    Fit the boresight offsets to the GCPs of a .gcs file (see load_gcpset).
+    Returns a dict with the GCP count, RMS error without offsets, fitted
+    offsets and RMS error with them; NaN with fewer than 3 GCPs.
+    """
+    gcpset = load_gcpset(fp, navpath, sensormodelpath, active_only, swaplatlon)
+    result = {'file': Path(fp).name, 'image': gcpset.name, 'gcps': len(gcpset)}
+    if len(gcpset) < 3:
+        return {**result, 'rms_initial': np.nan, 'roll': np.nan, 'pitch': np.nan, 'heading': np.nan, 'rms': np.nan}
+    offsets, rms = fit_offsets(gcpset)
+    return {**result, 'rms_initial': float(rms_error(gcpset)),
+            'roll': float(offsets[0]), 'pitch': float(offsets[1]), 'heading': float(offsets[2]), 'rms': rms}
+
+
+def _evaluate_gcs(args):
+    return evaluate_gcs(*args[:3], **args[3])
+
+
+def evaluate_campaigns(gcspaths, navpaths=None, sensormodelpaths=None, workers: Optional[int] = None,
+                       **kwargs) -> list:
+    """Run evaluate_gcs for many .gcs files in a process pool, one file per worker"""
+    navpaths = navpaths or [None] * len(gcspaths)
+    sensormodelpaths = sensormodelpaths or [None] * len(gcspaths)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_evaluate_gcs, [(fp, nav, model, kwargs) for fp, nav, model
+                                             in zip(gcspaths, navpaths, sensormodelpaths)]))
@@ -0,0 +1,221 @@
+# code for the catalog of the flightlines of all campaigns (see notebook DM01)
+#
+# The catalog is a GeoPackage layer with one row per flightline. Each campaign's rows carry the fingerprint
+# of the flightline file they were read from, so an update only re-reads the campaigns whose file changed:
+# their rows are deleted and appended again, all other rows stay as they are. The layer has the GeoPackage
+# R-tree on the geometry plus indexes on date, kind and label. CSV and Shapefile exports are derived from it.
+
+from pathlib import Path
+import datetime as dt
+import hashlib
+import json
+import sqlite3
+
+import geopandas as gp
+import pandas as pd
+
+catalog_layer = 'flightlines'
+catalog_columns = ['label', 'FlightlineID', 'year', 'month', 'date', 'total lines', 'kind', 'source', 'fingerprint']
+indexed_columns = ['date', 'kind', 'label']
+export_drivers = {'.csv': 'CSV', '.shp': 'ESRI Shapefile', '.gpkg': 'GPKG'}
+
+# flightline file of the campaigns up to 2021, relative to the base folder (formerly the subdirs list of DM01)
+campaign_files = {
+    '20190811_CalFlight': '20190811_CalFlight/00_aux/GIS/Flightline/20190811_CalFlight.shp',
+    '20190817_CPC': '20190817_CPC/00_aux/GIS/Flightline/20190817-CPC_useable.shp',
+    '20190826_BC': '20190826_BC/00_aux/GIS/Flightline/20190826-BC_useable.shp',
+    '20200522_Calflight': '20200522_Calflight/00_aux/GIS/Flightline/20200522-cal.shp',
+    '20200625_Calflight': '20200625_Calflight/00_aux/GIS/Flightline/20200625cal.shp',
+    '20200607_ClearCreekFire': '20200607_ClearCreekFire/00_aux/GIS/Flightline/test0607.shp',
+    '20200710_CPC': '20200710_CPC/00_aux/GIS/Flightline/20200710-CPC.shp',
+    '20200714_MKB': '20200714_MKB/00_aux/GIS/Flightline/20200714-MKB.shp',
+    '20200814_SC': '20200814_SC/00_aux/GIS/Flightline/20200814-SC.shp',
+    '20200830_BC': '20200830_BC/00_aux/GIS/Flightline/20200830-BC.shp',
+    '20200912_Calflight': '20200912_Calflight/00_aux/GIS/Flightline/20200912-PFCAL.shp',
+    '20210623': '20210623/00_aux/GIS/Flightline/20210623.shp',
+    '20210803_BC': '20210803_BC/00_aux/GIS/Flightline/20210803-BC.shp',
+    '20210802_Calflight': '20210802_Calflight/00_aux/GIS/Flightline/20210802-CAL.shp',
+    '20210828_KN': '20210828_KN/00_aux/GIS/Flightline/20210828-KN.shp',
+    '20210702-FX': '20210702-FX/00_aux/GIS/Flightline/20210702-FX.shp',
+    '20210914_MC': '20210914_MC/00_aux/GIS/Flightline/20210914-MC.shp',
+    '20210911_DC': '20210911_DC/00_aux/GIS/Flightline/20210911-DC.shp',
+}
+
+# Shapefile parts, removed before a Shapefile export
+shapefile_suffixes = ('.shp', '.shx', '.dbf', '.prj', '.cpg', '.qix', '.sbn', '.sbx')
+
+# purpose of the campaigns up to 2021 (formerly the purposes list of DM01); others default to 'unknown'
+campaign_kinds = {
+    '20190811_CalFlight': 'calibration',
+    '20190817_CPC': 'wildfire fuels',
+    '20190826_BC': 'wildfire fuels',
+    '20200522_Calflight': 'calibration',
+    '20200625_Calflight': 'calibration',
+    '20200607_ClearCreekFire': 'active fire',
+    '20200710_CPC': 'wildfire fuels',
+    '20200714_MKB': 'burn severity',
+    '20200814_SC': 'burn severity',
+    '20200830_BC': 'wildfire fuels',
+    '20200912_Calflight': 'calibration',
+    '20210623': 'active fire',
+    '20210803_BC': 'wildfire fuels',
+    '20210802_Calflight': 'calibration',
+    '20210828_KN': 'vegetation recovery',
+    '20210702-FX': 'active fire',
+    '20210914_MC': 'active fire',
+    '20210911_DC': 'active fire',
+}
+
+
+def find_campaign_files(basedir, files=None, flightlinedirstr='00_aux/GIS/Flightline'):
+    """
+    Flightline file of each campaign folder under basedir, keyed by folder
+    name. files maps campaign labels to their flightline file relative to
+    basedir (default: campaign_files). For other campaign folders, the
+    flightline folder is searched for a *useable* Shapefile, otherwise the
+    most recently modified Shapefile is used. GeoPackages are not picked:
+    the only ones there are the {prefix}.gpkg files of nav_to_gis.py.
+    """
+    files = campaign_files if files is None else files
+    campaigns = {}
+    for flightlinedir in sorted(Path(basedir).glob(f"*/{flightlinedirstr}")):
+        label = flightlinedir.parents[2].name
+        if label in files:
+            if (Path(basedir) / files[label]).exists():
+                campaigns[label] = Path(basedir) / files[label]
+            continue
+        candidates = [fp for fp in flightlinedir.iterdir() if fp.suffix.lower() == '.shp']
+        if candidates:
+            candidates.sort(key=lambda fp: ('useable' in fp.stem, fp.stat().st_mtime_ns))
+            campaigns[label] = candidates[-1]
+    return campaigns
+
+
+def fingerprint(fp):
+    """Fingerprint of a Shapefile or GeoPackage: path, size and modification time of all its files"""
+    fp = Path(fp)
+    parts = [fp.with_suffix(suffix) for suffix in shapefile_suffixes] if fp.suffix.lower() == '.shp' else [fp]
+    parts = [part for part in parts if part.exists()]
+    stats = [(part.name, part.stat().st_size, part.stat().st_mtime_ns) for part in parts]
+    return hashlib.sha1(repr((str(fp), stats)).encode('utf-8')).hexdigest()
+
+
+def read_campaign(label, fp, kind='unknown'):
+    """Flightlines of one campaign with the catalog columns, in WGS84"""
+    gdf = gp.read_file(fp)
+    gdf = gdf.to_crs("EPSG:4326") if gdf.crs is not None else gdf.set_crs("EPSG:4326")
+    flightlineids = gdf['FID'] if 'FID' in gdf.columns else range(len(gdf))
+    campaign = gp.GeoDataFrame({
+        'label': label, 'FlightlineID': list(flightlineids), 'year': int(label[:4]), 'month': int(label[4:6]),
+        'date': f"{label[:4]}-{label[4:6]}-{label[6:8]}", 'total lines': len(gdf), 'kind': kind,
+        'source': str(fp), 'fingerprint': fingerprint(fp)}, geometry=list(gdf.geometry), crs="EPSG:4326")
+    return campaign[catalog_columns + ['geometry']]
+
+
+def catalog_fingerprints(catalogpath):
+    """Fingerprint of each campaign in the catalog, read without the geometries"""
+    if not Path(catalogpath).exists():
+        return {}
+    with sqlite3.connect(str(catalogpath)) as con:
+        return dict(con.execute(f'SELECT label, fingerprint FROM "{catalog_layer}" GROUP BY label'))
+
+
+def update_catalog(basedir, catalogpath, kinds=None, rebuild=False, files=None):
+    """
+    Bring the catalog up to date with the campaign folders under basedir:
+    campaigns that are new or whose flightline file changed are (re)read,
+    campaigns that are gone are removed. kinds maps campaign labels to their
+    kind (default: campaign_kinds), files to their flightline file (see
+    find_campaign_files). Returns the labels read, and removed.
+    """
+    kinds = campaign_kinds if kinds is None else kinds
+    catalogpath = Path(catalogpath)
+    if rebuild and catalogpath.exists():
+        catalogpath.unlink()
+    campaigns = find_campaign_files(basedir, files)
+    stored = catalog_fingerprints(catalogpath)
+    changed = [label for label, fp in campaigns.items() if stored.get(label) != fingerprint(fp)]
+    removed = [label for label in stored if label not in campaigns]
+    stale = [label for label in changed + removed if label in stored]
+    if stale:
+        # the R-tree is kept up to date by the GeoPackage delete trigger
+        with sqlite3.connect(str(catalogpath)) as con:
+            con.execute(f'DELETE FROM "{catalog_layer}" WHERE label IN ({",".join("?" * len(stale))})', stale)
+    if changed:
+        new = gp.GeoDataFrame(
+            pd.concat([read_campaign(label, campaigns[label], kinds.get(label, 'unknown')) for label in changed],
+                         ignore_index=True), crs="EPSG:4326")
+        new.to_file(catalogpath, layer=catalog_layer, driver='GPKG', mode='a' if catalogpath.exists() else 'w')
+    if catalogpath.exists():
+        with sqlite3.connect(str(catalogpath)) as con:
+            for column in indexed_columns:
+                con.execute(f'CREATE INDEX IF NOT EXISTS "{catalog_layer}_{column}" '
+                            f'ON "{catalog_layer}" ("{column}")')
+    return changed, removed
+
+
+def _iso_date(value) -> str:
+    """A date (YYYY-MM-DD string or datetime.date) as YYYY-MM-DD, raising ValueError for anything else"""
+    if isinstance(value, dt.date):
+        return value.strftime('%Y-%m-%d')
+    return dt.datetime.strptime(str(value), '%Y-%m-%d').strftime('%Y-%m-%d')
+
+
+def query_catalog(catalogpath, bbox=None, start=None, end=None, kinds=None):
+    """
+    Flightlines of the catalog within a bounding box (minx, miny, maxx, maxy
+    in WGS84), from a start date and/or up to an end date (YYYY-MM-DD,
+    inclusive) and of the given kinds. The box and date filters run in the
+    GeoPackage on its spatial and date indexes, the dates parsed first;
+    the kinds are compared after reading.
+    """
+    bbox = None if bbox is None else tuple(bbox)
+    conditions = []
+    if start is not None:
+        conditions.append(f"date >= '{_iso_date(start)}'")
+    if end is not None:
+        conditions.append(f"date <= '{_iso_date(end)}'")
+    if conditions:
+        flightlines = gp.read_file(catalogpath, layer=catalog_layer, bbox=bbox, where=' AND '.join(conditions))
+    else:
+        flightlines = gp.read_file(catalogpath, layer=catalog_layer, bbox=bbox)
+    if kinds is not None:
+        flightlines = flightlines[flightlines['kind'].isin([str(kind) for kind in kinds])]
+    return flightlines
+
+
+def export_catalog(catalogpath, outpath):
+    """
+    Write the whole catalog to a CSV (geometry as WKT), Shapefile or
+    GeoPackage, by file extension, replacing an earlier export. Only the
+    output file (for a Shapefile, its parts) is replaced; the catalog
+    itself cannot be the output.
+    """
+    outpath = Path(outpath)
+    if outpath.resolve() == Path(catalogpath).resolve():
+        raise ValueError(f"Cannot export the catalog {catalogpath} to itself")
+    driver = export_drivers[outpath.suffix.lower()]
+    catalog = gp.read_file(catalogpath, layer=catalog_layer)
+    parts = [outpath.with_suffix(suffix) for suffix in shapefile_suffixes] if driver == 'ESRI Shapefile' \
+        else [outpath]
+    for part in parts:
+        if part.exists():
+            part.unlink()
+    options = {'GEOMETRY': 'AS_WKT'} if driver == 'CSV' else {}
+    catalog.to_file(outpath, driver=driver, **options)
+    return outpath
+
+
+def read_kinds(fp):
+    """Campaign kinds from a JSON file mapping labels to kinds, on top of campaign_kinds"""
+    with open(fp) as src:
+        return dict(campaign_kinds, **json.load(src))
+
+
+def read_files(fp):
+    """
+    Campaign flightline files from a JSON file mapping labels to paths
+    relative to the base folder, on top of campaign_files
+    """
+    with open(fp) as src:
+        return dict(campaign_files, **json.load(src))
@@ -0,0 +1,94 @@
+# code for cropping the swath edges of flightline rasters (notebook 05)
+# (command line: scripts/crop_flightlines.py)
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import os
+
+import numpy as np
+import rasterio as rio
+from rasterio.windows import Window
+
+import masking as msk
+
+_src = None
+
+
+def getcropbounds(refband, lprop=0.0, rprop=0.0):
+    """
+    Per-row left and right crop index from a reference band, as croprow
+    computes them. Rows with only nodata are left uncropped.
+    """
+    lidx, ridx, valid = msk.getarraybounds(refband, lprop=lprop, rprop=rprop)
+    lidx[~valid] = 0
+    ridx[~valid] = refband.shape[1]
+    return lidx, ridx
+
+
+def cropblock(data, lidx, ridx, nodataval=0):
+    """
+    Crop a (bands, rows, cols) block in place, with lidx and ridx the bounds
+    for its rows. Same result as croprow on every row of every band.
+    """
+    cols = np.arange(data.shape[-1])
+    outside = (cols < lidx[:, np.newaxis]) | (cols >= ridx[:, np.newaxis])
+    data[:, outside] = nodataval
+    return data
+
+
+def _initworker(path):
+    global _src
+    _src = rio.open(path)
+
+
+def _cropwindow(window, lidx, ridx, nodataval):
+    data = _src.read(window=window)
+    return window, cropblock(data, lidx, ridx, nodataval)
+
+
+def cropflightline(inpath, outpath, lprop=0.0, rprop=0.0, refband=1,
+                   blocklines=256, workers=None, nodataval=0, inflight=2):
+    """
+    Crop all bands of a flightline with the row bounds of one reference
+    band. Blocks of blocklines lines (all bands) are read and cropped in
+    a process pool; this process is the only writer. At most inflight
+    blocks per worker are submitted ahead of the one being written, so
+    memory stays bounded when writing is slower than cropping.
+    """
+    with rio.open(inpath) as src:
+        profile = src.profile
+        lidx, ridx = getcropbounds(src.read(refband), lprop, rprop)
+        height, width = src.height, src.width
+    windows = deque(Window(0, row, width, min(blocklines, height - row))
+                    for row in range(0, height, blocklines))
+    maxpending = inflight * (workers or os.cpu_count() or 1)
+    with rio.open(outpath, 'w', **profile) as dst:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_initworker,
+                                 initargs=(str(inpath),)) as pool:
+            pending = deque()
+            while windows or pending:
+                while windows and len(pending) < maxpending:
+                    win = windows.popleft()
+                    pending.append(pool.submit(_cropwindow, win, lidx[win.row_off:win.row_off + win.height],
+                                               ridx[win.row_off:win.row_off + win.height], nodataval))
+                window, data = pending.popleft().result()
+                dst.write(data, window=window)
+    return outpath
+
+
+def cropflightlines(inpaths, outdir=None, lprop=0.0, rprop=0.0, outprefix="Clip_", **kwargs):
+    """
+    Crop a series of flightlines. As flight direction usually alternates
+    from line to line, lprop and rprop are swapped after each flightline.
+    """
+    outpaths = []
+    for inpath in inpaths:
+        inpath = Path(inpath)
+        outpath = Path(outdir or inpath.parent) / f"{outprefix}{inpath.name}"
+        print(f"Cropping {inpath} to {outpath} (lprop={lprop}, rprop={rprop})")
+        outpaths.append(cropflightline(inpath, outpath, lprop, rprop, **kwargs))
+        lprop, rprop = rprop, lprop
+        print(f"Done with {inpath}")
+    return outpaths
+
@@ -0,0 +1,318 @@
+# code for finding and preparing the DEM tiles for a campaign (see notebook 04)
+#
+# The tile index is a GeoPackage with one footprint polygon per GeoTIFF tile, built from the Shapefiles
+# that come with the tiles. Both tile layouts of notebook 04 are supported:
+#   case 1 (EarthExplorer): one folder per tile with one GeoTIFF and one Shapefile with its outline
+#   case 2 (The National Map): several GeoTIFFs per folder and a gdaltindex Shapefile, one feature per
+#          GeoTIFF with the file name in the 'location' attribute
+#
+# The main DEM is reprojected from a virtual mosaic of the selected tiles to the target CRS at the tile
+# resolution, cropped, and resampled to the target resolution one block of rows at a time, on the grid of
+# notebook 04 but without intermediate files or an in-memory copy of the cropped mosaic. The flightline DEMs (notebook 04a)
+# are cut from the memory-mapped main DEM on its pixel grid.
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from xml.sax.saxutils import escape
+import json
+import math
+import os
+
+import geopandas as gp
+import numpy as np
+import pandas as pd
+import rasterio as rio
+from rasterio.enums import Resampling
+from rasterio.features import geometry_window
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import calculate_default_transform
+from rasterio.windows import Window, WindowError, from_bounds
+from rasterio.windows import transform as window_transform
+from shapely.geometry import LineString
+from shapely.ops import unary_union
+
+import envicube
+import instrumentation
+import navfile
+
+tile_index_name = 'DEM_tile_index.gpkg'
+tile_index_layer = 'tiles'
+tile_index_crs = "EPSG:3338"
+
+resampling_methods = ('nearest', 'bilinear', 'cubic')
+gdal_type_names = {'uint8': 'Byte', 'int16': 'Int16', 'uint16': 'UInt16', 'int32': 'Int32', 'uint32': 'UInt32',
+                   'float32': 'Float32', 'float64': 'Float64'}
+
+
+def find_tile_shapefiles(tilesdir):
+    """All Shapefiles in the tile tree, with their modification time (ns)"""
+    shapefiles = {}
+    for folder, _, filelist in os.walk(tilesdir):
+        for filename in filelist:
+            if filename.lower().endswith('.shp'):
+                shpfile = os.path.join(folder, filename)
+                shapefiles[shpfile] = os.stat(shpfile).st_mtime_ns
+    return shapefiles
+
+
+def read_tile_footprints(shpfile, mtime=None):
+    """
+    Tile footprints from one Shapefile, reprojected to tile_index_crs, with
+    the GeoTIFF path, the tile ID used in the DEM metadata, the Shapefile and
+    its modification time. Empty if the folder of a case 1 Shapefile has no
+    GeoTIFF.
+    """
+    folder = os.path.dirname(shpfile)
+    gdf = gp.read_file(shpfile)
+    if 'location' in gdf.columns:
+        tiffiles = [os.path.join(folder, location) for location in gdf['location']]
+        tileids = ['IFSAR_' + os.path.basename(location) for location in gdf['location']]
+        geometry = list(gdf.geometry)
+    else:
+        tiffiles = sorted(str(fp) for fp in Path(folder).glob("*.tif"))[:1]
+        tileids = [os.path.basename(folder)] * len(tiffiles)
+        geometry = [unary_union(list(gdf.geometry))] * len(tiffiles)
+    footprints = gp.GeoDataFrame(
+        {'tiffile': tiffiles, 'tile_id': tileids, 'shpfile': shpfile,
+         'shp_mtime': os.stat(shpfile).st_mtime_ns if mtime is None else mtime},
+        geometry=geometry, crs=gdf.crs)
+    return footprints.to_crs(tile_index_crs)
+
+
+def load_tile_index(indexpath):
+    return gp.read_file(indexpath, layer=tile_index_layer)
+
+
+def update_tile_index(tilesdir, indexpath=None, rebuild=False):
+    """
+    Build the tile index of a tile tree, or bring an existing one up to date:
+    only Shapefiles that are new or were modified since the last update are
+    read, and tiles of deleted Shapefiles are dropped. The index defaults to
+    DEM_tile_index.gpkg in the tile folder. Returns the index GeoDataFrame.
+    """
+    indexpath = Path(tilesdir) / tile_index_name if indexpath is None else Path(indexpath)
+    shapefiles = find_tile_shapefiles(tilesdir)
+    index = None if rebuild or not indexpath.exists() else load_tile_index(indexpath)
+    if index is not None:
+        current = index['shp_mtime'] == index['shpfile'].map(shapefiles)
+        unchanged = set(index.loc[current, 'shpfile'])
+        if current.all() and unchanged == set(shapefiles):
+            return index
+        index = index[current]
+    else:
+        unchanged = set()
+    footprints = [read_tile_footprints(shpfile, mtime) for shpfile, mtime in sorted(shapefiles.items())
+                  if shpfile not in unchanged]
+    if index is not None:
+        footprints.insert(0, index)
+    if footprints:
+        index = gp.GeoDataFrame(pd.concat(footprints, ignore_index=True), crs=tile_index_crs)
+    else:
+        index = gp.GeoDataFrame({'tiffile': [], 'tile_id': [], 'shpfile': [], 'shp_mtime': []},
+                                geometry=[], crs=tile_index_crs)
+    # the index is small, so it is rewritten as a whole (GeoPackages carry an R-tree on the footprints)
+    index.to_file(indexpath, layer=tile_index_layer, driver='GPKG')
+    return index
+
+
+def query_tiles(index, enclosure):
+    """
+    Tiles of the index whose footprint intersects the enclosure, a shapely
+    geometry in tile_index_crs or a GeoSeries/GeoDataFrame in any CRS. The
+    index is a GeoDataFrame from update_tile_index or load_tile_index, or
+    the path of an index file; the query uses its STRtree spatial index.
+    """
+    if not isinstance(index, gp.GeoDataFrame):
+        index = load_tile_index(index)
+    if isinstance(enclosure, (gp.GeoSeries, gp.GeoDataFrame)):
+        enclosure = unary_union(list(enclosure.to_crs(index.crs).geometry))
+    hits = index.sindex.query(enclosure, predicate='intersects')
+    return index.iloc[sorted(hits)]
+
+
+def tile_id_string(tiles):
+    """DEM_tile_IDs metadata string for the tiles returned by query_tiles"""
+    return ','.join(tiles['tile_id'])
+
+
+def flightline_enclosure(flightlinedf, buffer=500, margin=1000):
+    """
+    Rectangular enclosure (GeoSeries in EPSG:3338) of the flightlines,
+    buffered by buffer and then by margin, as in notebook 04
+    """
+    flightlinebuffer = flightlinedf.to_crs("EPSG:3338").buffer(buffer)
+    return gp.GeoSeries([unary_union(list(flightlinebuffer.buffer(margin))).envelope], crs="EPSG:3338")
+
+
+def mosaic_vrt(tiffiles):
+    """
+    VRT XML of a mosaic of single-band tiles, which must share CRS and
+    resolution. Nodata pixels of a tile don't cover the data of its
+    neighbours. rasterio opens the XML string like a file.
+    """
+    tiles = []
+    for tiffile in tiffiles:
+        with rio.open(tiffile) as src:
+            tiles.append((str(tiffile), src.crs, src.res, src.bounds, src.width, src.height, src.dtypes[0],
+                          src.nodata))
+    _, crs, res, _, _, _, dtype, nodata = tiles[0]
+    for tiffile, tilecrs, tileres, *_ in tiles:
+        if tilecrs != crs or not all(math.isclose(a, b) for a, b in zip(tileres, res)):
+            raise ValueError(f"Tile {tiffile} does not have the CRS and resolution of {tiles[0][0]}")
+    left = min(tile[3].left for tile in tiles)
+    top = max(tile[3].top for tile in tiles)
+    width = round((max(tile[3].right for tile in tiles) - left) / res[0])
+    height = round((top - min(tile[3].bottom for tile in tiles)) / res[1])
+    nodataxml = '' if nodata is None else f"<NODATA>{nodata!r}</NODATA>"
+    bandnodataxml = '' if nodata is None else f"<NoDataValue>{nodata!r}</NoDataValue>"
+    sources = ''.join(
+        f'<ComplexSource><SourceFilename relativeToVRT="0">{escape(tiffile)}</SourceFilename>'
+        f'<SourceBand>1</SourceBand>'
+        f'<SrcRect xOff="0" yOff="0" xSize="{tilewidth}" ySize="{tileheight}"/>'
+        f'<DstRect xOff="{round((bounds.left - left) / res[0])}" yOff="{round((top - bounds.top) / res[1])}" '
+        f'xSize="{tilewidth}" ySize="{tileheight}"/>{nodataxml}</ComplexSource>'
+        for tiffile, _, _, bounds, tilewidth, tileheight, _, _ in tiles)
+    return (f'<VRTDataset rasterXSize="{width}" rasterYSize="{height}">'
+            f'<SRS>{escape(crs.to_wkt())}</SRS>'
+            f'<GeoTransform>{left!r}, {res[0]!r}, 0.0, {top!r}, 0.0, {-res[1]!r}</GeoTransform>'
+            f'<VRTRasterBand dataType="{gdal_type_names[dtype]}" band="1">'
+            f'{bandnodataxml}{sources}</VRTRasterBand></VRTDataset>')
+
+
+@instrumentation.instrumented('dem_warp', 'outfn')
+def warp_dem(tiffiles, enclosure, outfn, dst_crs="EPSG:32606", resolution=1.0, resampling='cubic',
+             driver='ENVI', blocklines=1024):
+    """
+    Mosaic the DEM tiles, reproject and crop to the envelope of the enclosure
+    (GeoSeries/GeoDataFrame) in dst_crs at the tile resolution, then resample
+    to resolution (m), and write the result to outfn. Output grid and extent
+    are those of notebook 04: the cropped window of the reprojected mosaic,
+    upsampled by the ratio of the resolutions. Blocks of blocklines output
+    rows are read one at a time from the reprojected mosaic (a WarpedVRT at
+    the tile resolution), so memory use is bounded by the block size.
+    resampling is one of resampling_methods.
+    """
+    if resampling not in resampling_methods:
+        raise ValueError(f"Unknown resampling {resampling}, must be one of {resampling_methods}")
+    with rio.open(mosaic_vrt(tiffiles)) as mosaic:
+        transform, width, height = calculate_default_transform(mosaic.crs, dst_crs, mosaic.width, mosaic.height,
+                                                               *mosaic.bounds, resolution=mosaic.res[0])
+        factor = mosaic.res[0] / resolution
+        with WarpedVRT(mosaic, crs=dst_crs, transform=transform, width=width, height=height,
+                       resampling=Resampling[resampling], nodata=mosaic.nodata) as vrt:
+            window = geometry_window(vrt, list(enclosure.to_crs(dst_crs).envelope))
+            crop_transform = vrt.window_transform(window)
+            width, height = int(window.width * factor), int(window.height * factor)
+            profile = {'driver': driver, 'width': width, 'height': height, 'count': 1, 'dtype': vrt.dtypes[0],
+                       'crs': dst_crs, 'nodata': vrt.nodata,
+                       'transform': crop_transform * crop_transform.scale(window.width / width,
+                                                                          window.height / height)}
+            with rio.open(outfn, 'w', **profile) as dst:
+                for row in range(0, height, blocklines):
+                    lines = min(blocklines, height - row)
+                    # fractional source windows at the tile resolution, so the blocks join seamlessly
+                    srcwindow = Window(window.col_off, window.row_off + row / factor, window.width, lines / factor)
+                    dst.write(vrt.read(1, window=srcwindow, out_shape=(lines, width),
+                                       resampling=Resampling[resampling]),
+                              1, window=Window(0, row, width, lines))
+    return outfn
+
+
+def write_dem_meta(meta, demfn):
+    """Write the DEM metadata (author, downsampling, DEM_tile_IDs, ...) to {DEM stem}_meta.txt as JSON"""
+    outfn = Path(demfn).with_name(f"{Path(demfn).stem}_meta.txt")
+    with open(outfn, "w") as dst:
+        json.dump(meta, dst, indent=2)
+    return outfn
+
+
+def flightline_geometries(projectdir, prefix, shpfile=None, namefield=None,
+                          navfilepattern="_VNIR_1800_SN00812_FOVx2_raw.txt", navdirstr='NAV', step=10):
+    """
+    Track of each flightline {prefix}_?? of a project folder, as a GeoSeries
+    indexed by flightline folder name. With a flightline Shapefile and the
+    name of a field holding the flightline name or number, the Shapefile
+    features are used; otherwise (the Shapefile of notebook 02 has no line
+    names) every step-th position of the NAV file, as in notebook 02.
+    """
+    linedirs = sorted(Path(projectdir).glob(f"{prefix}_??"))
+    if shpfile is not None and namefield is not None:
+        gdf = gp.read_file(shpfile)
+        names = [f"{prefix}_{str(value)[-2:].zfill(2)}" for value in gdf[namefield]]
+        linenames = {linedir.name for linedir in linedirs}
+        keep = [name in linenames for name in names]
+        return gp.GeoSeries(list(gdf.geometry[keep]), index=[name for name in names if name in linenames],
+                            crs=gdf.crs)
+    tracks = {}
+    for linedir in linedirs:
+        navpath = linedir / navdirstr / f"{linedir.name}{navfilepattern}"
+        if navpath.exists():
+            tracks[linedir.name] = nav_track(navpath, step)
+    return gp.GeoSeries(list(tracks.values()), index=list(tracks), crs="EPSG:4326")
+
+
+def nav_track(navpath, step=10):
+    """Track of a NAV file as a LineString (WGS84), every step-th valid position as in notebook 02"""
+    navdata = navfile.read_nav(navpath)
+    navdata = navdata[navdata['lat'] > 0][::step]
+    return LineString(np.column_stack([navdata['lon'], navdata['lat']]))
+
+
+def line_windows(maindem, tracks, buffer=500):
+    """
+    Window of the main DEM (open rasterio dataset) for each flightline track,
+    the bounds of the track buffered by buffer (m), on the pixel grid of the
+    main DEM and clipped to it. Tracks outside the main DEM are left out.
+    """
+    full = Window(0, 0, maindem.width, maindem.height)
+    windows = {}
+    for name, geometry in tracks.to_crs(maindem.crs).buffer(buffer).items():
+        window = from_bounds(*geometry.bounds, transform=maindem.transform)
+        col, row = math.floor(window.col_off), math.floor(window.row_off)
+        window = Window(col, row, math.ceil(window.col_off + window.width) - col,
+                        math.ceil(window.row_off + window.height) - row)
+        try:
+            windows[name] = Window(*(int(value) for value in window.intersection(full).flatten()))
+        except WindowError:
+            pass
+    return windows
+
+
+def extract_line_dems(maindemfn, tracks, outpaths, buffer=500, workers=None, meta=None):
+    """
+    Cut the flightline DEMs out of the main DEM for all tracks (see
+    flightline_geometries) and write them as ENVI files to outpaths (a dict
+    keyed like tracks), each with a _meta.txt with the entries of meta plus
+    the main DEM and the window. Lines are written concurrently by threads
+    that share one memmap of the main DEM, so the blocks of overlapping lines
+    are read from disk once. The flightline DEMs are on the grid of the main
+    DEM, no resampling is done. Returns the written paths.
+    """
+    meta = {} if meta is None else meta
+    with rio.open(maindemfn) as maindem:
+        profile = maindem.profile
+        windows = line_windows(maindem, tracks, buffer)
+        transform = maindem.transform
+    cube = envicube.open_cube(maindemfn)
+
+    def extract(name):
+        window = windows[name]
+        if cube is not None:
+            linedem = cube.read(rows=slice(window.row_off, window.row_off + window.height),
+                                cols=slice(window.col_off, window.col_off + window.width))
+        else:
+            with rio.open(maindemfn) as maindem:
+                linedem = maindem.read(window=window)
+        lineprofile = {key: value for key, value in profile.items()
+                       if key not in ('blockxsize', 'blockysize', 'tiled', 'compress', 'interleave')}
+        lineprofile.update(driver='ENVI', width=window.width, height=window.height,
+                           transform=window_transform(window, transform))
+        with rio.open(outpaths[name], 'w', **lineprofile) as dst:
+            dst.write(linedem)
+        write_dem_meta(dict(meta, main_DEM=Path(maindemfn).name, flightline=name, buffer=buffer,
+                            window=[window.col_off, window.row_off, window.width, window.height]), outpaths[name])
+        return outpaths[name]
+
+    # the work is reading and writing, so threads sharing the memmap are enough
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(extract, [name for name in tracks.index if name in windows]))
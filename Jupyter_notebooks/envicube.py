@@ -0,0 +1,117 @@
+# code for reading ENVI cubes (.bsq, .bil, .bip with .hdr) as memory maps
+#
+# The binary file is mapped with np.memmap according to the header, and presented as a (bands, lines,
+# samples) array whatever the interleave. Bands, windows and spectra are views of the map: nothing is read
+# until the values are used, and then only the pages needed, without a copy by GDAL in between.
+
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+
+import metadata
+
+# ENVI data type codes
+envi_data_types = {1: 'u1', 2: 'i2', 3: 'i4', 4: 'f4', 5: 'f8', 6: 'c8', 9: 'c16', 12: 'u2', 13: 'u4',
+                   14: 'i8', 15: 'u8'}
+
+# axes of the file for each interleave, and the transpose that makes them (bands, lines, samples)
+interleave_shapes = {'bsq': ('bands', 'lines', 'samples'), 'bil': ('lines', 'bands', 'samples'),
+                     'bip': ('lines', 'samples', 'bands')}
+interleave_transposes = {'bsq': (0, 1, 2), 'bil': (1, 0, 2), 'bip': (2, 0, 1)}
+
+
+def find_hdr(fp) -> Optional[Path]:
+    """ENVI header of a binary file: <stem>.hdr or <name>.hdr, None if there is neither"""
+    fp = Path(fp)
+    for hdrpath in (fp.with_suffix('.hdr'), fp.with_name(f"{fp.name}.hdr")):
+        if hdrpath.exists():
+            return hdrpath
+    return None
+
+
+class EnviCube:
+    """
+    Memory-mapped ENVI cube. cube is a (bands, lines, samples) view of the
+    file in any interleave; band, window and spectrum return views of it.
+    Band indices are 0-based. Opened read-only unless mode is 'r+'.
+    """
+
+    def __init__(self, fp, hdr_file=None, mode: str = 'r'):
+        self.path = Path(fp)
+        hdr_file = find_hdr(fp) if hdr_file is None else hdr_file
+        if hdr_file is None:
+            raise ValueError(f"No ENVI header for {fp}")
+        self.meta = metadata.read_hdr(hdr_file)
+        self.interleave = self.meta.get('interleave', 'bsq').lower()
+        if self.interleave not in interleave_shapes:
+            raise ValueError(f"Unknown interleave {self.interleave} in {hdr_file}")
+        if self.meta['data type'] not in envi_data_types:
+            raise ValueError(f"Unsupported ENVI data type {self.meta['data type']} in {hdr_file}")
+        self.dtype = np.dtype(envi_data_types[self.meta['data type']]).newbyteorder(
+            '>' if self.meta.get('byte order', 0) else '<')
+        shape = tuple(self.meta[axis] for axis in interleave_shapes[self.interleave])
+        self.data = np.memmap(self.path, dtype=self.dtype, mode=mode, offset=self.meta.get('header offset', 0),
+                              shape=shape)
+        self.cube = self.data.transpose(interleave_transposes[self.interleave])
+
+    @property
+    def shape(self):
+        return self.cube.shape
+
+    @property
+    def bands(self) -> int:
+        return self.cube.shape[0]
+
+    @property
+    def lines(self) -> int:
+        return self.cube.shape[1]
+
+    @property
+    def samples(self) -> int:
+        return self.cube.shape[2]
+
+    @property
+    def nodata(self):
+        return self.meta.get('data ignore value')
+
+    @property
+    def wavelengths(self) -> Optional[np.ndarray]:
+        return self.meta.get('wavelength')
+
+    def band(self, band: int) -> np.ndarray:
+        """(lines, samples) view of one band"""
+        return self.cube[band]
+
+    def window(self, rows: slice, cols: slice = slice(None), bands: Union[slice, int] = slice(None)) -> np.ndarray:
+        """View of a window of lines and samples, for all bands or a band slice"""
+        return self.cube[bands, rows, cols]
+
+    def lines_block(self, start: int, stop: int) -> np.ndarray:
+        """(bands, lines, samples) view of a block of full lines"""
+        return self.cube[:, start:stop]
+
+    def spectrum(self, line: int, sample: int) -> np.ndarray:
+        """(bands,) view of the spectrum of one pixel"""
+        return self.cube[:, line, sample]
+
+    def spectra(self, lines, samples) -> np.ndarray:
+        """
+        (pixels, bands) spectra of many pixels. This is a copy (fancy
+        indexing), read with one pass over the pixels for BIP and BIL.
+        """
+        return self.cube[:, np.asarray(lines), np.asarray(samples)].T
+
+    def read(self, band: Optional[int] = None, rows: slice = slice(None), cols: slice = slice(None),
+             dtype=None) -> np.ndarray:
+        """Copy of one band (or all bands) of a window in native byte order, or as dtype"""
+        view = self.cube[slice(None) if band is None else band, rows, cols]
+        return np.array(view, dtype=self.dtype.newbyteorder('=') if dtype is None else dtype)
+
+
+def open_cube(fp, mode: str = 'r') -> Optional[EnviCube]:
+    """EnviCube for a raw ENVI file, or None if it has no readable ENVI header (e.g. a GeoTIFF)"""
+    try:
+        return EnviCube(fp, mode=mode)
+    except (ValueError, KeyError, OSError):
+        return None
@@ -0,0 +1,173 @@
+# code for per-pixel view geometry and per-scanline solar geometry of flightlines
+# in raw (sensor) geometry, from the NAV files and the sensor model files
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import datetime as dt
+
+import numpy as np
+
+import instrumentation
+import metadata
+import navfile
+import navigation
+
+sensormodel_dir = Path(__file__).resolve().parent.parent / 'sensormodel'
+
+# NAV file name pattern and sensor model files (Husky: cameras installed 180 degrees rotated, see notebook 01)
+sensors = {
+    'VNIR': {'navfilepattern': "_VNIR_1800_SN00812_FOVx2_raw.txt",
+             'rotated': 'sensormodel_VNIR_1800_sn0812_FOVexp_180deg_rotated.txt',
+             'unrotated': 'sensormodel_VNIR_sn0812_FOVexp.txt'},
+    'SWIR': {'navfilepattern': "_SWIR_384me_SN3107_FOVx2_raw.txt",
+             'rotated': 'sensormodel_SWIR_384_sn3107_FOVexp_180deg_rotated.txt',
+             'unrotated': 'sensormodel_SWIR_sn3107_FOVexp.txt'},
+}
+
+view_bands = ['view zenith', 'view azimuth', 'relative azimuth']
+solar_bands = ['sun zenith', 'sun azimuth']
+
+
+def read_sensormodel(fp):
+    """Across-track (vinkelx) and along-track (vinkely) view angle per pixel, radians"""
+    table = np.loadtxt(fp, skiprows=1)
+    return table[:, 1], table[:, 2]
+
+
+def look_vectors(vinkelx, vinkely):
+    """
+    Unit look vectors of the pixels in the sensor frame (x forward, y right,
+    z down), for across-track angles positive to the right
+    """
+    vectors = np.stack([np.tan(vinkely), np.tan(vinkelx), np.ones_like(vinkelx)], axis=-1)
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def attitude_matrices(roll, pitch, heading):
+    """
+    Rotation matrices (n, 3, 3) from the sensor frame to north-east-down,
+    for roll, pitch and heading in degrees (aerospace convention, roll
+    positive right wing down)
+    """
+    phi, theta, psi = (np.radians(np.asarray(angle, dtype=float)) for angle in (roll, pitch, heading))
+    cphi, sphi, ctheta, stheta, cpsi, spsi = np.cos(phi), np.sin(phi), np.cos(theta), np.sin(theta), \
+        np.cos(psi), np.sin(psi)
+    return np.stack([
+        np.stack([ctheta * cpsi, sphi * stheta * cpsi - cphi * spsi, cphi * stheta * cpsi + sphi * spsi], axis=-1),
+        np.stack([ctheta * spsi, sphi * stheta * spsi + cphi * cpsi, cphi * stheta * spsi - sphi * cpsi], axis=-1),
+        np.stack([-stheta, sphi * ctheta, cphi * ctheta], axis=-1)], axis=-2)
+
+
+def sensor_look_vectors(vinkelx, vinkely):
+    """
+    Look vectors (see look_vectors) for the view angles of a sensor model
+    file or PARGE status, whose across-track angles are positive to the left
+    """
+    return look_vectors(-np.asarray(vinkelx), vinkely)
+
+
+def nav_attitude_matrices(roll, pitch, heading):
+    """
+    Rotation matrices (see attitude_matrices) for the attitude of a NAV file
+    or PARGE status, whose roll is positive to the left
+    """
+    return attitude_matrices(-np.asarray(roll, dtype=float), pitch, heading)
+
+
+def view_angles(navblock, vectors):
+    """
+    View zenith and azimuth (degrees, azimuth of the sensor as seen from the
+    ground, clockwise from north) of all pixels of a block of scan lines,
+    as (lines, pixels) arrays, for look vectors from sensor_look_vectors.
+    Boresight offsets are not applied.
+    """
+    rotations = nav_attitude_matrices(navblock['roll'], navblock['pitch'], navblock['heading'])
+    # north, east and down components of the look vectors, each a (lines, 3) @ (3, pixels) product
+    north, east, down = (rotations[:, idx, :] @ vectors.T for idx in range(3))
+    zenith = np.degrees(np.arccos(np.clip(down, -1, 1)))
+    azimuth = np.degrees(np.arctan2(-east, -north)) % 360
+    return zenith, azimuth
+
+
+def _open_output(outstem, shape, dtype, band_names, description):
+    """
+    Output raster (lines, bands, samples): ENVI BIL for float32, .npy for
+    float16, which ENVI has no data type for. Both are written as memmaps.
+    """
+    lines, bands, samples = shape
+    if np.dtype(dtype) == np.float16:
+        return np.lib.format.open_memmap(f"{outstem}.npy", mode='w+', dtype=dtype, shape=shape)
+    metadata.write_hdr(f"{outstem}.hdr", {
+        'description': f"{{{description}}}", 'samples': samples, 'lines': lines, 'bands': bands,
+        'header offset': 0, 'file type': 'ENVI Standard', 'data type': 4, 'interleave': 'bil',
+        'byte order': 0, 'band names': band_names})
+    return np.memmap(f"{outstem}.bil", mode='w+', dtype=np.float32, shape=shape)
+
+
+@instrumentation.instrumented('geometry', 'navpath')
+def write_geometry(navpath, sensormodelpath, outstem, reference, dtype='float32', blocklines=512,
+                   swaplatlon=False):
+    """
+    Write the view geometry (view zenith, view azimuth and relative azimuth
+    to the sun per pixel) and the solar geometry (sun zenith and azimuth per
+    scan line) of a flightline in raw geometry, to {outstem}_view_geometry
+    and {outstem}_solar_geometry. The reference is the UTC acquisition start
+    for the NAV timestamps (see navigation.nav_datetimes). Blocks of
+    blocklines scan lines are computed at a time, so memory use does not
+    grow with the flightline length. Returns the output stems.
+    """
+    navdata = navfile.read_nav(navpath, swaplatlon=swaplatlon)
+    vectors = sensor_look_vectors(*read_sensormodel(sensormodelpath))
+    lines, samples = len(navdata), len(vectors)
+    viewstem, solarstem = f"{outstem}_view_geometry", f"{outstem}_solar_geometry"
+    viewout = _open_output(viewstem, (lines, len(view_bands), samples), dtype, view_bands,
+                           f"View geometry of {Path(navpath).name} in raw geometry, degrees")
+    solarout = _open_output(solarstem, (lines, len(solar_bands), 1), dtype, solar_bands,
+                            f"Solar geometry per scan line of {Path(navpath).name}, degrees")
+    for start in range(0, lines, blocklines):
+        navblock = navdata[start:start + blocklines]
+        sunzenith, sunazimuth = navigation.solar_position(
+            navblock['lat'], navblock['lon'], navigation.nav_datetimes(navblock['timestamp'], reference))
+        zenith, azimuth = view_angles(navblock, vectors)
+        viewout[start:start + len(navblock), 0] = zenith
+        viewout[start:start + len(navblock), 1] = azimuth
+        viewout[start:start + len(navblock), 2] = np.abs((azimuth - sunazimuth[:, np.newaxis] + 180) % 360 - 180)
+        solarout[start:start + len(navblock), 0, 0] = sunzenith
+        solarout[start:start + len(navblock), 1, 0] = sunazimuth
+    viewout.flush()
+    solarout.flush()
+    return viewstem, solarstem
+
+
+def _write_geometry(args):
+    return write_geometry(*args[:4], **args[4])
+
+
+def write_geometries(jobs, workers=None, **kwargs):
+    """
+    Run write_geometry for many flightlines in a process pool, one flightline
+    per worker. jobs are (navpath, sensormodelpath, outstem, reference) tuples.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_write_geometry, [(*job, kwargs) for job in jobs]))
+
+
+def campaign_jobs(projdir, prefix, sensornames=('VNIR', 'SWIR'), rotated=True, navdirstr='NAV',
+                  refdirstr='RAD', reffilepattern="_VNIR_1800_SN00812_FOVx2_raw_rad_bsq_float32.hdr",
+                  utc_offset=8):
+    """
+    write_geometry jobs for all flightlines {prefix}_?? in a project folder;
+    the outputs go to the NAV folder of each line. The acquisition start is
+    read from the reference header as in navigation.summarize_campaign.
+    """
+    jobs = []
+    for linedir in sorted(Path(projdir).glob(f"{prefix}_??")):
+        refmeta = metadata.read_hdr(linedir / refdirstr / f"{linedir.name}{reffilepattern}")
+        reference = metadata.get_acquisition_datetime(refmeta) + dt.timedelta(hours=utc_offset)
+        for name in sensornames:
+            sensor = sensors[name]
+            jobs.append((linedir / navdirstr / f"{linedir.name}{sensor['navfilepattern']}",
+                         sensormodel_dir / sensor['rotated' if rotated else 'unrotated'],
+                         linedir / navdirstr / f"{linedir.name}_{name}", reference))
+    return jobs
+
@@ -0,0 +1,323 @@
+# code for measuring where the time goes in a processing run: wall time, bytes read and written,
+# throughput, peak memory and GDAL block cache use of each stage, per flightline
+#
+# Instrumentation is switched on for a run with session() (the --report and --profile flags of the
+# scripts). It sets environment variables, so the worker processes of the process pools record their
+# stages too: each process appends its stage records to its own JSON lines file in the report folder,
+# and the report merges them. Without a session, stage() and the functions wrapped by instrumented()
+# only look up an environment variable per call.
+#
+# Bytes read and written are the I/O counters of the process: all read and write calls, also the ones
+# served from the file cache. On Linux the bytes fetched from storage are recorded as well; they include
+# the memory-mapped reads of raw ENVI cubes (envicube), which don't go through read calls. Peak RSS is the
+# peak of the stage where the peak can be reset (Linux), otherwise the peak of the process so far. GDAL
+# doesn't count block cache hits, so the cache in use at the end of the stage and its maximum are recorded.
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+import csv
+import datetime as dt
+import functools
+import inspect
+import json
+import os
+import sys
+import tempfile
+import time
+
+report_dir_variable = 'HYSPEX_REPORT_DIR'
+profiler_variable = 'HYSPEX_PROFILER'
+profile_dir_variable = 'HYSPEX_PROFILE_DIR'
+profilers = ('cprofile', 'pyinstrument')
+
+record_fields = ['stage', 'flightline', 'file', 'pid', 'start', 'seconds', 'read_mb', 'written_mb',
+                 'storage_read_mb', 'read_mb_s', 'write_mb_s', 'peak_rss_mb', 'gdal_cache_mb', 'gdal_cache_max_mb',
+                 'error']
+summary_fields = ['stage', 'flightline', 'calls', 'seconds', 'read_mb', 'written_mb', 'storage_read_mb',
+                  'read_mb_s', 'write_mb_s', 'peak_rss_mb']
+
+# the open stages of this process, innermost last
+_open_stages = []
+
+
+def is_enabled() -> bool:
+    """Whether the stages are recorded (inside a session, also in its worker processes)"""
+    return report_dir_variable in os.environ
+
+
+def io_counters() -> Optional[Dict[str, Optional[int]]]:
+    """Bytes read and written by this process so far, and on Linux the bytes fetched from storage"""
+    try:
+        with open('/proc/self/io') as src:
+            values = dict(line.split(': ') for line in src.read().splitlines())
+        return {'read': int(values['rchar']), 'written': int(values['wchar']),
+                'storage_read': int(values['read_bytes'])}
+    except (OSError, KeyError, ValueError):
+        pass
+    try:
+        import psutil
+        counters = psutil.Process().io_counters()
+    except (ImportError, AttributeError):
+        return None
+    return {'read': counters.read_bytes, 'written': counters.write_bytes, 'storage_read': None}
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process in MB (since the last reset_peak_rss on Linux)"""
+    try:
+        # VmHWM can be reset, unlike ru_maxrss
+        with open('/proc/self/status') as src:
+            for line in src:
+                if line.startswith('VmHWM'):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2**20
+    except (ImportError, AttributeError):
+        return None
+
+
+def reset_peak_rss() -> bool:
+    """Reset the peak resident set size to the current one (Linux only), return whether it was reset"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as dst:
+            dst.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def gdal_cache_mb():
+    """GDAL block cache in use and its maximum in MB, if GDAL was imported by the processing code"""
+    gdal = sys.modules.get('osgeo.gdal')
+    if gdal is None:
+        return None, None
+    return gdal.GetCacheUsed() / 2**20, gdal.GetCacheMax() / 2**20
+
+
+def flightline_from_path(fp) -> str:
+    """Flightline name ({prefix}_{NN}) at the start of a file name, or '' if there is none"""
+    parts = Path(fp).stem.split('_')
+    return '_'.join(parts[:2]) if len(parts) > 1 and len(parts[1]) == 2 and parts[1].isdigit() else ''
+
+
+def _difference_mb(after, before, key):
+    if after is None or before is None or after[key] is None:
+        return None
+    return (after[key] - before[key]) / 2**20
+
+
+def _rate(mb, seconds):
+    return None if mb is None or seconds <= 0 else mb / seconds
+
+
+def _start_profiler():
+    profiler = os.environ.get(profiler_variable)
+    if profiler == 'cprofile':
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+    if profiler == 'pyinstrument':
+        from pyinstrument import Profiler
+        profile = Profiler()
+        profile.start()
+        return profile
+    return None
+
+
+def _stop_profiler(profile, label):
+    profile_dir = Path(os.environ.get(profile_dir_variable, 'profiles'))
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    if os.environ.get(profiler_variable) == 'cprofile':
+        profile.disable()
+        profile.dump_stats(str(profile_dir / f"{label}_{os.getpid()}.prof"))
+    else:
+        profile.stop()
+        (profile_dir / f"{label}_{os.getpid()}.html").write_text(profile.output_html())
+
+
+@contextmanager
+def stage(name: str, fp=None, flightline: Optional[str] = None):
+    """
+    Record the code in the with block as a stage of the run, for the flightline of file fp (see
+    flightline_from_path) unless flightline is given. Nested stages are recorded separately. With
+    a profiler (see session), the outermost stage of each process is profiled.
+    """
+    if not is_enabled():
+        yield
+        return
+    if flightline is None:
+        flightline = flightline_from_path(fp) if fp is not None else ''
+    if _open_stages:
+        # the peak of the enclosing stage so far, before it is reset for this one
+        _open_stages[-1]['peak'] = max(_open_stages[-1]['peak'], peak_rss_mb() or 0.0)
+    reset_peak_rss()
+    current = {'peak': 0.0}
+    profile = _start_profiler() if not _open_stages else None
+    _open_stages.append(current)
+    error = ''
+    before, start, started = io_counters(), time.perf_counter(), dt.datetime.now()
+    try:
+        yield
+    except BaseException as err:
+        error = repr(err)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        after = io_counters()
+        _open_stages.pop()
+        peak = max(peak_rss_mb() or 0.0, current['peak'])
+        if _open_stages:
+            _open_stages[-1]['peak'] = max(_open_stages[-1]['peak'], peak)
+        label = f"{name}_{flightline}" if flightline else name
+        if profile is not None:
+            _stop_profiler(profile, label)
+        cache, cachemax = gdal_cache_mb()
+        read, written = _difference_mb(after, before, 'read'), _difference_mb(after, before, 'written')
+        record = {'stage': name, 'flightline': flightline, 'file': '' if fp is None else Path(fp).name,
+                  'pid': os.getpid(), 'start': started.isoformat(timespec='milliseconds'), 'seconds': seconds,
+                  'read_mb': read, 'written_mb': written,
+                  'storage_read_mb': _difference_mb(after, before, 'storage_read'),
+                  'read_mb_s': _rate(read, seconds), 'write_mb_s': _rate(written, seconds),
+                  'peak_rss_mb': peak or None, 'gdal_cache_mb': cache, 'gdal_cache_max_mb': cachemax,
+                  'error': error}
+        with open(Path(os.environ[report_dir_variable]) / f"stages_{os.getpid()}.jsonl", 'a') as dst:
+            dst.write(json.dumps(record) + '\n')
+
+
+def instrumented(name: str, path_arg: Optional[str] = None):
+    """
+    Decorator recording every call of a function as a stage (see stage), for the flightline of
+    the file passed as argument path_arg
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not is_enabled():
+                return func(*args, **kwargs)
+            fp = signature.bind_partial(*args, **kwargs).arguments.get(path_arg) if path_arg else None
+            with stage(name, fp):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def read_records(report_dir) -> List[dict]:
+    """Stage records of all processes of a session, in the order they started"""
+    records = []
+    for fp in sorted(Path(report_dir).glob('stages_*.jsonl')):
+        with open(fp) as src:
+            records += [json.loads(line) for line in src if line.strip()]
+    return sorted(records, key=lambda record: record['start'])
+
+
+def _total(records, key):
+    values = [record[key] for record in records if record[key] is not None]
+    return sum(values) if values else None
+
+
+def summarize(records: List[dict]) -> List[dict]:
+    """
+    Totals per stage (flightline '') and per stage and flightline: calls, wall time, MB read and
+    written, MB/s and the largest peak RSS. Stages of parallel workers add up, so the wall time of
+    a stage can exceed that of the run.
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault((record['stage'], ''), []).append(record)
+        if record['flightline']:
+            groups.setdefault((record['stage'], record['flightline']), []).append(record)
+    summary = []
+    for (name, flightline), group in groups.items():
+        seconds = sum(record['seconds'] for record in group)
+        read, written = _total(group, 'read_mb'), _total(group, 'written_mb')
+        peaks = [record['peak_rss_mb'] for record in group if record['peak_rss_mb'] is not None]
+        summary.append({'stage': name, 'flightline': flightline, 'calls': len(group), 'seconds': seconds,
+                        'read_mb': read, 'written_mb': written, 'storage_read_mb': _total(group, 'storage_read_mb'),
+                        'read_mb_s': _rate(read, seconds), 'write_mb_s': _rate(written, seconds),
+                        'peak_rss_mb': max(peaks) if peaks else None})
+    return summary
+
+
+def write_report(records: List[dict], outfile) -> Path:
+    """
+    Write the stage records and their summary (see summarize) as JSON, or if outfile ends in .csv
+    as CSV, with the summary in {stem}_summary.csv
+    """
+    outfile = Path(outfile)
+    outfile.parent.mkdir(parents=True, exist_ok=True)
+    summary = summarize(records)
+    if outfile.suffix.lower() == '.csv':
+        for fp, fields, rows in ((outfile, record_fields, records),
+                                 (outfile.with_name(f"{outfile.stem}_summary.csv"), summary_fields, summary)):
+            with open(fp, 'w', newline='') as dst:
+                writer = csv.DictWriter(dst, fieldnames=fields)
+                writer.writeheader()
+                writer.writerows(rows)
+    else:
+        with open(outfile, 'w') as dst:
+            json.dump({'summary': summary, 'stages': records}, dst, indent=1)
+    return outfile
+
+
+def print_summary(records: List[dict]):
+    """Table of the totals per stage"""
+    print(f"{'stage':24s} {'calls':>6s} {'seconds':>9s} {'read MB':>9s} {'write MB':>9s} {'MB/s':>8s} "
+          f"{'peak RSS':>9s}")
+    for row in summarize(records):
+        if row['flightline']:
+            continue
+        mbs = (row['read_mb'] or 0) + (row['written_mb'] or 0)
+        peak = f"{row['peak_rss_mb']:9.1f}" if row['peak_rss_mb'] is not None else f"{'':9s}"
+        print(f"{row['stage']:24s} {row['calls']:6d} {row['seconds']:9.2f} {row['read_mb'] or 0:9.1f} "
+              f"{row['written_mb'] or 0:9.1f} {_rate(mbs, row['seconds']) or 0:8.1f} {peak}")
+
+
+@contextmanager
+def session(report=None, profiler: Optional[str] = None):
+    """
+    Record the stages run in the with block, also in worker processes started inside it, print the
+    totals per stage and write the report to report (see write_report). With a profiler (one of
+    profilers), the outermost stage of each process is profiled and the profiles are written to
+    {report stem}_profiles next to the report (./profiles without a report), as .prof files for
+    cProfile (e.g. for snakeviz) or .html files for pyinstrument. Does nothing without report and profiler.
+    """
+    if report is None and profiler is None:
+        yield
+        return
+    if profiler is not None and profiler not in profilers:
+        raise ValueError(f"Unknown profiler {profiler}, must be one of {profilers}")
+    variables = (report_dir_variable, profiler_variable, profile_dir_variable)
+    previous = {variable: os.environ.get(variable) for variable in variables}
+    with tempfile.TemporaryDirectory() as report_dir:
+        os.environ[report_dir_variable] = report_dir
+        if profiler is not None:
+            os.environ[profiler_variable] = profiler
+            report_path = Path(report if report is not None else 'profiles').resolve()
+            os.environ[profile_dir_variable] = str(report_path.with_name(f"{report_path.stem}_profiles")
+                                                   if report is not None else report_path)
+        try:
+            yield
+        finally:
+            for variable, value in previous.items():
+                if value is None:
+                    os.environ.pop(variable, None)
+                else:
+                    os.environ[variable] = value
+            records = read_records(report_dir)
+            if records:
+                print_summary(records)
+            if report is not None:
+                print(f"Done writing {write_report(records, report)}")
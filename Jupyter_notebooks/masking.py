@@ -3,6 +3,9 @@
 import numpy as np
 import rasterio as rio
 
+import envicube
+import instrumentation
+
 def getdatabounds(row, nodataval=0.0, reversesign=False):
     """
     If row has nodata at both edges, returns first and last data index
@@ -13,14 +16,37 @@ def getdatabounds(row, nodataval=0.0, reversesign=False):
     return np.nonzero(cond)[0][0], np.nonzero(cond)[0][-1]
 
 
-def maskrow(row, lprop=0.0, rprop=0.0, nodataval=0):
+def getarraybounds(arr, lprop=0.0, rprop=0.0, nodataval=0.0, reversesign=False):
+    """
+    Vectorized getdatabounds for all rows of a 2D array at once.
+    Returns left and right index arrays, optionally moved inward by
+    proportion between 0 and 1 (as in croprow), and a boolean array
+    that is False for rows with only nodata
+    """
+    if reversesign:
+        cond = arr < nodataval
+    else:
+        cond = arr > nodataval
+    valid = cond.any(axis=1)
+    lidx = cond.argmax(axis=1)
+    ridx = arr.shape[1] - 1 - cond[:, ::-1].argmax(axis=1)
+    if lprop:
+        lidx = lidx + ((ridx - lidx) * lprop).astype(lidx.dtype)
+    if rprop:
+        ridx = ridx - ((ridx - lidx) * rprop).astype(ridx.dtype)
+    return lidx, ridx, valid
+
+
+def maskrow(row, lprop=0.0, rprop=0.0, nodataval=0, reversesign=False):
     """
     Return boolean data row (0 = nodata). Optionally extend mask by 
     proportion between 0 and 1 into the data
     """
     newrow = np.ones(len(row))
     try:
-        lbound, rbound = getdatabounds(row)
+        lbound, rbound = getdatabounds(row, reversesign=reversesign)
+        lbound = lbound + int((rbound - lbound) * lprop)
+        rbound = rbound - int((rbound - lbound) * rprop)
         newrow[:lbound] = nodataval
         newrow[rbound:] = nodataval
         return newrow
@@ -28,6 +54,32 @@ def maskrow(row, lprop=0.0, rprop=0.0, nodataval=0):
         return nodataval * newrow
 
 
+def maskarray(arr, lprop=0.0, rprop=0.0, nodataval=0, reversesign=False,
+              out=None, blocksize=1024):
+    """
+    Batched equivalent of np.apply_along_axis(maskrow, 1, arr). Writes
+    into out (int16, created as all ones if None) so that several masks
+    can be combined in one array: pixels that are already nodata in out
+    stay nodata. Rows are processed in blocks of blocksize to keep
+    the boolean temporaries small
+    """
+    if out is None:
+        out = np.ones(arr.shape, dtype='int16')
+    cols = np.arange(arr.shape[1], dtype='int32')
+    for start in range(0, arr.shape[0], blocksize):
+        stop = min(start + blocksize, arr.shape[0])
+        lidx, ridx, valid = getarraybounds(
+            arr[start:stop], lprop=lprop, rprop=rprop, reversesign=reversesign)
+        ridx[~valid] = 0
+        keep = cols >= lidx.astype('int32')[:, np.newaxis]
+        keep &= cols < ridx.astype('int32')[:, np.newaxis]
+        if nodataval == 0:
+            np.multiply(out[start:stop], keep, out=out[start:stop])
+        else:
+            np.copyto(out[start:stop], nodataval, where=~keep)
+    return out
+
+
 def croprow(row, lprop=0.1, rprop=0.1, nodataval=0):
     """
     Return row cropped with 0 (= nodata).Eextend mask by 
@@ -43,9 +95,20 @@ def croprow(row, lprop=0.1, rprop=0.1, nodataval=0):
         pass
     return row
 
-def getflightlinemask(vnirpath, swirpath, vnirscapath, swirscapath):
+def readband(src, band):
+    """
+    Band of an open rasterio dataset: a memmap view for raw ENVI files,
+    which maskarray then reads block by block, otherwise a rasterio read
+    """
+    cube = envicube.open_cube(src.name)
+    return src.read(band) if cube is None else cube.band(band - 1)
+
+@instrumentation.instrumented('masking', 'vnirpath')
+def getflightlinemask(vnirpath, swirpath, vnirscapath, swirscapath, lprop=0.0, rprop=0.0):
     """
-    Get flightline mask from all four _geo.bsq files
+    Get flightline mask from all four _geo.bsq files. Use lprop or rprop
+    to extend the mask into the data on one side (cf. maskrow_l, maskrow_r
+    in notebook 06)
     """
     try:
         with rio.open(vnirpath) as vnir:
@@ -58,24 +121,15 @@ def getflightlinemask(vnirpath, swirpath, vnirscapath, swirscapath):
                             'count': 1,
                             'nodata': 0
                         })
-                        vnir_sampleband = vnir.read(1)
-                        print("read vnir band")
-                        swir_sampleband = swir.read(1)
-                        print("read swir band")
-                        vnir_alt = vnir_sca.read(3)
-                        print("read vnir altitude")
-                        swir_alt = swir_sca.read(3)
-                        print("read swir altitude")
-                        maskvnir = np.apply_along_axis(maskrow, 1, vnir_sampleband)
+                        outdata = np.ones((vnir.height, vnir.width), dtype='int16')
+                        maskarray(readband(vnir, 1), lprop, rprop, out=outdata)
                         print("created vnir mask")
-                        maskswir = np.apply_along_axis(maskrow, 1, swir_sampleband)
+                        maskarray(readband(swir, 1), lprop, rprop, out=outdata)
                         print("created swir mask")
-                        maskvnir_alt = np.apply_along_axis(maskrow, 1, vnir_alt)
+                        maskarray(readband(vnir_sca, 3), lprop, rprop, out=outdata)
                         print("created vnir altitude mask")
-                        maskswir_alt = np.apply_along_axis(maskrow, 1, swir_alt)
+                        maskarray(readband(swir_sca, 3), lprop, rprop, out=outdata)
                         print("created swir altitude mask")
-                        outdata = maskvnir * maskswir * maskvnir_alt * maskswir_alt
-                        outdata = outdata.astype('int16')
     except:
         print(f"Didn't find all fines for flightline")
         raise
@@ -1,25 +1,42 @@
 # code for manipulating metadata
 
 from typing import AnyStr, List, Dict, Any
+from pathlib import Path
+import hashlib
+import os
+import pickle
 
+import numpy as np
 import pytz
 import datetime as dt
 
+# typed ENVI header fields. Everything else is kept as a string (braces stripped)
+hdr_int_fields = {'samples', 'lines', 'bands', 'header offset', 'data type', 'byte order',
+                  'x start', 'y start'}
+hdr_float_fields = {'data ignore value'}
+hdr_float_array_fields = {'wavelength', 'fwhm', 'bbl', 'data gain values', 'data offset values',
+                          'data reflectance gain values', 'data reflectance offset values'}
+hdr_int_array_fields = {'default bands'}
+hdr_list_fields = {'band names', 'spectra names', 'map info', 'z plot titles'}
+
+_hdr_memcache = {}
+
+hdr_cache_dir = Path(os.environ.get('HYSPEX_CACHE_DIR', Path.home() / '.cache' / 'hyspex_proc')) / 'hdr'
+
 
 def metadata_to_dict(metadatalist: List[AnyStr]) -> Dict:
     """Take metadata in list-of-lines form, parse into dict"""
-    metadict = {}
+    metaparts = {}
     for line in metadatalist:
         newitem = [item.strip() for item in line.split('=', 1)]
-        try:
-            metadict[newitem[0]] = metadict[newitem[0]] + ' ' + newitem[1]
-        except KeyError:
-            try:
-                metadict[newitem[0]] = newitem[1]
-                lastkey = newitem[0]
-            except IndexError:
-                metadict[lastkey] = metadict[lastkey] + ' ' + newitem[0]
-    return metadict
+        if len(newitem) == 1:
+            metaparts[lastkey].append(newitem[0])
+        elif newitem[0] in metaparts:
+            metaparts[newitem[0]].append(newitem[1])
+        else:
+            metaparts[newitem[0]] = [newitem[1]]
+            lastkey = newitem[0]
+    return {key: ' '.join(parts) for key, parts in metaparts.items()}
 
 
 def hdrfile_to_dict(fp) -> Dict:
@@ -30,6 +47,128 @@ def hdrfile_to_dict(fp) -> Dict:
     return metadata
 
 
+def _hdr_items(text: str):
+    """Yield (key, value) pairs of an ENVI header, joining brace-delimited values over lines"""
+    key = None
+    for line in text.splitlines():
+        if key is None:
+            name, sep, value = line.partition('=')
+            if not sep:
+                continue
+            value = value.strip()
+            if value.startswith('{') and '}' not in value:
+                key, parts = name.strip(), [value]
+                continue
+            yield name.strip(), value
+        else:
+            parts.append(line.strip())
+            if '}' in line:
+                yield key, ' '.join(parts)
+                key = None
+
+
+def parse_hdr(text: str) -> Dict[str, Any]:
+    """
+    Parse the text of an ENVI header. Brace-delimited numeric arrays
+    (wavelength, fwhm, ...) become NumPy arrays, list fields (band names, ...)
+    lists of strings, sizes and offsets ints, the data ignore value a float
+    (it may be nan). Other values are strings.
+    """
+    meta = {}
+    for key, value in _hdr_items(text):
+        key = key.lower()
+        braced = value.startswith('{')
+        if braced:
+            value = value[1:-1]
+        value = value.strip()
+        if key in hdr_float_array_fields:
+            meta[key] = np.fromstring(value, dtype=float, sep=',')
+        elif key in hdr_int_array_fields:
+            meta[key] = np.fromstring(value, dtype=float, sep=',').astype(int)
+        elif key in hdr_list_fields:
+            meta[key] = [item.strip() for item in value.split(',')]
+        elif key in hdr_int_fields:
+            meta[key] = int(float(value))
+        elif key in hdr_float_fields:
+            meta[key] = float(value)
+        else:
+            meta[key] = ' '.join(value.split()) if braced else value
+    return meta
+
+
+def _hdr_cache_path(fp: Path) -> Path:
+    return hdr_cache_dir / f"{hashlib.sha1(str(fp).encode('utf-8')).hexdigest()}.pkl"
+
+
+def _copy_meta(meta: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value.copy() if isinstance(value, (list, np.ndarray)) else value for key, value in meta.items()}
+
+
+def read_hdr(fp, cache: bool = True) -> Dict[str, Any]:
+    """
+    Take path of ENVI header, return typed dictionary (see parse_hdr).
+    Parsed headers are cached in memory and on disk (hdr_cache_dir, set
+    with HYSPEX_CACHE_DIR) keyed by path, mtime and size, so a header
+    is only parsed again after it changes. The returned dict is a copy,
+    so callers may modify it.
+    """
+    fp = Path(fp).resolve()
+    stat = fp.stat()
+    key = (str(fp), stat.st_mtime_ns, stat.st_size)
+    if cache:
+        if key in _hdr_memcache:
+            return _copy_meta(_hdr_memcache[key])
+        try:
+            with open(_hdr_cache_path(fp), 'rb') as src:
+                cachedkey, meta = pickle.load(src)
+            if cachedkey == key:
+                _hdr_memcache[key] = meta
+                return _copy_meta(meta)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            pass
+    with open(fp) as src:
+        meta = parse_hdr(src.read())
+    if cache:
+        _hdr_memcache[key] = _copy_meta(meta)
+        try:
+            hdr_cache_dir.mkdir(parents=True, exist_ok=True)
+            with open(_hdr_cache_path(fp), 'wb') as dst:
+                pickle.dump((key, meta), dst, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            pass
+    return meta
+
+
+def format_hdr(meta: Dict[str, Any]) -> str:
+    """
+    Format a dictionary as ENVI header text, the inverse of parse_hdr:
+    arrays and lists are written in braces, everything else as is.
+    """
+    lines = ['ENVI']
+    for key, value in meta.items():
+        if isinstance(value, np.ndarray):
+            value = '{' + ', '.join(f"{item:g}" for item in value.tolist()) + '}'
+        elif isinstance(value, (list, tuple)):
+            value = '{' + ', '.join(str(item) for item in value) + '}'
+        elif isinstance(value, float):
+            value = f"{value:g}"
+        lines.append(f"{key} = {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def write_hdr(fp, meta: Dict[str, Any]):
+    """Write a dictionary as ENVI header file (see format_hdr)"""
+    with open(fp, 'w') as dst:
+        dst.write(format_hdr(meta))
+
+
+def get_acquisition_datetime(meta: Dict[str, Any]) -> dt.datetime:
+    """Acquisition start (UTC) from a header parsed with read_hdr"""
+    timestr = meta.get('acquisition start time', meta.get('acquisition time'))
+    return pytz.utc.localize(dt.datetime.strptime(
+        f"{meta['acquisition date']} {timestr[:8]}", '%Y-%m-%d %H:%M:%S'))
+
+
 def gen_band_names(bands: int) -> str:
     if bands == 457:
         bandnames = ([f"Band {item} (VNIR Band {item})" for item in range(1, 171)] +
@@ -0,0 +1,92 @@
+# code for reading HySpex NAV files
+
+from pathlib import Path
+import hashlib
+import os
+
+import numpy as np
+
+import instrumentation
+
+# columns of the NAV .txt files: row id, WGS84 lon/lat (deg), elevation (m), roll, pitch, heading (deg)
+# and GPS timestamp (seconds of day)
+nav_dtype = np.dtype([('rowid', '<i4'), ('lon', '<f8'), ('lat', '<f8'), ('elev', '<f8'),
+                      ('roll', '<f8'), ('pitch', '<f8'), ('heading', '<f8'), ('timestamp', '<f8')])
+
+# used for the cache if the sidecar file can't be written next to the NAV file
+nav_cache_dir = Path(os.environ.get('HYSPEX_CACHE_DIR', Path.home() / '.cache' / 'hyspex_proc')) / 'nav'
+
+
+def parse_nav(text: str) -> np.ndarray:
+    """Parse the text of a whitespace-delimited NAV file into a structured array (nav_dtype)"""
+    values = np.fromstring(text, dtype=float, sep=' ')
+    ncols = len(nav_dtype.names)
+    if values.size % ncols:
+        raise ValueError(f"NAV data has {values.size} values, not a multiple of {ncols} columns")
+    values = values.reshape(-1, ncols)
+    navdata = np.empty(len(values), dtype=nav_dtype)
+    for idx, name in enumerate(nav_dtype.names):
+        navdata[name] = values[:, idx]
+    return navdata
+
+
+def swap_latlon(navdata: np.ndarray) -> np.ndarray:
+    """
+    View of NAV data with the lat and lon columns exchanged, for NAV files
+    written with the columns in the wrong order (see notebook DM02). No copy.
+    """
+    names = list(navdata.dtype.names)
+    lonidx, latidx = names.index('lon'), names.index('lat')
+    names[lonidx], names[latidx] = 'lat', 'lon'
+    swapped = np.dtype({'names': names,
+                        'formats': [navdata.dtype.fields[name][0] for name in navdata.dtype.names],
+                        'offsets': [navdata.dtype.fields[name][1] for name in navdata.dtype.names],
+                        'itemsize': navdata.dtype.itemsize})
+    return navdata.view(swapped)
+
+
+def nav_cache_paths(fp: Path):
+    """Candidate cache files: the sidecar next to the NAV file, then one in nav_cache_dir"""
+    return [fp.with_name(f"{fp.name}.npy"),
+            nav_cache_dir / f"{hashlib.sha1(str(fp).encode('utf-8')).hexdigest()}.npy"]
+
+
+@instrumentation.instrumented('nav_read', 'fp')
+def read_nav(fp, swaplatlon: bool = False, cache: bool = True, mmap: bool = True) -> np.ndarray:
+    """
+    Take path of NAV .txt file, return structured array (nav_dtype).
+    The parsed data is cached in a sidecar .npy file (<name>.txt.npy, or in
+    nav_cache_dir if the NAV directory is read-only) with the modification
+    time of the NAV file, so a NAV file is only parsed again after it changes.
+    Cached data is memory-mapped read-only unless mmap is False.
+    Set swaplatlon for NAV files with the lat and lon columns exchanged.
+    """
+    fp = Path(fp).resolve()
+    mtime = fp.stat().st_mtime_ns
+    navdata = None
+    if cache:
+        for cachepath in nav_cache_paths(fp):
+            try:
+                if cachepath.stat().st_mtime_ns == mtime:
+                    navdata = np.load(cachepath, mmap_mode='r' if mmap else None)
+                    if navdata.dtype != nav_dtype:
+                        navdata = None
+                    break
+            except (OSError, ValueError):
+                pass
+    if navdata is None:
+        with open(fp) as src:
+            navdata = parse_nav(src.read())
+        if cache:
+            for cachepath in nav_cache_paths(fp):
+                try:
+                    cachepath.parent.mkdir(parents=True, exist_ok=True)
+                    tmppath = cachepath.with_name(f"{cachepath.name}.tmp.npy")
+                    np.save(tmppath, navdata)
+                    # the cache is valid as long as its mtime matches that of the NAV file
+                    os.utime(tmppath, ns=(mtime, mtime))
+                    os.replace(tmppath, cachepath)
+                    break
+                except OSError:
+                    pass
+    return swap_latlon(navdata) if swaplatlon else navdata
@@ -0,0 +1,110 @@
+# code for converting HySpex NAV files to a flightline GIS file (see notebook 02)
+#
+# Each NAV file becomes one LineString, built from the coordinate arrays and simplified with Douglas-Peucker
+# (or decimated) before it is written. Per-line attributes (start and end point and time, scan lines, length,
+# attitude and elevation statistics) are stored with the lines, so they don't need to be recomputed.
+
+from pathlib import Path
+
+import geopandas as gp
+import numpy as np
+from pyproj import Transformer
+from shapely.geometry import LineString
+
+import navfile
+import navigation
+
+# projected CRS in which the tolerance and the line length are measured (Alaska Albers, m)
+metric_crs = "EPSG:3338"
+flightline_layer = 'flightlines'
+
+_to_metric = Transformer.from_crs("EPSG:4326", metric_crs, always_xy=True)
+
+
+def find_nav_files(projectdir, prefix, vnir_only=True, navdir=None):
+    """
+    NAV .txt files of a campaign, VNIR only by default (as notebook 02): in
+    navdir if given, otherwise in the NAV folders of the flightline folders
+    """
+    pattern = f"{prefix}*VNIR*_raw.txt" if vnir_only else f"{prefix}*_raw.txt"
+    if navdir is not None:
+        return sorted(Path(navdir).glob(pattern))
+    return sorted(Path(projectdir).glob(f"{prefix}_*/NAV/{pattern}"))
+
+
+def simplified_indices(x, y, tolerance=1.0, step=None):
+    """
+    Indices of the track vertices that are kept: every step-th point if step
+    is given, otherwise the Douglas-Peucker simplification of the projected
+    track with the tolerance (m), the largest distance of any dropped point
+    from the simplified line. The first and last points are always kept.
+    """
+    if step is not None:
+        indices = np.arange(0, len(x), step)
+        return indices if indices[-1] == len(x) - 1 else np.append(indices, len(x) - 1)
+    # the point index rides along as z coordinate, which the simplification keeps for the remaining vertices
+    track = LineString(np.column_stack([x, y, np.arange(len(x))]))
+    return np.asarray(track.simplify(tolerance, preserve_topology=False).coords)[:, 2].astype(int)
+
+
+def flightline_record(name, sensor, navdata, tolerance=1.0, step=None):
+    """
+    Simplified track (LineString, lon/lat) and attributes of one flightline
+    from its NAV data. Records with invalid positions (lat <= 0) are dropped;
+    returns None if fewer than two valid records remain.
+    """
+    navdata = navdata[navdata['lat'] > 0]
+    if len(navdata) < 2:
+        return None
+    x, y = _to_metric.transform(navdata['lon'], navdata['lat'])
+    indices = simplified_indices(x, y, tolerance, step)
+    start, end = navdata[0], navdata[-1]
+    return {
+        'flightline': name,
+        'sensor': sensor,
+        'scanlines': len(navdata),
+        'vertices': len(indices),
+        'start_lon': start['lon'], 'start_lat': start['lat'], 'start_time': start['timestamp'],
+        'end_lon': end['lon'], 'end_lat': end['lat'], 'end_time': end['timestamp'],
+        'duration': (end['timestamp'] - start['timestamp']) % 86400,
+        'length_m': np.hypot(np.diff(x), np.diff(y)).sum(),
+        'heading': navigation.avg_angle(navdata['heading']),
+        'roll_mean': navdata['roll'].mean(), 'roll_std': navdata['roll'].std(),
+        'pitch_mean': navdata['pitch'].mean(), 'pitch_std': navdata['pitch'].std(),
+        'elev_mean': navdata['elev'].mean(), 'elev_min': navdata['elev'].min(), 'elev_max': navdata['elev'].max(),
+        'geometry': LineString(np.column_stack([navdata['lon'][indices], navdata['lat'][indices]])),
+    }
+
+
+def flightline_name(navpath):
+    """Flightline name ({prefix}_{lineno}, e.g. 20210911-DC_01) and sensor of a NAV file"""
+    parts = Path(navpath).stem.split('_')
+    return '_'.join(parts[:2]), parts[2] if len(parts) > 2 else ''
+
+
+def nav_to_gis(navpaths, outfile=None, tolerance=1.0, step=None, layer=flightline_layer):
+    """
+    One simplified LineString with attributes per NAV file (see
+    flightline_record), as GeoDataFrame in WGS84. The NAV files are read one
+    at a time (and cached, see navfile.read_nav). If outfile is given, all
+    lines are written to it in one go: a GeoPackage layer, or a Shapefile if
+    outfile ends in .shp. Times are GPS seconds of day. The flightline
+    attribute matches the flightline folders of notebook 03. NAV files
+    without valid positions are skipped.
+    """
+    records = []
+    for navpath in navpaths:
+        record = flightline_record(*flightline_name(navpath), navfile.read_nav(navpath), tolerance, step)
+        if record is None:
+            print(f"No valid positions in {navpath}, skipping it")
+            continue
+        records.append(record)
+    if not records:
+        raise ValueError("None of the NAV files has valid positions")
+    flightlines = gp.GeoDataFrame(records, geometry='geometry', crs="EPSG:4326")
+    if outfile is not None:
+        if Path(outfile).suffix.lower() == '.shp':
+            flightlines.to_file(outfile, driver='ESRI Shapefile')
+        else:
+            flightlines.to_file(outfile, layer=layer, driver='GPKG')
+    return flightlines
@@ -1,10 +1,246 @@
 # functions for navigational and solar parameters
 
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+import csv
+import datetime as dt
+import json
+
 import numpy as np
+import pytz
+
+import metadata
+import navfile
+
+# per-flightline summary as written to the _flightdata.txt files (see notebook 07)
+summary_dtype = np.dtype([('flightlinename', 'U64'), ('scanlines', '<i8'),
+                          ('origts_utc', 'datetime64[ms]'), ('linets_utc', 'datetime64[ms]'),
+                          ('heading_avg', '<f8'), ('roll_avg', '<f8'), ('roll_std', '<f8'),
+                          ('pitch_avg', '<f8'), ('pitch_std', '<f8'), ('elevation_m_amsl', '<f8'),
+                          ('latitude', '<f8'), ('longitude', '<f8'), ('sun_azimuth', '<f8'), ('sun_zenith', '<f8'),
+                          ('sun_zenith_min', '<f8'), ('sun_zenith_max', '<f8')])
+
+# solar position along track, for every Nth scan line
+along_track_dtype = np.dtype([('rowid', '<i4'), ('time_utc', 'datetime64[ms]'), ('lat', '<f8'), ('lon', '<f8'),
+                              ('sun_azimuth', '<f8'), ('sun_zenith', '<f8')])
 
 def avg_angle(angle):
     """Averages a sequence of angles. Input: single angle or 1-D numpy array
     Angles in degrees"""
     return (np.arctan2(
         np.sin(angle * np.pi / 180.).mean(), 
-        np.cos(angle * np.pi / 180.).mean()) * 180. / np.pi + 360) % 360
\ No newline at end of file
+        np.cos(angle * np.pi / 180.).mean()) * 180. / np.pi + 360) % 360
+
+
+def solar_position(lat, lon, times) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Solar zenith and azimuth angles (degrees, azimuth clockwise from north)
+    for arrays of latitude, longitude (degrees) and UTC times (datetime64).
+    NOAA solar position equations, vectorized, without refraction correction.
+    Agrees with pysolar's get_altitude(..., pressure=0) and get_azimuth to
+    about 0.01 degrees; get_altitude_fast (notebook 07) is off by up to 1 degree.
+    """
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.asarray(lon, dtype=float)
+    times = np.asarray(times, dtype='datetime64[ms]')
+    seconds = (times - np.datetime64('1970-01-01T00:00:00', 'ms')).astype(float) / 1000
+    jc = (seconds / 86400 + 2440587.5 - 2451545) / 36525
+    meanlong = np.radians((280.46646 + jc * (36000.76983 + jc * 0.0003032)) % 360)
+    meananom = np.radians(357.52911 + jc * (35999.05029 - 0.0001537 * jc))
+    ecc = 0.016708634 - jc * (0.000042037 + 0.0000001267 * jc)
+    center = np.radians(np.sin(meananom) * (1.914602 - jc * (0.004817 + 0.000014 * jc))
+                        + np.sin(2 * meananom) * (0.019993 - 0.000101 * jc)
+                        + np.sin(3 * meananom) * 0.000289)
+    omega = np.radians(125.04 - 1934.136 * jc)
+    applong = meanlong + center - np.radians(0.00569 + 0.00478 * np.sin(omega))
+    obliquity = np.radians(23 + (26 + (21.448 - jc * (46.815 + jc * (0.00059 - jc * 0.001813))) / 60) / 60
+                           + 0.00256 * np.cos(omega))
+    declination = np.arcsin(np.sin(obliquity) * np.sin(applong))
+    y = np.tan(obliquity / 2) ** 2
+    eqtime = 4 * np.degrees(y * np.sin(2 * meanlong) - 2 * ecc * np.sin(meananom)
+                            + 4 * ecc * y * np.sin(meananom) * np.cos(2 * meanlong)
+                            - 0.5 * y * y * np.sin(4 * meanlong) - 1.25 * ecc * ecc * np.sin(2 * meananom))
+    solartime = (seconds % 86400 / 60 + eqtime + 4 * lon) % 1440
+    hourangle = np.radians(solartime / 4 - 180)
+    zenith = np.arccos(np.clip(np.sin(lat) * np.sin(declination)
+                               + np.cos(lat) * np.cos(declination) * np.cos(hourangle), -1, 1))
+    azimuth = (np.degrees(np.arctan2(np.sin(hourangle), np.cos(hourangle) * np.sin(lat)
+                                     - np.tan(declination) * np.cos(lat))) + 180) % 360
+    return np.degrees(zenith), azimuth
+
+
+def _to_datetime64(times) -> np.ndarray:
+    """UTC datetime64[ms] from datetime64 or (timezone-aware or UTC) datetime values"""
+    if isinstance(times, dt.datetime):
+        times = [times]
+    times = [time.astimezone(pytz.utc).replace(tzinfo=None)
+             if isinstance(time, dt.datetime) and time.tzinfo else time for time in np.ravel(times)]
+    return np.array(times, dtype='datetime64[ms]')
+
+
+def nav_datetimes(timestamps, reference) -> np.ndarray:
+    """
+    UTC times (datetime64[ms]) of NAV timestamps (seconds, reduced to
+    seconds of day as in notebook 07), on the day that puts them closest to
+    the reference time (UTC, e.g. the acquisition start from the ENVI
+    header). This handles lines that cross midnight UTC. The reference is a
+    single time or one time per timestamp.
+    """
+    reference = _to_datetime64(reference)
+    timestamps = np.asarray(timestamps, dtype=float) % 86400
+    if reference.size == 1 and timestamps.ndim == 0:
+        reference = reference[0]
+    times = (reference.astype('datetime64[D]').astype('datetime64[ms]')
+             + np.round(timestamps * 1000).astype('timedelta64[ms]'))
+    halfday = np.timedelta64(12, 'h')
+    oneday = np.timedelta64(1, 'D')
+    times = np.where(times - reference > halfday, times - oneday, times)
+    return np.where(reference - times > halfday, times + oneday, times)
+
+
+def nav_datetime(timestamp: float, reference: dt.datetime) -> dt.datetime:
+    """Single NAV timestamp as a timezone-aware UTC datetime, see nav_datetimes"""
+    return pytz.utc.localize(nav_datetimes(timestamp, reference).astype('datetime64[us]').item())
+
+
+def summarize_flightlines(names: Sequence[str], navdatas: Sequence[np.ndarray], references: Sequence,
+                          step: Optional[int] = None) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """
+    Navigation summary and solar geometry of many flightlines at once.
+    navdatas are NAV arrays as returned by navfile.read_nav, references the
+    UTC acquisition start of each line. All lines are concatenated and the
+    per-line statistics computed with np.bincount; the solar position is
+    computed at the centre scan line of each line, and if step is given at
+    every step-th scan line for the along-track variation.
+    Returns the summary (summary_dtype) and, if step is given, the along-track
+    solar position of each line (along_track_dtype), otherwise an empty list.
+    """
+    counts = np.array([len(navdata) for navdata in navdatas])
+    if np.any(counts == 0):
+        raise ValueError(f"Empty NAV data for {[name for name, count in zip(names, counts) if not count]}")
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    lineidx = np.repeat(np.arange(len(counts)), counts)
+    allnav = np.concatenate([np.asarray(navdata) for navdata in navdatas])
+    refs = _to_datetime64(references)
+
+    def linemean(values):
+        return np.bincount(lineidx, weights=values) / counts
+
+    def linestd(values, mean):
+        return np.sqrt(linemean((values - mean[lineidx]) ** 2))
+
+    summary = np.zeros(len(counts), dtype=summary_dtype)
+    summary['flightlinename'] = names
+    summary['scanlines'] = counts
+    summary['origts_utc'] = refs
+    headingrad = np.radians(allnav['heading'])
+    summary['heading_avg'] = (np.degrees(np.arctan2(linemean(np.sin(headingrad)),
+                                                    linemean(np.cos(headingrad)))) + 360) % 360
+    for name in ['roll', 'pitch']:
+        summary[f'{name}_avg'] = linemean(allnav[name])
+        summary[f'{name}_std'] = linestd(allnav[name], summary[f'{name}_avg'])
+    summary['elevation_m_amsl'] = linemean(allnav['elev'])
+    middle = allnav[starts + counts // 2]
+    summary['latitude'] = middle['lat']
+    summary['longitude'] = middle['lon']
+    linetimes = nav_datetimes(middle['timestamp'], refs)
+    summary['linets_utc'] = linetimes
+    summary['sun_zenith'], summary['sun_azimuth'] = solar_position(middle['lat'], middle['lon'], linetimes)
+
+    alongtrack = []
+    if step:
+        rows = np.flatnonzero((np.arange(len(allnav)) - starts[lineidx]) % step == 0)
+        sampled = allnav[rows]
+        alltimes = nav_datetimes(sampled['timestamp'], refs[lineidx[rows]])
+        zenith, azimuth = solar_position(sampled['lat'], sampled['lon'], alltimes)
+        along = np.zeros(len(rows), dtype=along_track_dtype)
+        along['rowid'] = sampled['rowid']
+        along['time_utc'] = alltimes
+        along['lat'] = sampled['lat']
+        along['lon'] = sampled['lon']
+        along['sun_zenith'] = zenith
+        along['sun_azimuth'] = azimuth
+        alongtrack = np.split(along, np.cumsum(np.bincount(lineidx[rows], minlength=len(counts)))[:-1])
+        summary['sun_zenith_min'] = [line['sun_zenith'].min() for line in alongtrack]
+        summary['sun_zenith_max'] = [line['sun_zenith'].max() for line in alongtrack]
+    else:
+        summary['sun_zenith_min'] = summary['sun_zenith_max'] = summary['sun_zenith']
+    return summary, alongtrack
+
+
+def summarize_campaign(projdir, prefix: str, navfilepattern: str = "_VNIR_1800_SN00812_FOVx2_raw.txt",
+                       reffilepattern: str = "_VNIR_1800_SN00812_FOVx2_raw_rad_bsq_float32.hdr",
+                       navdirstr: str = 'NAV', refdirstr: str = 'RAD', utc_offset: float = 8,
+                       step: Optional[int] = None) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """
+    Summarize all flightlines {prefix}_?? in a project folder (layout as in
+    notebook 03), see summarize_flightlines. The acquisition start is read
+    from the reference ENVI header and converted to UTC by adding utc_offset
+    hours (8: header time in AKDT, as assumed in notebook 07).
+    """
+    linedirs = sorted(Path(projdir).glob(f"{prefix}_??"))
+    names, navdatas, references = [], [], []
+    for linedir in linedirs:
+        linenumstr = linedir.name[-2:]
+        refmeta = metadata.read_hdr(linedir / refdirstr / f"{prefix}_{linenumstr}{reffilepattern}")
+        references.append(metadata.get_acquisition_datetime(refmeta) + dt.timedelta(hours=utc_offset))
+        navdatas.append(navfile.read_nav(linedir / navdirstr / f"{prefix}_{linenumstr}{navfilepattern}"))
+        names.append(linedir.name)
+    return summarize_flightlines(names, navdatas, references, step)
+
+
+def _format_time(time: np.datetime64, fmt: str) -> str:
+    return time.astype('datetime64[s]').item().strftime(fmt)
+
+
+def flightdata_dict(row: np.void, utc_offset: float = 8) -> dict:
+    """The content of a _flightdata.txt file (see notebook 07) from one row of a summary"""
+    flightdata = {}
+    flightdata['flightlinename'] = str(row['flightlinename'])
+    flightdata['origts_utc'] = _format_time(row['origts_utc'], '%Y-%m-%dT%H:%M:%S.0Z')
+    flightdata['linets_utc'] = _format_time(row['linets_utc'], '%Y-%m-%dT%H:%M:%S.0Z')
+    flightdata['linets_akdt'] = _format_time(row['linets_utc'] - np.timedelta64(int(utc_offset * 3600), 's'),
+                                             '%Y-%m-%d %H:%M:%S')
+    for key in ['heading_avg', 'roll_avg', 'roll_std', 'pitch_avg', 'pitch_std', 'elevation_m_amsl',
+                'latitude', 'longitude', 'sun_azimuth', 'sun_zenith']:
+        flightdata[key] = round(float(row[key]), 2)
+    return flightdata
+
+
+def write_flightdata(summary: np.ndarray, projdir, outfile_patt: str = "VNIR_SWIR_rad_geo_flightdata.txt",
+                     outdirstr: str = 'NAV', utc_offset: float = 8) -> List[Path]:
+    """Write the per-line _flightdata.txt files of a campaign summary, return their paths"""
+    outfps = []
+    for row in summary:
+        name = str(row['flightlinename'])
+        outfp = Path(projdir) / name / outdirstr / f"{name}_{outfile_patt}"
+        with open(outfp, "w") as dst:
+            dst.write(json.dumps(flightdata_dict(row, utc_offset), indent=2))
+        outfps.append(outfp)
+    return outfps
+
+
+def write_summary_table(summary: np.ndarray, fp):
+    """Write a campaign summary as a CSV table, one row per flightline"""
+    formats = {'M': lambda value: _format_time(value, '%Y-%m-%dT%H:%M:%S'), 'U': str, 'i': str,
+               'f': lambda value: f"{value:.6f}"}
+    with open(fp, 'w', newline='') as dst:
+        writer = csv.writer(dst)
+        writer.writerow(summary.dtype.names)
+        for row in summary:
+            writer.writerow([formats[summary.dtype[name].kind](row[name]) for name in summary.dtype.names])
+
+
+def write_solar_along_track(summary: np.ndarray, alongtrack: Sequence[np.ndarray], projdir,
+                            outdirstr: str = 'NAV') -> List[Path]:
+    """Write the along-track solar position of each line (see summarize_flightlines) as CSV, return the paths"""
+    outfps = []
+    for row, along in zip(summary, alongtrack):
+        name = str(row['flightlinename'])
+        outfp = Path(projdir) / name / outdirstr / f"{name}_solar_along_track.csv"
+        np.savetxt(outfp, np.column_stack([along['rowid'], along['lat'], along['lon'],
+                                           along['sun_azimuth'], along['sun_zenith']]),
+                   fmt=['%d', '%.8f', '%.8f', '%.4f', '%.4f'], delimiter=',',
+                   header='rowid,lat,lon,sun_azimuth,sun_zenith', comments='')
+        outfps.append(outfp)
+    return outfps
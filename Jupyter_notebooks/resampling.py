@@ -0,0 +1,284 @@
+# code for resampling supercubes to the bands of other sensors (Landsat, Sentinel-2, vegetation index bands)
+#
+# The band responses of the source (a HySpex supercube) and of the target sensor are laid out on a common
+# wavelength grid. Each target band is the response-weighted average of the source bands, the source bands
+# being spread over the grid by their own responses: this gives a target x source weight matrix, which is
+# sparse, as each target band only overlaps a few source bands. It is computed once per sensor pair and
+# cached, in memory and as .npz. Cubes are resampled a block of lines at a time, with one matrix product per
+# block, reading only the source bands with weights. Wavelengths are in nm, as in the ENVI headers.
+
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple
+import hashlib
+import os
+
+import numpy as np
+
+import envicube
+import metadata
+import sensormodel
+import spectral
+
+# band centre and FWHM (nm) of the target sensors: Landsat 8 OLI (band passes from USGS) and Sentinel-2A MSI
+# (central wavelength and bandwidth from ESA), in order of wavelength. Their responses are approximated by
+# Gaussians, unless a sensor model folder with .rsp files is used instead.
+sensor_bands = {
+    'landsat8': {'B1': (443.0, 16.0), 'B2': (482.0, 60.0), 'B3': (561.5, 57.0), 'B4': (654.5, 37.0),
+                 'B5': (865.0, 28.0), 'B9': (1373.5, 21.0), 'B6': (1608.5, 85.0), 'B7': (2200.5, 187.0)},
+    'sentinel2': {'B1': (442.7, 21.0), 'B2': (492.4, 66.0), 'B3': (559.8, 36.0), 'B4': (664.6, 31.0),
+                  'B5': (704.1, 15.0), 'B6': (740.5, 15.0), 'B7': (782.8, 20.0), 'B8': (832.8, 106.0),
+                  'B8A': (864.7, 21.0), 'B9': (945.1, 20.0), 'B10': (1373.5, 31.0), 'B11': (1613.7, 91.0),
+                  'B12': (2202.4, 175.0)},
+}
+
+# wavelength step of the common grid (nm)
+grid_step = sensormodel.grid_step * 1000
+# weights below this fraction of the largest weight of a target band are dropped
+weight_threshold = 1e-3
+# target bands whose response is covered by the source bands to less than this fraction are refused
+min_coverage = 0.9
+
+resampling_cache_dir = Path(os.environ.get('HYSPEX_CACHE_DIR', Path.home() / '.cache' / 'hyspex_proc')) / 'resampling'
+_resampler_memcache = {}
+
+
+def band_responses(grid, centres, fwhm, shape='gaussian'):
+    """
+    (bands, grid) responses of bands with the given centres and FWHM: 'gaussian', or 'butterworth' of order 2
+    as in the ATCOR sensor models (see sensormodel.butterworth_responses). Zero beyond 2 FWHM of the centres.
+    """
+    offsets = (grid[np.newaxis, :] - np.asarray(centres, dtype=float)[:, np.newaxis]) / np.asarray(
+        fwhm, dtype=float)[:, np.newaxis]
+    if shape == 'gaussian':
+        responses = np.exp(-4 * np.log(2) * offsets ** 2)
+    elif shape == 'butterworth':
+        responses = 1 / (1 + (2 * offsets) ** 4)
+    else:
+        raise ValueError(f"Unknown response shape {shape}")
+    responses[np.abs(offsets) >= 2] = 0
+    return responses
+
+
+def band_grid(centres, fwhm, step=grid_step):
+    """Common grid (nm) covering 2 FWHM on either side of all bands"""
+    lowest = np.min(np.asarray(centres) - 2 * np.asarray(fwhm))
+    highest = np.max(np.asarray(centres) + 2 * np.asarray(fwhm))
+    return np.arange(np.floor(lowest / step), np.ceil(highest / step) + 1) * step
+
+
+class BandSet:
+    """
+    Bands of a sensor: names, centres and FWHM (nm), and either a response
+    shape or measured responses on their own grid (from .rsp files)
+    """
+
+    def __init__(self, names: Sequence[str], centres, fwhm, shape: str = 'gaussian',
+                 grid: Optional[np.ndarray] = None, matrix: Optional[np.ndarray] = None):
+        self.names = list(names)
+        self.centres = np.asarray(centres, dtype=float)
+        self.fwhm = np.asarray(fwhm, dtype=float)
+        self.shape = shape
+        self.grid, self.matrix = grid, matrix
+
+    def __len__(self):
+        return len(self.centres)
+
+    def responses(self, grid: np.ndarray) -> np.ndarray:
+        """(bands, grid) responses on the given grid"""
+        if self.matrix is None:
+            return band_responses(grid, self.centres, self.fwhm, self.shape)
+        return np.stack([np.interp(grid, self.grid, row, left=0, right=0) for row in self.matrix])
+
+    def key(self) -> str:
+        """Digest of the band definition, for the cache of the weights"""
+        parts = [self.centres.tobytes(), self.fwhm.tobytes(), self.shape.encode('utf-8')]
+        if self.matrix is not None:
+            parts.append(np.ascontiguousarray(self.matrix).tobytes())
+        return hashlib.sha1(b''.join(parts)).hexdigest()
+
+
+def sensor_bandset(sensor: str) -> BandSet:
+    """BandSet of a target sensor in sensor_bands"""
+    bands = sensor_bands[sensor]
+    return BandSet(list(bands), [centre for centre, _ in bands.values()], [fwhm for _, fwhm in bands.values()])
+
+
+def wavelength_bandset(wavelengths: Sequence[float], fwhm) -> BandSet:
+    """BandSet of Gaussian bands at the given wavelengths (nm), e.g. the wavelengths of vegetation indices"""
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    return BandSet([f"{wvl:g} nm" for wvl in wavelengths], wavelengths, np.broadcast_to(fwhm, wavelengths.shape))
+
+
+def hdr_bandset(hdr_file) -> BandSet:
+    """
+    BandSet of the bands of an ENVI file, with Butterworth responses as in
+    the ATCOR sensor models. Without fwhm in the header, the band spacing
+    is used (see spectral.SensorBands).
+    """
+    bands = spectral.sensor_bands_from_hdr(hdr_file)
+    names = metadata.read_hdr(hdr_file).get('band names') or [f"Band {idx + 1}" for idx in range(len(bands))]
+    return BandSet(names, bands.wavelengths, bands.fwhm, 'butterworth')
+
+
+def model_bandset(sensordir) -> BandSet:
+    """BandSet of the measured responses of an ATCOR sensor model folder (see sensormodel.load_responses)"""
+    arrays = sensormodel.load_responses(sensordir, matrix=True)
+    return BandSet([f"Band {idx + 1}" for idx in range(len(arrays['centres']))], arrays['centres'] * 1000,
+                   arrays['fwhm'] * 1000, 'measured', arrays['grid'] * 1000, arrays['matrix'])
+
+
+def weight_matrix(source: BandSet, target: BandSet, step: float = grid_step) -> np.ndarray:
+    """
+    Dense (target, source) weight matrix: the response-weighted average over
+    each target band of the source bands, each spread over the grid with
+    its response normalized so that all source responses add up to one.
+    Rows are normalized to sum to one. Raises
+    spectral.WavelengthOutOfRangeError for target bands the source bands
+    don't cover (see min_coverage).
+    """
+    grid = band_grid(np.concatenate([source.centres, target.centres]),
+                     np.concatenate([source.fwhm, target.fwhm]), step)
+    sourceresp = source.responses(grid)
+    total = sourceresp.sum(axis=0)
+    covered = total > 0
+    sourceresp[:, covered] /= total[covered]
+    targetresp = target.responses(grid)
+    weights = targetresp @ sourceresp.T / targetresp.sum(axis=1, keepdims=True)
+    coverage = weights.sum(axis=1)
+    if np.any(coverage < min_coverage):
+        raise spectral.WavelengthOutOfRangeError(
+            f"Target bands {[name for name, cov in zip(target.names, coverage) if cov < min_coverage]} "
+            f"are outside the source bands")
+    return weights / coverage[:, np.newaxis]
+
+
+def sparse_weights(weights: np.ndarray, threshold: float = weight_threshold) -> Dict[str, np.ndarray]:
+    """
+    CSR arrays (indptr, indices, data) of a weight matrix, without the
+    weights below threshold times the largest weight of their row, and with
+    the rows normalized to sum to one again
+    """
+    keep = weights >= threshold * weights.max(axis=1, keepdims=True)
+    kept = np.where(keep, weights, 0)
+    kept /= kept.sum(axis=1, keepdims=True)
+    rows, cols = np.nonzero(keep)
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(weights)))])
+    return {'indptr': indptr, 'indices': cols, 'data': kept[rows, cols], 'shape': np.array(weights.shape)}
+
+
+class Resampler:
+    """
+    Sparse target x source weights of a sensor pair, in CSR form. bands are
+    the (0-based) source bands with weights, and weights the dense
+    (targets, bands) matrix applied to them, so that only those source bands
+    are read and the resampling is one matrix product.
+    """
+
+    def __init__(self, csr: Dict[str, np.ndarray], names: Sequence[str], centres, fwhm):
+        self.csr = csr
+        self.names = list(names)
+        self.centres = np.asarray(centres, dtype=float)
+        self.fwhm = np.asarray(fwhm, dtype=float)
+        self.source_bands = int(csr['shape'][1])
+        self.bands = np.unique(csr['indices'])
+        self.weights = np.zeros((len(self.names), len(self.bands)), dtype='float32')
+        rows = np.repeat(np.arange(len(self.names)), np.diff(csr['indptr']))
+        self.weights[rows, np.searchsorted(self.bands, csr['indices'])] = csr['data']
+        # for BIL and BIP, where all bands of a line are read anyway, the product over all bands is faster
+        self.full_weights = np.zeros((len(self.names), self.source_bands), dtype='float32')
+        self.full_weights[:, self.bands] = self.weights
+
+    def __len__(self):
+        return len(self.names)
+
+    def resample(self, spectra: np.ndarray, axis: int = -1) -> np.ndarray:
+        """Resample an array with the source bands (all of them, or only bands) along axis"""
+        if spectra.shape[axis] == self.source_bands:
+            spectra = np.take(spectra, self.bands, axis=axis)
+        return np.moveaxis(np.tensordot(self.weights, spectra, axes=([1], [axis])), 0, axis)
+
+    def resample_lines(self, cube: envicube.EnviCube, start: int, stop: int) -> np.ndarray:
+        """
+        Resampled block of lines of a cube as float32, in the interleave of the
+        cube: one matrix product, over the bands with weights (BSQ) or all bands
+        """
+        if cube.bands != self.source_bands:
+            raise ValueError(f"{cube.path} has {cube.bands} bands, the resampler expects {self.source_bands}")
+        if cube.interleave == 'bsq':
+            block = cube.data[self.bands, start:stop].astype('float32')
+            return (self.weights @ block.reshape(len(self.bands), -1)).reshape(len(self), stop - start, -1)
+        elif cube.interleave == 'bil':
+            return np.matmul(self.full_weights, cube.data[start:stop].astype('float32'))
+        return cube.data[start:stop].astype('float32') @ self.full_weights.T
+
+
+def _cache_path(key: str) -> Path:
+    return resampling_cache_dir / f"{key}.npz"
+
+
+def get_resampler(source: BandSet, target: BandSet, threshold: float = weight_threshold) -> Resampler:
+    """
+    Resampler from source to target bands. The weights are computed once
+    per sensor pair and cached in memory and on disk (resampling_cache_dir,
+    set with HYSPEX_CACHE_DIR).
+    """
+    key = hashlib.sha1(f"{source.key()} {target.key()} {threshold} {grid_step}".encode('utf-8')).hexdigest()
+    if key in _resampler_memcache:
+        return _resampler_memcache[key]
+    csr = None
+    try:
+        with np.load(_cache_path(key)) as cached:
+            csr = {name: cached[name] for name in ('indptr', 'indices', 'data', 'shape')}
+    except (OSError, KeyError, ValueError):
+        pass
+    if csr is None:
+        csr = sparse_weights(weight_matrix(source, target), threshold)
+        try:
+            resampling_cache_dir.mkdir(parents=True, exist_ok=True)
+            tmppath = _cache_path(key).with_name(f"{key}.tmp.npz")
+            np.savez(tmppath, **csr)
+            os.replace(tmppath, _cache_path(key))
+        except OSError:
+            pass
+    resampler = Resampler(csr, target.names, target.centres, target.fwhm)
+    _resampler_memcache[key] = resampler
+    return resampler
+
+
+def resampled_meta(meta: Dict, resampler: Resampler) -> Dict:
+    """Header of a resampled cube: that of the source, with the target bands and float32 data"""
+    outmeta = {key: value for key, value in meta.items()
+               if key not in ('wavelength', 'fwhm', 'band names', 'data gain values', 'data offset values',
+                              'bbl', 'default bands')}
+    outmeta.update({'bands': len(resampler), 'data type': 4, 'byte order': 0, 'header offset': 0,
+                    'wavelength units': 'Nanometers', 'wavelength': resampler.centres, 'fwhm': resampler.fwhm,
+                    'band names': resampler.names})
+    return outmeta
+
+
+def resample_cube(input_file, output_file, target: BandSet, source: Optional[BandSet] = None,
+                  block_lines: int = 256) -> Tuple[Path, Resampler]:
+    """
+    Resample a raw ENVI cube to the target bands and write the result as
+    ENVI float32 cube in the same interleave, with a header giving the
+    target band names, wavelengths and FWHM (so that generate_vi can use it).
+    The source bands default to those of the input header (see hdr_bandset).
+    """
+    cube = envicube.EnviCube(input_file)
+    source = hdr_bandset(envicube.find_hdr(input_file)) if source is None else source
+    resampler = get_resampler(source, target)
+    outmeta = resampled_meta(cube.meta, resampler)
+    output_file = Path(output_file)
+    metadata.write_hdr(output_file.with_suffix('.hdr'), outmeta)
+    shape = tuple(outmeta[axis] for axis in envicube.interleave_shapes[cube.interleave])
+    out = np.memmap(output_file, dtype='<f4', mode='w+', shape=shape)
+    for start in range(0, cube.lines, block_lines):
+        stop = min(start + block_lines, cube.lines)
+        block = resampler.resample_lines(cube, start, stop)
+        if cube.interleave == 'bsq':
+            out[:, start:stop] = block
+        else:
+            out[start:stop] = block
+    out.flush()
+    del out
+    return output_file, resampler
@@ -0,0 +1,244 @@
+# code for generating ATCOR-4 sensor models (see notebook 09 and sensormodel_for_ATCOR/README.md)
+#
+# A sensor model folder holds one bandNNN.rsp response file per band, sensor_<name>.dat, sensor_<name>.cal,
+# e0_solar_<name>.spc and pressure.dat. Here the band responses are stacked into (bands, samples) arrays:
+# centre wavelengths, FWHM and band solar irradiance of all bands follow with array operations instead of a
+# loop over the bands. For spectral resampling, the responses are also interpolated onto a common wavelength
+# grid as one (bands, grid) matrix. Parsed models are cached in memory until their .rsp files change.
+# Wavelengths are in micrometers throughout, as in the ATCOR files.
+
+from pathlib import Path
+import hashlib
+import re
+
+import numpy as np
+
+import metadata
+
+# wavelength step of the common grid of the response matrix (micrometers)
+grid_step = 0.0002
+
+_response_memcache = {}
+
+rsp_pattern = re.compile(r'band(\d+)\.rsp$')
+
+pressure_text = ("  1013.0   R0.000000   lab pressure, instrument pressure (mbar, hPa)\n"
+                 "                  instrument pressure is relative or absolute\n"
+                 "                  R=r=relative pressure above ambient flight altitude\n"
+                 "                  A=a=absolute pressure in instrument\n")
+
+
+def find_rsp_files(sensordir):
+    """bandNNN.rsp files of a sensor model folder, in band order"""
+    rspfiles = [fp for fp in Path(sensordir).iterdir() if rsp_pattern.match(fp.name)]
+    return sorted(rspfiles, key=lambda fp: int(rsp_pattern.match(fp.name).group(1)))
+
+
+def read_rsp(fp):
+    """Wavelengths (micrometers) and response of one .rsp file"""
+    with open(fp) as src:
+        src.readline()
+        values = np.fromstring(src.read(), dtype=float, sep=' ').reshape(-1, 2)
+    return values[:, 0], values[:, 1]
+
+
+def butterworth_responses(centres, fwhm, order=2, points=41, extent=2.0):
+    """
+    Butterworth filter responses 1 / (1 + (2 dx / fwhm)^(2 order)) of all
+    bands, sampled at points wavelengths within extent FWHM of the centres,
+    with the outermost samples set to zero. With the defaults this is the
+    response of the .rsp files in sensormodel_for_ATCOR. Returns
+    (bands, points) arrays of wavelengths and responses.
+    """
+    offsets = np.linspace(-extent, extent, points)
+    wavelengths = np.asarray(centres, dtype=float)[:, np.newaxis] + offsets * np.asarray(fwhm)[:, np.newaxis]
+    response = 1 / (1 + (2 * offsets) ** (2 * order))
+    response[[0, -1]] = 0
+    return wavelengths, np.broadcast_to(response, wavelengths.shape)
+
+
+def response_matrix(responses, step=grid_step):
+    """
+    Common wavelength grid and (bands, grid) float32 matrix of the band
+    responses, each interpolated linearly onto the grid over its own range.
+    responses is a sequence of (wavelengths, response) pairs, one per band.
+    The grid extends one step beyond the outermost response wavelengths.
+    """
+    lowest = min(wvl[0] for wvl, _ in responses)
+    highest = max(wvl[-1] for wvl, _ in responses)
+    grid = np.arange(np.floor(lowest / step) - 1, np.ceil(highest / step) + 2) * step
+    matrix = np.zeros((len(responses), len(grid)), dtype='float32')
+    for idx, (wvl, response) in enumerate(responses):
+        start, stop = np.searchsorted(grid, [wvl[0], wvl[-1]], side='right')
+        matrix[idx, start:stop] = np.interp(grid[start:stop], wvl, response)
+    return grid, matrix
+
+
+def stack_responses(responses):
+    """
+    (bands, points) arrays of the wavelengths and values of band responses
+    given as (wavelengths, response) pairs. Shorter responses are padded
+    with zero response at their last wavelength.
+    """
+    points = max(len(wvl) for wvl, _ in responses)
+    wavelengths = np.empty((len(responses), points))
+    values = np.zeros((len(responses), points))
+    for idx, (wvl, response) in enumerate(responses):
+        wavelengths[idx, :len(wvl)], wavelengths[idx, len(wvl):] = wvl, wvl[-1]
+        values[idx, :len(response)] = response
+    return wavelengths, values
+
+
+def band_parameters(wavelengths, responses):
+    """
+    Centre wavelength and FWHM of all bands, from the half-maximum crossings
+    on either side of the peak, interpolated linearly between samples.
+    responses is a (bands, points) array, sampled at wavelengths, which is
+    either a common grid (points,) or (bands, points), see stack_responses.
+    """
+    wavelengths = np.broadcast_to(wavelengths, responses.shape)
+    rows = np.arange(len(responses))
+    half = responses.max(axis=1) / 2
+    above = responses >= half[:, np.newaxis]
+    first = above.argmax(axis=1)
+    last = responses.shape[1] - 1 - above[:, ::-1].argmax(axis=1)
+
+    def crossing(inside, outside):
+        inner, outer = responses[rows, inside], responses[rows, outside]
+        return wavelengths[rows, outside] + (half - outer) / (inner - outer) * (
+            wavelengths[rows, inside] - wavelengths[rows, outside])
+
+    left, right = crossing(first, first - 1), crossing(last, last + 1)
+    return (left + right) / 2, right - left
+
+
+def read_solar_spectrum(fp):
+    """
+    Solar irradiance spectrum (wavelength, E0) from a text file with these
+    two columns, e.g. from the sun folder of the ATCOR-4 installation. Lines
+    that aren't numbers are skipped; wavelengths in nm are converted to
+    micrometers.
+    """
+    table = np.genfromtxt(fp, usecols=(0, 1), invalid_raise=False)
+    table = table[~np.isnan(table).any(axis=1)]
+    wavelengths = table[:, 0] / 1000 if table[:, 0].max() > 100 else table[:, 0]
+    return wavelengths, table[:, 1]
+
+
+def solar_irradiance(wavelengths, responses, solar_wavelengths, solar_e0):
+    """
+    Band solar irradiance: the solar spectrum weighted with each band
+    response, for all bands at once. responses is a (bands, points) array
+    sampled at wavelengths, either the stacked responses (see
+    stack_responses) or the response matrix on its common grid.
+    """
+    weighted = responses * np.interp(wavelengths, solar_wavelengths, solar_e0)
+    return weighted.sum(axis=-1) / responses.sum(axis=-1)
+
+
+def response_fingerprint(rspfiles, step=grid_step):
+    """Fingerprint of the .rsp files of a model (names, sizes and modification times) and the grid step"""
+    stats = [(fp.name, fp.stat().st_size, fp.stat().st_mtime_ns) for fp in rspfiles]
+    return hashlib.sha1(repr((stats, step)).encode('utf-8')).hexdigest()
+
+
+def response_arrays(responses, step=grid_step, matrix=False):
+    """
+    Stacked wavelengths and responses (see stack_responses) and band centres
+    and FWHM of band responses given as (wavelengths, response) pairs, as a
+    dict; with matrix, also the common grid and (bands, grid) response
+    matrix (see response_matrix). The centres and FWHM are computed from
+    the responses as given.
+    """
+    wavelengths, values = stack_responses(responses)
+    centres, fwhm = band_parameters(wavelengths, values)
+    arrays = {'wavelengths': wavelengths, 'responses': values, 'centres': centres, 'fwhm': fwhm}
+    if matrix:
+        arrays['grid'], arrays['matrix'] = response_matrix(responses, step)
+    return arrays
+
+
+def load_responses(sensordir, step=grid_step, matrix=False, cache=True):
+    """
+    Band responses of the .rsp files of a sensor model folder (see
+    response_arrays). They are cached in memory and read again from the
+    .rsp files only after these changed.
+    """
+    rspfiles = find_rsp_files(sensordir)
+    if not rspfiles:
+        raise ValueError(f"No .rsp files in {sensordir}")
+    key = (str(Path(sensordir).resolve()), response_fingerprint(rspfiles, step), matrix)
+    if cache and key in _response_memcache:
+        return _response_memcache[key]
+    arrays = response_arrays([read_rsp(fp) for fp in rspfiles], step, matrix)
+    if cache:
+        _response_memcache[key] = arrays
+    return arrays
+
+
+def wavelengths_from_hdr(hdr_file):
+    """
+    Band centres and FWHM (micrometers) from an ENVI header. Without fwhm in
+    the header, the FWHM is 1.2 times the wavelength difference to the next
+    band, as in notebook 09. This is only a rough estimate (the real FWHM of
+    the HySpex bands is not tied to their spacing, and spectral.SensorBands
+    uses the spacing itself), so use headers with fwhm where possible.
+    """
+    meta = metadata.read_hdr(hdr_file)
+    scale = 1 if meta.get('wavelength units', '').lower().startswith('micro') else 1 / 1000
+    centres = np.asarray(meta['wavelength'], dtype=float) * scale
+    if meta.get('fwhm') is not None:
+        return centres, np.asarray(meta['fwhm'], dtype=float) * scale
+    return centres, 1.2 * np.diff(centres, append=2 * centres[-1] - centres[-2])
+
+
+def write_wvl(fp, centres, fwhm, columns=3):
+    """.wvl file of notebook 09: band index, centre wavelength and FWHM, or just the last two"""
+    if columns == 3:
+        np.savetxt(fp, np.stack((np.arange(1, len(centres) + 1), centres, fwhm), axis=-1),
+                   fmt='    %1.3f    %0.7f    %0.7f')
+    else:
+        np.savetxt(fp, np.stack((centres, fwhm), axis=-1), fmt='    %0.7f    %0.7f')
+
+
+def write_sensor_model(outdir, name, responses, solar=None, fov=33.0, pixels=1800, calibration=(0.0, 100.0),
+                       step=grid_step, wvl_columns=3):
+    """
+    Write the ATCOR-4 sensor model folder outdir/name from the band
+    responses (a sequence of (wavelengths, response) pairs, see
+    butterworth_responses and read_rsp): the .rsp files, sensor_<name>.dat
+    and .cal (calibration offset and gain of all bands), pressure.dat, the
+    .wvl file. e0_solar_<name>.spc is written if a
+    solar spectrum (wavelengths, E0) is given. Returns the model folder.
+    """
+    modeldir = Path(outdir) / name
+    modeldir.mkdir(parents=True, exist_ok=True)
+    for fp in find_rsp_files(modeldir):
+        fp.unlink()
+    bands = len(responses)
+    for idx, (wvl, response) in enumerate(responses):
+        rspname = f"band{idx + 1:03d}.rsp"
+        with open(modeldir / rspname, 'w') as dst:
+            dst.write(f"{len(wvl):5d}         {rspname}\n")
+            dst.writelines(f"{w:8.5f}    {r:8.6f}\n" for w, r in zip(wvl, response))
+    # the responses as written, rounded to the precision of the .rsp files
+    arrays = load_responses(modeldir, step)
+    centres, fwhm = arrays['centres'], arrays['fwhm']
+
+    with open(modeldir / f"sensor_{name}.dat", 'w') as dst:
+        dst.write(f"{fov:6.1f}{pixels:6d}  across-track FOV [degree], pixel per line\n")
+        dst.write(f"{1:6d}{bands:6d}  first, last reflective band (0.35 - 2.55 micron)\n")
+        dst.write(f"{0:6d}{0:6d}  first, last mid IR band (2.6 - 7.1 micron)\n")
+        dst.write(f"{0:6d}{0:6d}  first, last thermal band (7.1 - 14 micron)\n")
+        dst.write(f"{0:6d}        flag for tilt in flight direction\n")
+        dst.write(f"{0:6d}        no gain settings\n")
+    with open(modeldir / f"sensor_{name}.cal", 'w') as dst:
+        dst.writelines(f"{band:27.7f}{calibration[0]:27.8f}{calibration[1]:27.5f}\n" for band in range(1, bands + 1))
+    (modeldir / 'pressure.dat').write_text(pressure_text)
+    if solar is not None:
+        e0 = solar_irradiance(arrays['wavelengths'], arrays['responses'], *solar)
+        with open(modeldir / f"e0_solar_{name}.spc", 'w') as dst:
+            dst.write("     wvl      fwhm     E0 [mW/cm2 micron]\n")
+            dst.writelines(f"{c:10.6f}{f:10.6f}{e:10.3f}\n" for c, f, e in zip(centres, fwhm, e0))
+    write_wvl(modeldir / f"{name}.wvl", centres, fwhm, wvl_columns)
+    return modeldir
@@ -0,0 +1,108 @@
+# code for looking up bands by wavelength
+
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+import metadata
+
+band_modes = ('nearest', 'lower', 'upper')
+
+# ATCOR sensor models shipped with the repository (see sensormodel_for_ATCOR/README.md)
+atcor_sensor_dir = Path(__file__).resolve().parent.parent / 'sensormodel_for_ATCOR'
+
+
+class WavelengthOutOfRangeError(ValueError):
+    pass
+
+
+class SensorBands:
+    """
+    Sorted band centre wavelengths (nm) of a sensor with the boundaries
+    between neighbouring bands precomputed, so that any number of target
+    wavelengths is looked up with a single np.searchsorted call.
+    Band indices returned are 0-based.
+    """
+
+    def __init__(self, wavelengths: Sequence[float], fwhm: Optional[Sequence[float]] = None):
+        self.wavelengths = np.asarray(wavelengths, dtype=float)
+        if np.any(np.diff(self.wavelengths) <= 0):
+            raise ValueError("Band wavelengths must be strictly increasing")
+        spacing = np.gradient(self.wavelengths) if len(self.wavelengths) > 1 else np.ones(1)
+        self.fwhm = spacing if fwhm is None else np.asarray(fwhm, dtype=float)
+        self.midpoints = (self.wavelengths[:-1] + self.wavelengths[1:]) / 2
+        # targets up to half a band width beyond the outermost band centres are in range
+        self.lowest = self.wavelengths[0] - self.fwhm[0] / 2
+        self.highest = self.wavelengths[-1] + self.fwhm[-1] / 2
+
+    def __len__(self):
+        return len(self.wavelengths)
+
+    def check_range(self, targets: np.ndarray):
+        outside = (targets < self.lowest) | (targets > self.highest)
+        if np.any(outside):
+            raise WavelengthOutOfRangeError(
+                f"Wavelengths {targets[outside].tolist()} nm are outside the sensor range "
+                f"{self.lowest:.1f} - {self.highest:.1f} nm")
+
+    def band_indices(self, targets: Sequence[float], mode: str = 'nearest') -> np.ndarray:
+        """
+        Index of the band for each target wavelength: the nearest band, or the
+        closest band with a centre at or below (lower) or at or above (upper)
+        the target. Raises WavelengthOutOfRangeError for targets outside the
+        sensor range, or without a lower/upper band.
+        """
+        targets = np.atleast_1d(np.asarray(targets, dtype=float))
+        self.check_range(targets)
+        if mode == 'nearest':
+            return np.searchsorted(self.midpoints, targets)
+        elif mode == 'lower':
+            indices = np.searchsorted(self.wavelengths, targets, side='right') - 1
+            missing = indices < 0
+        elif mode == 'upper':
+            indices = np.searchsorted(self.wavelengths, targets, side='left')
+            missing = indices >= len(self.wavelengths)
+        else:
+            raise ValueError(f"Unknown band mode {mode}, must be one of {band_modes}")
+        if np.any(missing):
+            raise WavelengthOutOfRangeError(
+                f"No {mode} band for wavelengths {targets[missing].tolist()} nm")
+        return indices
+
+
+_sensor_tables = {}
+
+
+def get_sensor_bands(wavelengths: Sequence[float], fwhm: Optional[Sequence[float]] = None) -> SensorBands:
+    """SensorBands for the given wavelengths and FWHM, built once per distinct set"""
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    if fwhm is not None:
+        fwhm = np.asarray(fwhm, dtype=float)
+    key = (wavelengths.tobytes(), None if fwhm is None else fwhm.tobytes())
+    if key not in _sensor_tables:
+        _sensor_tables[key] = SensorBands(wavelengths, fwhm)
+    return _sensor_tables[key]
+
+
+def sensor_bands_from_hdr(hdr_file) -> SensorBands:
+    """SensorBands from the wavelength (and fwhm, if present) of an ENVI header"""
+    meta = metadata.read_hdr(hdr_file)
+    scale = 1000 if meta.get('wavelength units', '').lower().startswith('micro') else 1
+    fwhm = meta.get('fwhm')
+    return get_sensor_bands(meta['wavelength'] * scale, None if fwhm is None else fwhm * scale)
+
+
+def sensor_bands_from_atcor(sensor: str) -> SensorBands:
+    """
+    SensorBands of an ATCOR sensor model in sensormodel_for_ATCOR, from the
+    e0_solar_*.spc file (wavelengths in micrometers)
+    """
+    spcfile = atcor_sensor_dir / sensor / f"e0_solar_{sensor}.spc"
+    table = np.loadtxt(spcfile, skiprows=1)
+    return get_sensor_bands(table[:, 0] * 1000, table[:, 1] * 1000)
+
+
+def get_band_numbers(hdr_file, targets: Sequence[float], mode: str = 'nearest') -> List[int]:
+    """1-based band numbers (as used by GDAL and rasterio) for the target wavelengths"""
+    return (sensor_bands_from_hdr(hdr_file).band_indices(targets, mode) + 1).tolist()
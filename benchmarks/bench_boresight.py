@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Benchmark for evaluating boresight offsets against the GCPs of a      #
+#       PARGE .gcs file in the boresight folder: the vectorized residuals     #
+#       of boresight (all GCPs and offsets at once, serial and in a process   #
+#       pool) versus a loop over offsets and GCPs, and the least-squares fit. #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      numpy, scipy                                                           #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'Jupyter_notebooks'))
+import boresight
+import geometry
+from synthetic import timed
+
+
+def gcp_loop(gcpset, candidates):
+    """RMS error of each candidate offset, one GCP ray at a time"""
+    rms = np.empty(len(candidates))
+    for idx, (droll, dpitch, dheading) in enumerate(candidates):
+        total = 0.0
+        for gcp in gcpset.gcps:
+            line = gcpset.lines[gcp['line']]
+            rotation = geometry.nav_attitude_matrices(line['roll'] + droll, line['pitch'] + dpitch,
+                                                      line['heading'] + dheading)
+            vector = geometry.sensor_look_vectors(gcpset.vinkelx[gcp['pixel']], gcpset.vinkely[gcp['pixel']])
+            north, east, down = rotation @ vector
+            distance = (line['elevation'] - gcp['elevation']) / down
+            total += ((line['easting'] + distance * east - gcp['easting']) ** 2
+                      + (line['northing'] + distance * north - gcp['northing']) ** 2)
+        rms[idx] = np.sqrt(total / len(gcpset))
+    return rms
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark the vectorized boresight residuals against a per-GCP loop.')
+    parser.add_argument('-g', '--gcs', default='20200912_Husky_VNIR_boresight_IFSAR.gcs',
+                        help='.gcs file in the boresight folder (default: %(default)s)')
+    parser.add_argument('-n', '--steps', type=int, default=41,
+                        help='Grid points per offset for the grid search (default: 41)')
+    parser.add_argument('--loop-offsets', type=int, default=200, dest='loopoffsets',
+                        help='Number of grid points evaluated with the loop')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Number of worker processes')
+    args = parser.parse_args()
+
+    gcpset = timed("read_gcs", lambda: boresight.read_gcs(boresight.boresight_dir / args.gcs)).active()
+    print(f"\t{gcpset}")
+    offsets, rms = timed("least-squares fit", lambda: boresight.fit_offsets(gcpset))
+    print(f"\troll {offsets[0]:.3f}, pitch {offsets[1]:.3f}, heading {offsets[2]:.3f} deg, RMS {rms:.2f} m")
+
+    steps = np.linspace(-0.5, 0.5, args.steps)
+    axes = [offset + steps for offset in offsets]
+    candidates = boresight.offset_grid(*axes).reshape(-1, 3)
+    print(f"Grid search, {len(candidates)} offsets x {len(gcpset)} GCPs")
+    serial, _ = timed("grid_search, 1 process", lambda: boresight.grid_search(gcpset, *axes, workers=1))
+    parallel, best = timed("grid_search, process pool", lambda: boresight.grid_search(gcpset, *axes, args.workers))
+    sample = candidates[::max(1, len(candidates) // args.loopoffsets)][:args.loopoffsets]
+    loop = timed(f"per-GCP loop, {len(sample)} offsets", lambda: gcp_loop(gcpset, sample))
+    print(f"\tbest grid point roll {best[0]:.3f}, pitch {best[1]:.3f}, heading {best[2]:.3f} deg, "
+          f"RMS {parallel.min():.2f} m")
+    if not np.array_equal(serial, parallel):
+        raise AssertionError("grid search differs between 1 process and the process pool")
+    deviation = np.abs(boresight.rms_error(gcpset, sample) - loop).max()
+    print(f"\tmax difference to the loop: {deviation:.2e} m")
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Benchmark for preparing the main DEM: dem.warp_dem (reproject and     #
+#       upsample blocks of output rows) versus the merge ->                   #
+#       reproject -> crop -> 5x upsample sequence of notebook 04 with its     #
+#       intermediate GeoTIFFs. Reports wall time and peak RSS, each run in a  #
+#       fresh process, and checks that both write the same grid.             #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      geopandas                                                              #
+#      numpy                                                                  #
+#      rasterio                                                               #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, SUPPRESS
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'Jupyter_notebooks'))
+from instrumentation import peak_rss_mb
+from synthetic import dem_surface, write_dem_tiles
+
+
+def enclosure_for(tilesdir):
+    import geopandas as gp
+    from shapely.geometry import box
+
+    # an enclosure well inside the synthetic tile grid
+    return gp.GeoSeries([box(297000 + 1500, 1667000 - 6500, 297000 + 6500, 1667000 - 1500)], crs="EPSG:3338")
+
+
+def prepare_dem_notebook(tiffiles, enclosure, workdir, resampling='cubic'):
+    """The raster steps of notebook 04 (cells 34-55), for comparison"""
+    import geopandas as gp
+    import rasterio as rio
+    import rasterio.mask
+    from rasterio.merge import merge
+    from rasterio.warp import calculate_default_transform, reproject, Resampling
+
+    enclosure_6N = gp.GeoDataFrame({'geometry': list(enclosure.to_crs("EPSG:32606").envelope)})
+    rasters = [rio.open(tiffile) for tiffile in tiffiles]
+    mosaic, out_trans = merge(rasters)
+    out_meta = rasters[0].meta.copy()
+    out_meta.update({"height": mosaic.shape[1], "width": mosaic.shape[2], "transform": out_trans})
+    with rio.open(workdir / 'aux_IFSAR_mosaic_new.tif', "w", **out_meta) as dst:
+        dst.write(mosaic)
+    del mosaic
+    dst_crs = "EPSG:32606"
+    with rio.open(workdir / 'aux_IFSAR_mosaic_new.tif') as src:
+        transform, width, height = calculate_default_transform(
+            src.crs, dst_crs, src.width, src.height, *src.bounds, resolution=5.0)
+        kwargs = src.meta.copy()
+        kwargs.update({'crs': dst_crs, 'transform': transform, 'width': width, 'height': height})
+        with rio.open(workdir / 'aux_IFSAR_mosaic6N_new.tif', 'w', **kwargs) as dst:
+            reproject(source=rio.band(src, 1), destination=rio.band(dst, 1), src_transform=src.transform,
+                      src_crs=src.crs, dst_transform=transform, dst_crs=dst_crs, resampling=Resampling[resampling])
+    with rio.open(workdir / 'aux_IFSAR_mosaic6N_new.tif') as src:
+        crop, crop_transform = rasterio.mask.mask(src, list(enclosure_6N.geometry), crop=True)
+        crop_meta = src.meta.copy()
+        crop_meta.update({"driver": "GTiff", "height": crop.shape[1], "width": crop.shape[2],
+                          "transform": crop_transform})
+    with rio.open(workdir / 'aux_IFSAR_mosaic_crop6N_new.tif', "w", **crop_meta) as dst:
+        dst.write(crop)
+    del crop
+    with rio.open(workdir / 'aux_IFSAR_mosaic_crop6N_new.tif') as dataset:
+        out_data = dataset.read(out_shape=(dataset.count, int(dataset.height * 5.0), int(dataset.width * 5.0)),
+                                resampling=Resampling[resampling])
+        out_transform = dataset.transform * dataset.transform.scale(
+            (dataset.width / out_data.shape[-1]), (dataset.height / out_data.shape[-2]))
+        out_meta = dataset.meta.copy()
+    out_meta.update({"driver": "ENVI", "height": out_data.shape[1], "width": out_data.shape[2],
+                     "transform": out_transform})
+    outfn = workdir / 'IFSAR_crop_1m_cubic_main.bsq'
+    with rio.open(outfn, "w", **out_meta) as dst:
+        dst.write(out_data)
+    return outfn
+
+
+def run_single(implementation, tilesdir, workdir, resampling):
+    import dem
+
+    tiffiles = sorted(str(fp) for fp in Path(tilesdir).rglob('*.tif'))
+    enclosure = enclosure_for(tilesdir)
+    start = time.perf_counter()
+    if implementation == 'notebook':
+        outfn = prepare_dem_notebook(tiffiles, enclosure, Path(workdir), resampling)
+    else:
+        outfn = dem.warp_dem(tiffiles, enclosure, Path(workdir) / 'IFSAR_crop_1m_cubic_main.bsq',
+                             resampling=resampling)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({'implementation': implementation, 'seconds': elapsed, 'peak_rss_mb': peak_rss_mb(),
+                      'output': str(outfn),
+                      'intermediate_mb': sum(fp.stat().st_size for fp in Path(workdir).glob('aux_*')) / 2**20}))
+
+
+def surface_error(outfn):
+    """Shape, transform and mean and max absolute difference of the DEM to the synthetic terrain (data pixels, m)"""
+    import rasterio as rio
+    from rasterio.warp import transform as transform_coords
+
+    with rio.open(outfn) as src:
+        elevation = src.read(1)
+        rows, cols = np.mgrid[0:src.height:50, 0:src.width:50]
+        xs, ys = rio.transform.xy(src.transform, rows.ravel(), cols.ravel())
+        ax, ay = transform_coords(src.crs, "EPSG:3338", xs, ys)
+        diff = np.abs(elevation[rows.ravel(), cols.ravel()] - dem_surface(np.array(ax), np.array(ay)))
+        valid = elevation[rows.ravel(), cols.ravel()] != src.nodata
+        return elevation.shape, src.transform, diff[valid].mean(), diff[valid].max()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark the main DEM preparation against the steps of notebook 04.')
+    parser.add_argument('-n', '--grid', type=int, default=4, help='Tile grid size (n x n tiles of 2 x 2 km)')
+    parser.add_argument('-r', '--resampling', default='cubic', choices=('nearest', 'bilinear', 'cubic'))
+    parser.add_argument('--single', nargs=3, help=SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        run_single(*args.single, args.resampling)
+        sys.exit()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tilesdir = Path(tmpdir) / 'tiles'
+        write_dem_tiles(tilesdir, tilerows=args.grid, tilecols=args.grid, tilesize=400)
+        print(f"{args.grid ** 2} tiles of 400 x 400 pixels at 5 m, {args.resampling} resampling")
+        grids = {}
+        for implementation in ('notebook', 'warp_dem'):
+            workdir = Path(tmpdir) / implementation
+            workdir.mkdir()
+            output = subprocess.run([sys.executable, __file__, '--single', implementation, str(tilesdir),
+                                     str(workdir), '-r', args.resampling],
+                                    check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            shape, transform, meanerr, maxerr = surface_error(result['output'])
+            grids[implementation] = (shape, transform)
+            rss = f"{result['peak_rss_mb']:8.1f} MB" if result['peak_rss_mb'] is not None else f"{'':11s}"
+            print(f"\t{implementation:10s} {result['seconds']:8.3f} s  peak RSS {rss}  "
+                  f"intermediate files {result['intermediate_mb']:7.1f} MB  output {shape[1]} x {shape[0]}  "
+                  f"terrain error mean {meanerr:.3f} m, max {maxerr:.3f} m")
+        if grids['warp_dem'][0] != grids['notebook'][0] or not grids['warp_dem'][1].almost_equals(
+                grids['notebook'][1], precision=1e-6):
+            raise AssertionError(f"warp_dem grid {grids['warp_dem']} differs from the notebook {grids['notebook']}")
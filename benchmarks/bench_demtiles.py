@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Benchmark for finding the DEM tiles of a flightline enclosure:        #
+#       the GeoPackage tile index of dem.py (build, incremental update,       #
+#       query) versus the os.walk + read_file + iterrows loop of notebook 04. #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      geopandas                                                              #
+#      rasterio                                                               #
+#      shapely                                                                #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+import glob
+import os
+import sys
+import tempfile
+from argparse import ArgumentParser
+from pathlib import Path
+
+import geopandas as gp
+from shapely.geometry import box
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'Jupyter_notebooks'))
+import dem
+from synthetic import timed, write_dem_tiles
+
+
+def find_tiles_notebook(tilesdir, enclosure):
+    """Case 2 of notebook 04: read every tile index Shapefile, test each footprint"""
+    shplist = [
+        (folder, glob.glob(os.path.join(folder, "*.shp"))[0])
+        for (folder, dirlist, filelist) in os.walk(tilesdir)
+        if len(glob.glob(os.path.join(folder, "*.shp"))) > 0]
+    tiffiles = []
+    for foldername, shppth in shplist:
+        footprint = gp.read_file(shppth)
+        for idx, row in footprint.iterrows():
+            if not row["geometry"].intersection(enclosure).is_empty:
+                tiffiles.append(os.path.join(foldername, row["location"]))
+    return tiffiles
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark the DEM tile index against the tile search of notebook 04.')
+    parser.add_argument('-n', '--grid', type=int, default=30, help='Tile grid size (n x n tiles)')
+    parser.add_argument('--per-folder', type=int, default=10, dest='per_folder', help='Tiles per folder')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tilesdir = Path(tmpdir) / 'tiles'
+        write_dem_tiles(tilesdir, tilerows=args.grid, tilecols=args.grid, tilesize=16,
+                        tiles_per_folder=args.per_folder)
+        # a flightline enclosure across a few tiles (tiles are 80 m here)
+        enclosure = box(297000 + 300, 1667000 - 900, 297000 + 1100, 1667000 - 200)
+        print(f"{args.grid ** 2} tiles in {-(-args.grid ** 2 // args.per_folder)} folders")
+
+        expected = timed("notebook 04: os.walk + read_file + iterrows",
+                         lambda: find_tiles_notebook(tilesdir, enclosure))
+        timed("update_tile_index (build)", lambda: dem.update_tile_index(tilesdir))
+        timed("update_tile_index (unchanged)", lambda: dem.update_tile_index(tilesdir))
+        index = timed("load_tile_index", lambda: dem.load_tile_index(tilesdir / dem.tile_index_name))
+        tiles = timed("query_tiles (first, builds STRtree)", lambda: dem.query_tiles(index, enclosure))
+        tiles = timed("query_tiles", lambda: dem.query_tiles(index, enclosure))
+        print(f"\t{len(tiles)} tiles found, same as notebook: {sorted(tiles['tiffile']) == sorted(expected)}")
+
+        write_dem_tiles(Path(tmpdir) / 'tiles' / 'added', tilerows=1, tilecols=args.per_folder, tilesize=16,
+                        origin=(297000.0, 1667000.0 + 80), tiles_per_folder=args.per_folder)
+        index = timed("update_tile_index (one folder added)", lambda: dem.update_tile_index(tilesdir))
+        print(f"\t{len(index)} tiles in the index")
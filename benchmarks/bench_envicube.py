@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Benchmark for reading ENVI cubes: envicube.EnviCube memmap views      #
+#       versus rasterio.read, for band, window and single-spectrum access,    #
+#       in BSQ, BIL and BIP interleave.                                       #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      numpy                                                                  #
+#      rasterio                                                               #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import rasterio as rio
+from rasterio.windows import Window
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'Jupyter_notebooks'))
+import envicube
+from synthetic import write_envi_cube
+
+
+def timed(label, func, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    print(f"\t{label:44s} {(time.perf_counter() - start) / repeat:8.4f} s")
+    return result
+
+
+def touched(view):
+    """The view, after summing it so that its values are actually read from the file"""
+    view.sum()
+    return view
+
+
+def access_patterns(path, band, rows, cols, pixels):
+    """(label, rasterio function, EnviCube function) of each access pattern"""
+    cube = envicube.EnviCube(path)
+    window = Window.from_slices(rows, cols)
+
+    def rio_spectra():
+        with rio.open(path) as src:
+            return np.array([src.read(window=Window(sample, line, 1, 1))[:, 0, 0] for line, sample in pixels])
+
+    def rio_read(**kwargs):
+        with rio.open(path) as src:
+            return src.read(**kwargs)
+
+    return [
+        (f"band {band + 1}", lambda: rio_read(indexes=band + 1), lambda: cube.band(band)),
+        (f"window {rows.stop - rows.start} x {cols.stop - cols.start}, all bands",
+         lambda: rio_read(window=window), lambda: cube.window(rows, cols)),
+        (f"{len(pixels)} single spectra", rio_spectra,
+         lambda: np.array([cube.spectrum(line, sample) for line, sample in pixels])),
+    ]
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark memory-mapped ENVI access against rasterio.read.')
+    parser.add_argument('--lines', type=int, default=2000, help='Number of lines of the synthetic cube')
+    parser.add_argument('--samples', type=int, default=1000, help='Number of samples of the synthetic cube')
+    parser.add_argument('--bands', type=int, default=459, help='Number of bands of the synthetic cube')
+    parser.add_argument('--window', type=int, default=256, help='Size of the square window')
+    parser.add_argument('--pixels', type=int, default=200, help='Number of single spectra')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed repetitions')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    band = args.bands // 2
+    rows = slice(args.lines // 3, args.lines // 3 + args.window)
+    cols = slice(args.samples // 3, args.samples // 3 + args.window)
+    pixels = list(zip(rng.integers(0, args.lines, args.pixels).tolist(),
+                      rng.integers(0, args.samples, args.pixels).tolist()))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for interleave in ('bsq', 'bil', 'bip'):
+            path = write_envi_cube(Path(tmpdir) / f"cube_{interleave}.{interleave}", args.lines, args.samples,
+                                   args.bands, interleave=interleave)
+            print(f"{interleave.upper()} cube, {args.bands} bands x {args.lines} lines x {args.samples} samples")
+            for label, rio_func, cube_func in access_patterns(path, band, rows, cols, pixels):
+                expected = timed(f"rasterio.read: {label}", rio_func, args.repeat)
+                result = timed(f"EnviCube: {label}", lambda: touched(cube_func()), args.repeat)
+                if not np.array_equal(expected, result):
+                    raise AssertionError(f"EnviCube and rasterio differ for {label} ({interleave})")
+            path.unlink()
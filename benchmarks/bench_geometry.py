@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Benchmark for the per-pixel view geometry (geometry.write_geometry)   #
+#       of a synthetic flightline, and check of the view angles against the   #
+#       GCPs of a PARGE .gcs file in the boresight folder: the ray of each    #
+#       GCP pixel, cast with geometry.view_angles from its scan line, must    #
+#       meet the GCP as the rays of boresight.ground_points do.               #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      numpy, scipy                                                           #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+import datetime as dt
+import sys
+import tempfile
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'Jupyter_notebooks'))
+import boresight
+import geometry
+from synthetic import timed, write_nav_file
+
+
+def view_ground_points(gcpset, offsets=(0.0, 0.0, 0.0)):
+    """Easting and northing of the GCP pixel rays from the view zenith and azimuth of geometry.view_angles"""
+    lines = gcpset.lines[gcpset.gcps['line']].copy()
+    for name, offset in zip(('roll', 'pitch', 'heading'), offsets):
+        lines[name] += offset
+    vectors = geometry.sensor_look_vectors(gcpset.vinkelx, gcpset.vinkely)
+    zenith, azimuth = geometry.view_angles(lines, vectors)
+    rows = np.arange(len(gcpset))
+    zenith, azimuth = np.radians(zenith[rows, gcpset.gcps['pixel']]), np.radians(azimuth[rows, gcpset.gcps['pixel']])
+    # the azimuth is that of the sensor as seen from the ground
+    distance = (lines['elevation'] - gcpset.gcps['elevation']) * np.tan(zenith)
+    return lines['easting'] - distance * np.sin(azimuth), lines['northing'] - distance * np.cos(azimuth)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark the view geometry and check it against the GCPs of a .gcs file.')
+    parser.add_argument('-g', '--gcs', default='20200912_Husky_VNIR_boresight_IFSAR.gcs',
+                        help='.gcs file in the boresight folder (default: %(default)s)')
+    parser.add_argument('--sensor', default='VNIR', choices=list(geometry.sensors),
+                        help='Sensor of the .gcs file (default: %(default)s)')
+    parser.add_argument('--rows', type=int, default=20000, help='Number of scan lines of the synthetic flightline')
+    args = parser.parse_args()
+
+    sensormodelpath = geometry.sensormodel_dir / geometry.sensors[args.sensor]['rotated']
+    gcpset = boresight.read_gcs(boresight.boresight_dir / args.gcs).active().with_sensormodel(sensormodelpath)
+    offsets, fitted = boresight.fit_offsets(gcpset)
+    print(f"{gcpset}, fitted offsets roll {offsets[0]:.3f}, pitch {offsets[1]:.3f}, heading {offsets[2]:.3f} deg")
+    for label, candidate in (('zero offsets', np.zeros(3)), ('fitted offsets', offsets)):
+        easting, northing = view_ground_points(gcpset, candidate)
+        expected = boresight.ground_points(gcpset, candidate)
+        rms = np.sqrt(((easting - gcpset.gcps['easting']) ** 2 + (northing - gcpset.gcps['northing']) ** 2).mean())
+        deviation = np.hypot(easting - expected[0], northing - expected[1]).max()
+        print(f"\tview_angles rays, {label:15s} RMS to the GCPs {rms:8.2f} m, "
+              f"max difference to boresight.ground_points {deviation:.2e} m")
+        if deviation > 1e-3:
+            raise AssertionError(f"view_angles rays differ from boresight.ground_points by {deviation:.3f} m")
+    if rms > 2 * fitted + 1:
+        raise AssertionError(f"view_angles rays miss the GCPs by {rms:.2f} m RMS with the fitted offsets")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        navpath = write_nav_file(Path(tmpdir) / f"line_01{geometry.sensors[args.sensor]['navfilepattern']}", args.rows)
+        reference = dt.datetime(2020, 7, 10, 20, tzinfo=dt.timezone.utc)
+        print(f"View and solar geometry of {args.rows} scan lines x {len(geometry.read_sensormodel(sensormodelpath)[0])} "
+              f"pixels")
+        for dtype in ('float32', 'float16'):
+            timed(f"write_geometry, {dtype}", lambda: geometry.write_geometry(
+                navpath, sensormodelpath, Path(tmpdir) / f"line_01_{dtype}", reference, dtype))
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Benchmark for ENVI header parsing on 459-band headers:                #
+#       metadata.read_hdr (uncached, disk cache, memory cache) versus the     #
+#       line-based hdrfile_to_dict as used in notebook 09.                    #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      numpy                                                                  #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'Jupyter_notebooks'))
+import metadata
+from synthetic import hyspex_wavelengths
+
+
+def write_header(path, bands=459, values_per_line=6):
+    """A header laid out like the ATCOR output headers, with multi-line arrays"""
+    def multiline(values):
+        return "{\n " + ",\n ".join(", ".join(values[idx:idx + values_per_line])
+                                     for idx in range(0, len(values), values_per_line)) + "}"
+    wavelengths = hyspex_wavelengths(bands)
+    with open(path, 'w') as dst:
+        dst.write("ENVI\ndescription = {\n  Synthetic header for benchmarking}\n")
+        dst.write(f"samples = 1800\nlines = 20000\nbands = {bands}\nheader offset = 0\n")
+        dst.write("file type = ENVI Standard\ndata type = 2\ninterleave = bsq\nbyte order = 0\n")
+        dst.write("acquisition date = 2020-07-10\nacquisition start time = 20:15:03\n")
+        dst.write(f"band names = {multiline([f'Band {idx} refl [%*100]' for idx in range(1, bands + 1)])}\n")
+        dst.write(f"wavelength = {multiline([f'{wvl:.6f}' for wvl in wavelengths])}\n")
+        dst.write(f"fwhm = {multiline([f'{val:.6f}' for val in np.gradient(wavelengths)])}\n")
+        dst.write("wavelength units = nm\n")
+
+
+def wavelength_hdrfile_to_dict(path):
+    """Wavelength parsing as in notebook 09"""
+    return np.fromstring(metadata.hdrfile_to_dict(path)['wavelength'].strip(' {}'), dtype=float, sep=',')
+
+
+def timed(label, func, paths):
+    start = time.perf_counter()
+    for path in paths:
+        func(path)
+    elapsed = time.perf_counter() - start
+    print(f"\t{label:38s} {elapsed * 1000 / len(paths):8.3f} ms per header")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark ENVI header parsing.')
+    parser.add_argument('-n', '--headers', type=int, default=200, help='Number of headers')
+    parser.add_argument('--bands', type=int, default=459, help='Number of bands per header')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        metadata.hdr_cache_dir = Path(tmpdir) / 'cache'
+        paths = [Path(tmpdir) / f"line_{idx:03d}.hdr" for idx in range(args.headers)]
+        for path in paths:
+            write_header(path, args.bands)
+        expected = wavelength_hdrfile_to_dict(paths[0])
+        assert np.allclose(metadata.read_hdr(paths[0], cache=False)['wavelength'], expected)
+
+        print(f"{args.headers} headers with {args.bands} bands")
+        timed("hdrfile_to_dict + np.fromstring", wavelength_hdrfile_to_dict, paths)
+        timed("read_hdr, no cache", lambda path: metadata.read_hdr(path, cache=False), paths)
+        timed("read_hdr, first run (fills cache)", metadata.read_hdr, paths)
+        metadata._hdr_memcache.clear()
+        timed("read_hdr, disk cache", metadata.read_hdr, paths)
+        timed("read_hdr, memory cache", metadata.read_hdr, paths)
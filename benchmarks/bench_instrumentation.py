@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Benchmark for the overhead of the stage instrumentation               #
+#       (instrumentation.py) on the wrapped hot paths: the cached NAV read    #
+#       (many short calls) and the flightline mask, without a session, with   #
+#       a session recording the stages and with cProfile.                     #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      numpy, rasterio                                                        #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+import contextlib
+import io
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'Jupyter_notebooks'))
+import instrumentation
+import masking
+import navfile
+from synthetic import write_envi_cube, write_nav_file
+
+
+def timed(label, func, repeat):
+    start = time.perf_counter()
+    # masking prints a line per mask
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            result = func()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"\t{label:44s} {elapsed * 1e3:10.3f} ms per call")
+    return result, elapsed
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark the overhead of the stage instrumentation.')
+    parser.add_argument('--lines', type=int, default=4000, help='Number of lines of the synthetic _geo files')
+    parser.add_argument('--samples', type=int, default=1800, help='Number of samples of the synthetic _geo files')
+    parser.add_argument('--nav-calls', type=int, default=2000, dest='navcalls', help='Number of cached NAV reads')
+    parser.add_argument('--mask-calls', type=int, default=3, dest='maskcalls', help='Number of masks computed')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        navpath = write_nav_file(tmpdir / '20200710-CPC_01_VNIR_1800_SN00812_FOVx2_raw.txt')
+        navfile.read_nav(navpath)
+        geofiles = [write_envi_cube(tmpdir / f"20200710-CPC_01_{name}.bsq", args.lines, args.samples, bands=3,
+                                    dtype='float32', seed=idx)
+                    for idx, name in enumerate(('vnir_geo', 'swir_geo', 'vnir_geo_sca', 'swir_geo_sca'))]
+        print(f"Cached NAV read, {args.navcalls} calls; mask of four {args.lines} x {args.samples} _geo files")
+
+        results = {}
+        for label, report, profiler in (('no session', None, None),
+                                        ('session', tmpdir / 'report.json', None),
+                                        ('session with cProfile', tmpdir / 'report_profiled.json', 'cprofile')):
+            print(label)
+            with instrumentation.session(report, profiler):
+                timed("navfile.read_nav", lambda: navfile.read_nav(navpath), args.navcalls)
+                results[label], _ = timed("masking.getflightlinemask", lambda: masking.getflightlinemask(*geofiles),
+                                          args.maskcalls)
+        for label, mask in results.items():
+            if not np.array_equal(mask[0], results['no session'][0]):
+                raise AssertionError(f"mask differs with {label}")
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Benchmark for the flightline edge mask: batched maskarray versus      #
+#       the per-row np.apply_along_axis(maskrow) implementation.              #
+#       Also checks that both produce identical masks.                        #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      numpy                                                                  #
+#      rasterio                                                               #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+import sys
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'Jupyter_notebooks'))
+import masking as msk
+
+
+def synthetic_band(lines, pixels, seed=0, dtype='float32'):
+    """Band with nodata wedges of varying width at both swath edges and a few empty lines"""
+    rng = np.random.default_rng(seed)
+    band = rng.uniform(1, 1000, size=(lines, pixels)).astype(dtype)
+    rows = np.arange(lines)
+    left = (pixels * (0.05 + 0.25 * rows / lines)).astype(int)
+    right = (pixels * (0.95 - 0.25 * (lines - rows) / lines)).astype(int)
+    cols = np.arange(pixels)
+    band[(cols < left[:, np.newaxis]) | (cols > right[:, np.newaxis])] = 0
+    band[rng.integers(0, lines, size=max(lines // 1000, 1))] = 0
+    return band
+
+
+def perrow_mask(bands, lprop=0.0, rprop=0.0):
+    """The mask as getflightlinemask used to compute it"""
+    outdata = np.ones(bands[0].shape)
+    for band in bands:
+        outdata = outdata * np.apply_along_axis(msk.maskrow, 1, band, lprop=lprop, rprop=rprop)
+    return outdata.astype('int16')
+
+
+def batched_mask(bands, lprop=0.0, rprop=0.0):
+    outdata = np.ones(bands[0].shape, dtype='int16')
+    for band in bands:
+        msk.maskarray(band, lprop, rprop, out=outdata)
+    return outdata
+
+
+def timeit(func, *args, repeat=1, **kwargs):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def check_equivalence():
+    """Small randomized equivalence check, including reversesign and all-nodata rows"""
+    rng = np.random.default_rng(42)
+    for _ in range(50):
+        lines, pixels = rng.integers(1, 60), rng.integers(1, 80)
+        band = rng.choice([0.0, 0.0, 1.5, -2.0], size=(lines, pixels))
+        lprop, rprop = rng.choice([0.0, 0.1, 0.2, 0.5], size=2)
+        reversesign = bool(rng.integers(0, 2))
+        expected = np.apply_along_axis(
+            msk.maskrow, 1, band, lprop=lprop, rprop=rprop, reversesign=reversesign).astype('int16')
+        result = msk.maskarray(band, lprop, rprop, reversesign=reversesign, blocksize=7)
+        if not np.array_equal(expected, result):
+            raise AssertionError(f"maskarray differs from maskrow (lprop={lprop}, rprop={rprop}, "
+                                 f"reversesign={reversesign})")
+    print("maskarray matches maskrow on randomized rows")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark batched versus per-row flightline masking.')
+    parser.add_argument('--lines', type=int, default=20000, help='Number of scan lines (rows)')
+    parser.add_argument('--pixels', type=int, default=2000, help='Number of pixels per line (columns)')
+    parser.add_argument('--lprop', type=float, default=0.0, help='Inward extension on the left')
+    parser.add_argument('--rprop', type=float, default=0.1, help='Inward extension on the right')
+    args = parser.parse_args()
+
+    check_equivalence()
+
+    bands = [synthetic_band(args.lines, args.pixels, seed=seed) for seed in range(4)]
+    print(f"Four synthetic bands of {args.lines} x {args.pixels} pixels")
+    t_old, old = timeit(perrow_mask, bands, args.lprop, args.rprop)
+    print(f"\tper-row apply_along_axis(maskrow): {t_old:8.3f} s")
+    t_new, new = timeit(batched_mask, bands, args.lprop, args.rprop, repeat=3)
+    print(f"\tbatched maskarray:                 {t_new:8.3f} s")
+    print(f"\tspeedup: {t_old / t_new:.1f}x, identical output: {np.array_equal(old, new)}")
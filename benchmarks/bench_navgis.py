@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Benchmark for converting NAV files to a flightline GIS file:          #
+#       navgis.nav_to_gis with simplified tracks versus notebook 02, which    #
+#       builds one Point per scan line and a LineString from them.            #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      geopandas                                                              #
+#      numpy                                                                  #
+#      shapely                                                                #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+import sys
+import tempfile
+from argparse import ArgumentParser
+from pathlib import Path
+
+import geopandas as gp
+import pandas as pd
+from shapely.geometry import LineString
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'Jupyter_notebooks'))
+import navfile
+import navgis
+from synthetic import timed, write_nav_file
+
+
+def nav_to_gis_notebook(navpaths, outfile):
+    """Notebook 02 (cells 11-18)"""
+    geodfs = []
+    for fpath in navpaths:
+        datatable = pd.DataFrame(navfile.read_nav(fpath))
+        datatable = datatable[datatable.lat > 0]
+        geodf = gp.GeoDataFrame(datatable, geometry=gp.points_from_xy(datatable.lon, datatable.lat))
+        geodfs.append(geodf)
+    flightlines = [LineString(geodf['geometry'].tolist()) for geodf in geodfs]
+    flightseries = gp.GeoSeries(flightlines, crs="EPSG:4326")
+    flightseries.to_file(outfile, driver="ESRI Shapefile")
+    return flightseries
+
+
+def output_mb(outfile):
+    return sum(fp.stat().st_size for fp in outfile.parent.glob(f"{outfile.stem}.*")) / 2**20
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark the NAV to GIS conversion against notebook 02.')
+    parser.add_argument('-n', '--lines', type=int, default=40, help='Number of flightlines')
+    parser.add_argument('--rows', type=int, default=30000, help='Number of scan lines per flightline')
+    parser.add_argument('-t', '--tolerance', type=float, default=1.0, help='Douglas-Peucker tolerance in m')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        navfile.nav_cache_dir = tmpdir / 'cache'
+        navpaths = [write_nav_file(tmpdir / f"20210911-DC_{idx + 1:02d}_VNIR_1800_SN00812_FOVx2_raw.txt", args.rows,
+                                   68400 + 900 * idx, heading=(37 * idx) % 360, wander=0.05, seed=idx)
+                    for idx in range(args.lines)]
+        print(f"{args.lines} flightlines with {args.rows} scan lines")
+        for navpath in navpaths:
+            navfile.read_nav(navpath)
+        flightseries = timed("notebook 02 (Points, LineString, Shapefile)",
+                             lambda: nav_to_gis_notebook(navpaths, tmpdir / 'notebook.shp'))
+        flightlines = timed(f"nav_to_gis, tolerance {args.tolerance} m (GeoPackage)",
+                            lambda: navgis.nav_to_gis(navpaths, tmpdir / 'nav_to_gis.gpkg', args.tolerance))
+        print(f"\toutput size: notebook {output_mb(tmpdir / 'notebook.shp'):.2f} MB, "
+              f"nav_to_gis {output_mb(tmpdir / 'nav_to_gis.gpkg'):.2f} MB, "
+              f"{flightlines['vertices'].sum()} instead of {flightlines['scanlines'].sum()} vertices")
+        # largest distance of a scan line position from the simplified track
+        deviation = max(full.hausdorff_distance(simple) for full, simple in zip(
+            flightseries.to_crs(navgis.metric_crs), flightlines.geometry.to_crs(navgis.metric_crs)))
+        print(f"\tmax distance of the full tracks from the simplified ones: {deviation:.3f} m")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Benchmark for the campaign navigation summary: vectorized             #
+#       navigation.summarize_flightlines with NumPy solar positions versus    #
+#       the per-line loop of notebook 07 with np.loadtxt and pysolar.         #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      numpy                                                                  #
+#      pysolar                                                                #
+#      pytz                                                                   #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+import datetime as dt
+import sys
+import tempfile
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pytz
+from pysolar import solar
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'Jupyter_notebooks'))
+import navfile
+import navigation
+from synthetic import timed, write_nav_file
+
+
+def summarize_per_line(navpaths, references):
+    """Per-line summary as in notebook 07, returns (zenith, azimuth) per line"""
+    results = []
+    for navpath, origts in zip(navpaths, references):
+        navdata = np.loadtxt(navpath, dtype={'names': ('line', 'lon', 'lat', 'height', 'roll', 'pitch', 'heading',
+                                                       'tstamp'),
+                                             'formats': ('<i4', '<f8', '<f8', '<f8', '<f8', '<f8', '<f8', '<f8')})
+        middle = len(navdata) // 2
+        navigation.avg_angle(navdata['heading'])
+        for name in ['roll', 'pitch']:
+            navdata[name].mean()
+            navdata[name].std()
+        navdata['height'].mean()
+        datestamp = navigation.nav_datetime(navdata['tstamp'][middle], origts)
+        azimuth = solar.get_azimuth(navdata['lat'][middle], navdata['lon'][middle], datestamp)
+        zenith = 90 - solar.get_altitude(navdata['lat'][middle], navdata['lon'][middle], datestamp, pressure=0)
+        results.append((zenith, azimuth))
+    return np.array(results)
+
+
+def along_track_pysolar(navdatas, references, step):
+    zeniths = []
+    for navdata, origts in zip(navdatas, references):
+        for row in navdata[::step]:
+            datestamp = navigation.nav_datetime(row['timestamp'], origts)
+            zeniths.append(90 - solar.get_altitude(row['lat'], row['lon'], datestamp, pressure=0))
+    return np.array(zeniths)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark the campaign navigation summary and solar geometry.')
+    parser.add_argument('-n', '--lines', type=int, default=40, help='Number of flightlines')
+    parser.add_argument('--rows', type=int, default=20000, help='Number of scan lines per flightline')
+    parser.add_argument('--step', type=int, default=100, help='Along-track solar position every Nth scan line')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        navfile.nav_cache_dir = Path(tmpdir) / 'cache'
+        starts = 68400 + 900 * np.arange(args.lines)
+        navpaths = [write_nav_file(Path(tmpdir) / f"line_{idx:02d}_raw.txt", args.rows, start, seed=idx)
+                    for idx, start in enumerate(starts)]
+        references = [pytz.utc.localize(dt.datetime(2021, 8, 3) + dt.timedelta(seconds=int(start)))
+                      for start in starts]
+        names = [path.stem for path in navpaths]
+        print(f"{args.lines} flightlines with {args.rows} scan lines")
+
+        expected = timed("per line: np.loadtxt + pysolar", lambda: summarize_per_line(navpaths, references))
+        navdatas = timed("read_nav (parse, write cache)", lambda: [navfile.read_nav(path) for path in navpaths])
+        navdatas = timed("read_nav (cached)", lambda: [navfile.read_nav(path) for path in navpaths])
+        summary, _ = timed("summarize_flightlines", lambda: navigation.summarize_flightlines(
+            names, navdatas, references))
+        print(f"\tmax difference to pysolar: zenith {np.abs(summary['sun_zenith'] - expected[:, 0]).max():.4f} deg, "
+              f"azimuth {np.abs(summary['sun_azimuth'] - expected[:, 1]).max():.4f} deg")
+
+        # synthetic.write_nav_file writes seconds of day; NAV files can also count seconds over several days
+        print("NAV timestamps two days on (reduced to seconds of day)")
+        shifted = []
+        for navdata in navdatas:
+            navdata = navdata.copy()
+            navdata['timestamp'] += 2 * 86400
+            shifted.append(navdata)
+        shiftedsummary, _ = timed("summarize_flightlines", lambda: navigation.summarize_flightlines(
+            names, shifted, references))
+        if not np.array_equal(shiftedsummary, summary):
+            raise AssertionError("summary differs with NAV timestamps over 86400 s")
+        expected = [dt.datetime.combine(reference.date(), dt.time()) +
+                    dt.timedelta(seconds=dt.timedelta(seconds=navdata['timestamp'][len(navdata) // 2]).seconds)
+                    for navdata, reference in zip(shifted, references)]
+        result = [navigation.nav_datetime(navdata['timestamp'][len(navdata) // 2], reference).replace(
+            tzinfo=None, microsecond=0) for navdata, reference in zip(shifted, references)]
+        if result != expected:
+            raise AssertionError("nav_datetime differs from the day of notebook 07")
+
+        print(f"Along-track solar zenith every {args.step} scan lines")
+        zeniths = timed("pysolar per scan line", lambda: along_track_pysolar(navdatas, references, args.step))
+        _, alongtrack = timed("summarize_flightlines with step", lambda: navigation.summarize_flightlines(
+            names, navdatas, references, step=args.step))
+        print(f"\tmax difference to pysolar: zenith "
+              f"{np.abs(np.concatenate(alongtrack)['sun_zenith'] - zeniths).max():.4f} deg")
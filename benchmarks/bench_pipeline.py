@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Benchmark for the pipeline runner (scripts/run_pipeline.py) on a      #
+#       synthetic project: a full run, a re-run with everything up to date,  #
+#       a re-run after touching the NAV files (same content, new mtime) and   #
+#       one after changing one NAV file, versus re-running every stage.       #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      gdal, geopandas, numpy, pyproj, rasterio                               #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+import json
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+from pyproj import Transformer
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'Jupyter_notebooks'))
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'scripts'))
+import run_pipeline
+from pipeline import run_tasks
+from synthetic import write_dem_tiles, write_envi_cube, write_nav_file
+
+prefix = '20200710-CPC'
+
+
+def write_project(projectdir, lines, samples, cubelines):
+    """Flightline folders with NAV files, a radiance header, PARGE _geo files and a supercube each"""
+    # flightlines across the middle of the synthetic tile grid
+    to_wgs84 = Transformer.from_crs("EPSG:3338", "EPSG:4326", always_xy=True)
+    for idx in range(lines):
+        name = f"{prefix}_{idx + 1:02d}"
+        linedir = projectdir / name
+        for subdir in ('NAV', 'RAD', 'Parge_with_offsets', 'ATCOR', 'ELE'):
+            (linedir / subdir).mkdir(parents=True, exist_ok=True)
+        lon, lat = to_wgs84.transform(297000 + 1000, 1667000 - 1000 - 500 * idx)
+        write_nav_file(linedir / 'NAV' / f"{name}_VNIR_1800_SN00812_FOVx2_raw.txt", rows=3000, lat=lat, lon=lon,
+                       start=72000.0 + 600 * idx, seed=idx)
+        ref = write_envi_cube(linedir / 'RAD' / f"{name}_ref.bsq", 4, 4, bands=4)
+        os.replace(ref.with_suffix('.hdr'), linedir / 'RAD' / f"{name}_VNIR_1800_SN00812_FOVx2_raw_rad_bsq_float32.hdr")
+        os.remove(ref)
+        for sensor in (run_pipeline.vnir_sensor, run_pipeline.swir_sensor):
+            for suffix, bands in (('geo', 4), ('geo_sca', 4)):
+                write_envi_cube(linedir / 'Parge_with_offsets' / f"{name}_{sensor}_raw_rad_bsq_float32_{suffix}.bsq",
+                                cubelines, samples, bands=bands, dtype='float32', seed=idx)
+        write_envi_cube(linedir / 'ATCOR' / f"{name}_atm_bcor.bsq", cubelines, samples, seed=idx)
+
+
+def timed_run(label, config, **kwargs):
+    start = time.perf_counter()
+    status, _ = run_tasks(run_pipeline.build_tasks(config), Path(config['projectdir']) / 'pipeline_state.json',
+                          **kwargs)
+    elapsed = time.perf_counter() - start
+    counts = {result: sum(value == result for value in status.values()) for result in set(status.values())}
+    print(f"\t{label:44s} {elapsed:8.3f} s  {counts}")
+    return status, elapsed
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark the pipeline runner on a synthetic project.')
+    parser.add_argument('-n', '--lines', type=int, default=4, help='Number of flightlines')
+    parser.add_argument('--samples', type=int, default=600, help='Samples of the synthetic cubes')
+    parser.add_argument('--cube-lines', type=int, default=800, dest='cubelines', help='Lines of the synthetic cubes')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Number of worker processes')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        projectdir = Path(tmpdir) / 'project'
+        write_dem_tiles(Path(tmpdir) / 'tiles', tilesize=200, resolution=10.0)
+        write_project(projectdir, args.lines, args.samples, args.cubelines)
+        configfile = Path(tmpdir) / 'config.json'
+        configfile.write_text(json.dumps({'projectdir': str(projectdir), 'prefix': prefix,
+                                          'main_dem': {'tilesdir': str(Path(tmpdir) / 'tiles'), 'resolution': 5.0},
+                                          'flightdata': {'every': 100},
+                                          'vis': {'vi_types': ['ndvi', 'evi']},
+                                          'overviews': {'stats': 'sample'}}))
+        config = run_pipeline.read_config(configfile)
+        print(f"{args.lines} flightlines, cubes of {args.cubelines} x {args.samples}")
+
+        _, full = timed_run("full run", config, workers=args.workers)
+        outputs = {fp: os.stat(fp).st_mtime_ns for task in run_pipeline.build_tasks(config) for fp in task.outputs}
+        _, cached = timed_run("re-run, all up to date", config, workers=args.workers)
+        for navpath in projectdir.glob('*/NAV/*_raw.txt'):
+            os.utime(navpath)
+        statefile = projectdir / 'pipeline_state.json'
+        before = statefile.read_bytes()
+        timed_run("dry run after touching the NAV files", config, dry_run=True)
+        if statefile.read_bytes() != before:
+            raise AssertionError("the dry run changed the state file")
+        status, _ = timed_run("re-run after touching the NAV files", config, workers=args.workers)
+        rewritten = [fp for fp, mtime in outputs.items() if os.stat(fp).st_mtime_ns != mtime]
+        if rewritten:
+            raise AssertionError(f"outputs rewritten although no input content changed: {rewritten}")
+        write_nav_file(projectdir / f"{prefix}_01" / 'NAV' / f"{prefix}_01_VNIR_1800_SN00812_FOVx2_raw.txt",
+                       rows=2500, seed=99, lat=64.80, lon=-147.69)
+        status, _ = timed_run("re-run after changing one NAV file", config, workers=args.workers)
+        print(f"\t\tre-run tasks: {', '.join(name for name, result in status.items() if result == 'done')}")
+        _, forced = timed_run("all stages re-run (--force)", config, workers=args.workers, force=True)
+        print(f"\tup-to-date re-run {forced / cached:.0f}x faster than re-running all stages")
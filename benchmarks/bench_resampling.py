@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Benchmark for resampling supercubes to Sentinel-2 bands:              #
+#       resampling.resample_cube (cached sparse weights, one matrix product   #
+#       per block of lines) versus a per-pixel loop, in BSQ, BIL and BIP.     #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      numpy                                                                  #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'Jupyter_notebooks'))
+import envicube
+import resampling
+from synthetic import write_envi_cube
+
+
+def pixel_loop(cube, weights, lines):
+    """Each pixel's spectrum read and multiplied with the dense weight matrix in turn"""
+    out = np.empty((len(weights), lines, cube.samples), dtype='float32')
+    for line in range(lines):
+        for sample in range(cube.samples):
+            out[:, line, sample] = weights @ cube.spectrum(line, sample).astype(float)
+    return out
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"\t{label:44s} {elapsed:8.3f} s")
+    return result, elapsed
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark the spectral resampling against a per-pixel loop.')
+    parser.add_argument('--lines', type=int, default=2000, help='Number of lines of the synthetic cube')
+    parser.add_argument('--samples', type=int, default=1000, help='Number of samples of the synthetic cube')
+    parser.add_argument('--loop-lines', type=int, default=20, dest='looplines',
+                        help='Number of lines resampled with the per-pixel loop')
+    parser.add_argument('-s', '--sensor', default='sentinel2', choices=list(resampling.sensor_bands),
+                        help='Target sensor (default: sentinel2)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        resampling.resampling_cache_dir = tmpdir / 'cache'
+        target = resampling.sensor_bandset(args.sensor)
+        for interleave in ('bsq', 'bil', 'bip'):
+            path = write_envi_cube(tmpdir / f"cube.{interleave}", args.lines, args.samples, interleave=interleave)
+            cube = envicube.EnviCube(path)
+            print(f"{interleave.upper()} cube, {cube.bands} bands x {cube.lines} lines x {cube.samples} samples "
+                  f"to {len(target)} {args.sensor} bands")
+            source = resampling.hdr_bandset(envicube.find_hdr(path))
+            if interleave == 'bsq':
+                resampling._resampler_memcache.clear()
+                resampler, _ = timed("weight matrix, computed", lambda: resampling.get_resampler(source, target))
+                resampling._resampler_memcache.clear()
+                timed("weight matrix, from the .npz cache", lambda: resampling.get_resampler(source, target))
+                print(f"\t{len(resampler.csr['data'])} of {len(target) * cube.bands} weights kept, "
+                      f"{len(resampler.bands)} source bands read")
+            dense = resampling.weight_matrix(source, target)
+            outpath = tmpdir / f"resampled.{interleave}"
+            _, elapsed = timed("resample_cube", lambda: resampling.resample_cube(path, outpath, target))
+            loop, loopelapsed = timed(f"per-pixel loop, {args.looplines} lines",
+                                      lambda: pixel_loop(cube, dense, args.looplines))
+            print(f"\tthroughput: resample_cube {cube.lines * cube.samples / elapsed / 1e6:.2f} Mpixel/s, "
+                  f"loop {args.looplines * cube.samples / loopelapsed / 1e6:.4f} Mpixel/s")
+            resampled = envicube.EnviCube(outpath).cube
+            deviation = np.abs(resampled[:, :args.looplines] - loop).max() / np.abs(loop).max()
+            print(f"\tmax difference to the loop with the dense weights: {deviation:.2e} (relative)")
+            del cube, resampled
+            for fp in tmpdir.glob('*.*'):
+                if fp.is_file():
+                    os.remove(fp)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Benchmark for the ATCOR-4 sensor model: centre wavelength, FWHM and   #
+#       band solar irradiance of the .rsp files of a model in                 #
+#       sensormodel_for_ATCOR with the stacked responses of sensormodel       #
+#       versus a per-band loop, on the same parsed .rsp files; plus the       #
+#       per-band loop of the notebooks (np.loadtxt), the memory cache and     #
+#       the response matrix used for spectral resampling.                     #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      numpy                                                                  #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+import sys
+import tempfile
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'Jupyter_notebooks'))
+import sensormodel
+from synthetic import timed, write_solar_spectrum
+
+
+def band_loop(responses, solar_wavelengths, solar_e0):
+    """Centre, FWHM and E0 one band at a time, from (wavelengths, response) pairs"""
+    centres, fwhm, e0 = [], [], []
+    for wvl, response in responses:
+        half = response.max() / 2
+        above = np.nonzero(response >= half)[0]
+        left = np.interp(half, response[above[0] - 1:above[0] + 1], wvl[above[0] - 1:above[0] + 1])
+        right = np.interp(half, response[above[-1]:above[-1] + 2][::-1], wvl[above[-1]:above[-1] + 2][::-1])
+        centres.append((left + right) / 2)
+        fwhm.append(right - left)
+        e0.append((response * np.interp(wvl, solar_wavelengths, solar_e0)).sum() / response.sum())
+    return np.array(centres), np.array(fwhm), np.array(e0)
+
+
+def notebook_loop(sensordir, solar_wavelengths, solar_e0):
+    """The per-band loop, reading each .rsp file with np.loadtxt"""
+    responses = []
+    for fp in sensormodel.find_rsp_files(sensordir):
+        table = np.loadtxt(fp, skiprows=1)
+        responses.append((table[:, 0], table[:, 1]))
+    return band_loop(responses, solar_wavelengths, solar_e0)
+
+
+def stacked(arrays, solar_wavelengths, solar_e0):
+    return (arrays['centres'], arrays['fwhm'],
+            sensormodel.solar_irradiance(arrays['wavelengths'], arrays['responses'], solar_wavelengths, solar_e0))
+
+
+def stacked_model(sensordir, solar_wavelengths, solar_e0, cache=True):
+    return stacked(sensormodel.load_responses(sensordir, cache=cache), solar_wavelengths, solar_e0)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark the stacked ATCOR sensor model responses against a per-band loop.')
+    parser.add_argument('-s', '--sensor', default='HySpex_459_FoV2_Husky',
+                        help='Sensor model in sensormodel_for_ATCOR (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=20,
+                        help='Repeats of the computations on the parsed responses (default: %(default)s)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sensordir = Path(__file__).resolve().parents[1] / 'sensormodel_for_ATCOR' / args.sensor
+        solar = sensormodel.read_solar_spectrum(write_solar_spectrum(Path(tmpdir) / 'solar.txt'))
+        rspfiles = sensormodel.find_rsp_files(sensordir)
+        print(f"{args.sensor}: {len(rspfiles)} bands")
+        loop = timed("per-band loop, np.loadtxt (notebooks)", lambda: notebook_loop(sensordir, *solar))
+        responses = timed("parse the .rsp files (read_rsp)", lambda: [sensormodel.read_rsp(fp) for fp in rspfiles])
+        arrays = timed("stack the responses", lambda: sensormodel.response_arrays(responses))
+        timed(f"per-band loop on parsed responses, x{args.repeat}",
+              lambda: [band_loop(responses, *solar) for _ in range(args.repeat)])
+        timed(f"stacked responses, x{args.repeat}", lambda: [stacked(arrays, *solar) for _ in range(args.repeat)])
+        result = timed("load_responses, uncached", lambda: stacked_model(sensordir, *solar, cache=False))
+        stacked_model(sensordir, *solar)
+        cached = timed("load_responses, from the memory cache", lambda: stacked_model(sensordir, *solar))
+        timed("response matrix for resampling", lambda: sensormodel.load_responses(sensordir, matrix=True, cache=False))
+        labels = ('centre wavelength (micron)', 'FWHM (micron)', 'E0 (mW/cm2 micron)')
+        for label, expected, computed in zip(labels, loop, result):
+            print(f"\tmax difference {label}: {np.abs(computed - expected).max():.2e}")
+        if not all(np.array_equal(a, b) for a, b in zip(result, cached)):
+            raise AssertionError("cached responses differ")
+        spcfile = sensordir / f"e0_solar_{args.sensor}.spc"
+        if spcfile.exists():
+            table = np.loadtxt(spcfile, skiprows=1)
+            print(f"\tmax difference to {spcfile.name}: centre {np.abs(result[0] - table[:, 0]).max():.2e}, "
+                  f"FWHM {np.abs(result[1] - table[:, 1]).max():.2e} micron")
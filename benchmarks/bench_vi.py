@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Benchmark for generate_vi: block-windowed float32 computation with    #
+#       tiled, compressed output versus reading whole bands.                  #
+#       Reports wall time and peak RSS, each run in a fresh process.          #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      gdal                                                                   #
+#      numpy                                                                  #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, SUPPRESS
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'Jupyter_notebooks'))
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'scripts'))
+from instrumentation import peak_rss_mb
+from synthetic import write_envi_cube
+
+
+def generate_vi_wholeband(input_file, output_file, vi_type):
+    """generate_vi as it was before the windowed implementation, for comparison"""
+    from osgeo import gdal, gdalconst
+    import generate_vi as gvi
+
+    dataset = gdal.Open(str(input_file), gdalconst.GA_ReadOnly)
+    target_bands = gvi.get_band_info(f"{str(input_file).rsplit('.', 1)[0]}.hdr", gvi.indices_to_wavelengths[vi_type])
+    bands = [dataset.GetRasterBand(band).ReadAsArray() for band in target_bands]
+    y_size, x_size = bands[0].shape
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vi_index = np.divide((bands[1] - bands[0]), (bands[1] + bands[0]))
+    outdata = gdal.GetDriverByName("GTiff").Create(str(output_file), x_size, y_size, 1, gdal.GDT_Float32)
+    outdata.SetGeoTransform(dataset.GetGeoTransform())
+    outdata.SetProjection(dataset.GetProjection())
+    outdata.GetRasterBand(1).WriteArray(vi_index)
+    outdata.FlushCache()
+
+
+def run_single(implementation, cube, output, tile_lines):
+    import generate_vi as gvi
+
+    start = time.perf_counter()
+    if implementation == 'wholeband':
+        generate_vi_wholeband(cube, output, 'ndvi')
+    else:
+        gvi.generate_vi(str(cube), str(output), 'ndvi', tile_lines=tile_lines)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({'implementation': implementation, 'seconds': elapsed, 'peak_rss_mb': peak_rss_mb(),
+                      'output_mb': Path(output).stat().st_size / 2**20}))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark windowed versus whole-band vegetation index computation.')
+    parser.add_argument('--lines', type=int, default=20000, help='Number of scan lines')
+    parser.add_argument('--samples', type=int, default=1800, help='Number of pixels per line')
+    parser.add_argument('--bands', type=int, default=459, help='Number of bands')
+    parser.add_argument('--tile-lines', type=int, default=None, help='Lines per window for the windowed run')
+    parser.add_argument('--workdir', default=None, help='Directory for the synthetic cube (default: temporary)')
+    # internal: run a single implementation in this process
+    parser.add_argument('--run', choices=['wholeband', 'windowed'], help=SUPPRESS)
+    parser.add_argument('--cube', help=SUPPRESS)
+    parser.add_argument('--output', help=SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_single(args.run, args.cube, args.output, args.tile_lines)
+        sys.exit()
+
+    with tempfile.TemporaryDirectory(dir=args.workdir) as tmpdir:
+        cube = write_envi_cube(Path(tmpdir) / 'synthetic_VNIR_SWIR_rad_geo_atm_bcor.bsq',
+                               args.lines, args.samples, args.bands)
+        print(f"Synthetic cube: {args.lines} lines x {args.samples} samples x {args.bands} bands, "
+              f"{cube.stat().st_size / 2**30:.2f} GB")
+        for implementation in ['wholeband', 'windowed']:
+            command = [sys.executable, __file__, '--run', implementation, '--cube', str(cube),
+                       '--output', str(Path(tmpdir) / f'{implementation}.tif')]
+            if args.tile_lines:
+                command += ['--tile-lines', str(args.tile_lines)]
+            result = json.loads(subprocess.run(command, check=True, stdout=subprocess.PIPE,
+                                               universal_newlines=True).stdout.strip().splitlines()[-1])
+            rss = f"{result['peak_rss_mb']:8.1f} MB" if result['peak_rss_mb'] is not None else f"{'':11s}"
+            print(f"\t{implementation:10s} {result['seconds']:8.2f} s  peak RSS {rss}  "
+                  f"output {result['output_mb']:8.1f} MB")
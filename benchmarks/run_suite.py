@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Benchmark suite for the processing entry points on a synthetic        #
+#       project with campaign-sized cubes (VNIR 1800 px, SWIR 384 px,         #
+#       457-band supercube) and NAV files: generate_vi,                       #
+#       generate_rgb_overview, masking.getflightlinemask, the navigation      #
+#       summary of notebook 07 and ENVI header parsing.                       #
+#       The results are appended to a JSON history and compared to the       #
+#       previous runs with the same settings on the same host, to flag        #
+#       regressions.                                                          #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      gdal, numpy, rasterio, pytz                                            #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+import contextlib
+import datetime as dt
+import io
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+repodir = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(repodir / 'Jupyter_notebooks'))
+sys.path.insert(0, str(repodir / 'scripts'))
+import generate_rgb_overview
+import generate_vi
+import instrumentation
+import masking
+import metadata
+import navfile
+import navigation
+import resampling
+from parsing import load_manifest, save_manifest
+from synthetic import sensor_presets, write_flightline
+
+prefix = '20200710-CPC'
+default_history = Path(os.environ.get('HYSPEX_CACHE_DIR', Path.home() / '.cache' / 'hyspex_proc')) / \
+    'benchmark_history.json'
+
+
+def clear_caches(projectdir):
+    """Remove the NAV sidecar caches and the parsed header caches, so the next read parses the files"""
+    for cachepath in Path(projectdir).glob('*/NAV/*.npy'):
+        cachepath.unlink()
+    metadata._hdr_memcache.clear()
+    shutil.rmtree(metadata.hdr_cache_dir, ignore_errors=True)
+
+
+def bench_read_hdr(project, args):
+    for _ in range(args.hdr_calls):
+        for paths in project['lines']:
+            for kind in ('vnir', 'swir', 'supercube'):
+                metadata.read_hdr(paths[kind].with_suffix('.hdr'), cache=False)
+
+
+def bench_nav_summary(project, args):
+    navigation.summarize_campaign(project['dir'], prefix, step=args.step)
+
+
+def bench_masking(project, args):
+    paths = project['lines'][0]
+    masking.getflightlinemask(paths['vnir_geo'], paths['swir_geo'], paths['vnir_geo_sca'], paths['swir_geo_sca'])
+
+
+def bench_vi(project, args):
+    generate_vi.generate_vis(str(project['lines'][0]['supercube']), [str(project['out'] / 'vi.tif')],
+                             ['ndvi', 'evi', 'ndwi'])
+
+
+def bench_rgb_overview(project, args):
+    input_files = [str(paths['vnir']) for paths in project['lines']]
+    generate_rgb_overview.generate_image(input_files, [str(project['out'] / f"rgb_{idx:02d}.tif")
+                                                       for idx in range(len(input_files))],
+                                         bands=[1, 2, 3], wavelengths=[640, 550, 460], stats_mode='sample',
+                                         workers=args.workers)
+
+
+# name: (function, function run before each repeat, description, synthetic files read: kinds of
+# write_flightline written in full and header kinds, and whether of all flightlines or of the first only)
+benchmarks = {
+    'read_hdr': (bench_read_hdr, None, "metadata.read_hdr of the VNIR, SWIR and supercube headers, uncached",
+                 ((), ('vnir', 'swir', 'supercube'), True)),
+    'nav_summary': (bench_nav_summary, lambda project: clear_caches(project['dir']),
+                    "navigation.summarize_campaign (notebook 07), NAV files parsed", (('nav',), ('vnir',), True)),
+    'nav_summary_cached': (bench_nav_summary, None, "navigation.summarize_campaign with the NAV and header caches",
+                           (('nav',), ('vnir',), True)),
+    'masking': (bench_masking, None, "masking.getflightlinemask of one flightline",
+                (('vnir_geo', 'swir_geo', 'vnir_geo_sca', 'swir_geo_sca'), (), False)),
+    'vi': (bench_vi, None, "generate_vi.generate_vis, NDVI, EVI and NDWI of one supercube",
+           (('supercube',), (), False)),
+    'rgb_overview': (bench_rgb_overview, None, "generate_rgb_overview.generate_image of the VNIR cubes",
+                     (('vnir',), (), True)),
+}
+
+
+def required_kinds(names, linenum):
+    """Kinds of write_flightline written in full and header kinds the benchmarks read of flightline linenum"""
+    kinds, header_kinds = set(), set()
+    for name in names:
+        full, headers, all_lines = benchmarks[name][3]
+        if all_lines or linenum == 1:
+            kinds.update(full)
+            header_kinds.update(headers)
+    return kinds, header_kinds - kinds
+
+
+def run_benchmark(name, project, args):
+    """Runs a benchmark args.repeat times, returns the median and minimum wall time and the peak RSS"""
+    func, setup, _, _ = benchmarks[name]
+    seconds, peaks = [], []
+    for _ in range(args.repeat):
+        if setup:
+            setup(project)
+        instrumentation.reset_peak_rss()
+        start = time.perf_counter()
+        # the entry points print progress messages
+        with contextlib.redirect_stdout(io.StringIO()):
+            func(project, args)
+        seconds.append(time.perf_counter() - start)
+        peaks.append(instrumentation.peak_rss_mb())
+    return {'seconds': statistics.median(seconds), 'min_seconds': min(seconds),
+            'peak_rss_mb': max(peaks) if None not in peaks else None}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=str(repodir), check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def find_regressions(history, run, threshold, baseline_runs, min_seconds=0.01):
+    """
+    Compares the results of a run to the median of the last baseline_runs runs in the history with the same
+    parameters on the same host. A benchmark more than threshold (fraction) and min_seconds slower is a regression.
+    :return: (name, seconds, baseline seconds) of the regressions, and the names of the benchmarks without baseline
+    """
+    previous = [entry for entry in history if entry['host'] == run['host']
+                and entry['parameters'] == run['parameters']][-baseline_runs:]
+    regressions, new = [], []
+    for name, result in run['results'].items():
+        timings = [entry['results'][name]['seconds'] for entry in previous if name in entry['results']]
+        if not timings:
+            new.append(name)
+            continue
+        baseline = statistics.median(timings)
+        if result['seconds'] > baseline * (1 + threshold) and result['seconds'] - baseline > min_seconds:
+            regressions.append((name, result['seconds'], baseline))
+    return regressions, new
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Run the benchmark suite on a synthetic project and flag regressions.')
+    parser.add_argument('-b', '--benchmarks', nargs='+', choices=list(benchmarks), default=list(benchmarks),
+                        help='Benchmarks to run (default: all)')
+    parser.add_argument('-n', '--flightlines', type=int, default=2, help='Number of flightlines')
+    parser.add_argument('--lines', type=int, default=1000, help='Number of scan lines per flightline')
+    parser.add_argument('--samples', type=int, default=sensor_presets['supercube']['samples'],
+                        help='Samples of the supercubes and _geo files (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Runs per benchmark, the median is recorded')
+    parser.add_argument('--hdr-calls', type=int, default=10, dest='hdr_calls',
+                        help='Times each header is parsed per run of read_hdr')
+    parser.add_argument('--step', type=int, default=100, help='Along-track solar position every Nth scan line')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--history', type=Path, default=default_history,
+                        help='JSON history of the results (default: %(default)s)')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='Slowdown (fraction of the baseline) flagged as a regression (default: %(default)s)')
+    parser.add_argument('--baseline-runs', type=int, default=5, dest='baseline_runs',
+                        help='Number of previous runs the baseline is the median of (default: %(default)s)')
+    parser.add_argument('--no-save', action='store_true', dest='nosave', help="Don't add this run to the history")
+    parser.add_argument('--workdir', default=None, help='Directory for the synthetic project (default: temporary)')
+    args = parser.parse_args()
+
+    history = load_manifest(args.history).get('runs', [])
+    run = {'timestamp': dt.datetime.now().isoformat(timespec='seconds'), 'commit': git_commit(),
+           'host': platform.node(), 'python': platform.python_version(), 'cpus': os.cpu_count(),
+           'parameters': {key: getattr(args, key) for key in ('flightlines', 'lines', 'samples', 'repeat',
+                                                              'hdr_calls', 'step', 'workers')},
+           'results': {}}
+
+    with tempfile.TemporaryDirectory(dir=args.workdir) as tmpdir:
+        tmpdir = Path(tmpdir)
+        # keep the caches of this run out of the user cache
+        metadata.hdr_cache_dir = tmpdir / 'cache' / 'hdr'
+        navfile.nav_cache_dir = tmpdir / 'cache' / 'nav'
+        resampling.resampling_cache_dir = tmpdir / 'cache' / 'resampling'
+        project = {'dir': tmpdir / 'project', 'out': tmpdir / 'out'}
+        project['out'].mkdir()
+        start = time.perf_counter()
+        # only the files the selected benchmarks read
+        project['lines'] = []
+        for idx in range(args.flightlines):
+            kinds, header_kinds = required_kinds(args.benchmarks, idx + 1)
+            project['lines'].append(write_flightline(project['dir'], prefix, idx + 1, args.lines, args.samples,
+                                                     seed=idx, kinds=kinds, header_kinds=header_kinds))
+        size = sum(fp.stat().st_size for fp in project['dir'].rglob('*') if fp.is_file())
+        print(f"{args.flightlines} synthetic flightlines of {args.lines} scan lines, {size / 2**30:.2f} GB, "
+              f"written in {time.perf_counter() - start:.1f} s")
+
+        for name in args.benchmarks:
+            result = run_benchmark(name, project, args)
+            run['results'][name] = result
+            rss = f"{result['peak_rss_mb']:8.1f} MB" if result['peak_rss_mb'] is not None else ''
+            print(f"\t{name:20s} {result['seconds']:8.3f} s (min {result['min_seconds']:8.3f} s)  peak RSS {rss}"
+                  f"  {benchmarks[name][2]}")
+
+    regressions, new = find_regressions(history, run, args.threshold, args.baseline_runs)
+    if new:
+        print(f"No baseline yet for {', '.join(new)}")
+    for name, seconds, baseline in regressions:
+        print(f"REGRESSION {name}: {seconds:.3f} s, {seconds / baseline - 1:+.0%} versus {baseline:.3f} s")
+    if not args.nosave:
+        args.history.parent.mkdir(parents=True, exist_ok=True)
+        save_manifest({'runs': history + [run]}, args.history)
+        print(f"Added the results to {args.history} ({len(history) + 1} runs)")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,253 @@
+# synthetic HySpex-like test data and shared helpers for the benchmarks
+
+from pathlib import Path
+import time
+
+import numpy as np
+
+envi_data_types = {'int16': 2, 'int32': 3, 'float32': 4, 'float64': 5, 'uint16': 12}
+
+# cube shapes of the campaign: the VNIR-1800 and SWIR-384 radiance cubes
+# and the ATCOR-4 reflectance supercube (%*100, int16) of both sensors
+sensor_presets = {
+    'vnir': {'samples': 1800, 'bands': 186, 'dtype': 'float32', 'wavelengths': (410.4, 992.0)},
+    'swir': {'samples': 384, 'bands': 288, 'dtype': 'float32', 'wavelengths': (953.5, 2516.0)},
+    'supercube': {'samples': 1800, 'bands': 457, 'dtype': 'int16', 'wavelengths': None},
+}
+
+# the files of a flightline written by write_flightline
+flightline_kinds = ('nav', 'vnir', 'swir', 'vnir_geo', 'swir_geo', 'vnir_geo_sca', 'swir_geo_sca', 'supercube')
+
+
+def hyspex_wavelengths(bands=459):
+    """Wavelengths (nm) of a VNIR-SWIR supercube with the cut-over at 954 nm"""
+    nvnir = 170 if bands > 170 else bands
+    vnir = np.linspace(410.4, 954.0, nvnir)
+    swir = np.linspace(957.6, 2500.0, bands - nvnir)
+    return np.concatenate([vnir, swir])
+
+
+def edge_wedges(lines, samples, seed=0):
+    """
+    Per-line first and last data pixel, with nodata wedges of varying
+    width at both swath edges as in georeferenced flightlines
+    """
+    rng = np.random.default_rng(seed)
+    rows = np.arange(lines)
+    left = (samples * (0.05 + 0.20 * rows / max(lines, 1))).astype(int)
+    right = (samples * (0.95 - 0.20 * (lines - rows) / max(lines, 1))).astype(int)
+    jitter = rng.integers(0, max(samples // 100, 1), size=lines)
+    return left + jitter, right - jitter
+
+
+def write_envi_cube(path, lines, samples, bands=459, dtype='int16', interleave='bsq',
+                    wedges=True, blocklines=512, seed=0, wavelengths=None, header_only=False):
+    """
+    Write a synthetic ENVI cube (binary + .hdr) of smooth vegetation-like
+    spectra with noise, in blocks of lines so that large cubes can be
+    generated with little memory; with header_only, only the .hdr file.
+    Returns the path of the binary file.
+    """
+    path = Path(path)
+    rng = np.random.default_rng(seed)
+    if wavelengths is None:
+        wavelengths = hyspex_wavelengths(bands)
+    # red edge and water absorption features, scaled to reflectance %*100
+    spectrum = (1500 + 3000 / (1 + np.exp(-(wavelengths - 715) / 15))
+                - 1500 * np.exp(-((wavelengths - 1450) / 60) ** 2)
+                - 2000 * np.exp(-((wavelengths - 1940) / 80) ** 2))
+    if not header_only:
+        left, right = edge_wedges(lines, samples, seed) if wedges else (np.zeros(lines, int), np.full(lines, samples))
+        shapes = {'bsq': (bands, lines, samples), 'bil': (lines, bands, samples), 'bip': (lines, samples, bands)}
+        cube = np.memmap(path, dtype=dtype, mode='w+', shape=shapes[interleave])
+        cols = np.arange(samples)
+        for start in range(0, lines, blocklines):
+            stop = min(start + blocklines, lines)
+            scale = rng.uniform(0.5, 1.5, size=(stop - start, samples, 1))
+            block = spectrum * scale + rng.normal(0, 50, size=(stop - start, samples, bands))
+            outside = (cols < left[start:stop, np.newaxis]) | (cols > right[start:stop, np.newaxis])
+            block[outside] = 0
+            block = block.astype(dtype)
+            if interleave == 'bsq':
+                cube[:, start:stop, :] = block.transpose(2, 0, 1)
+            elif interleave == 'bil':
+                cube[start:stop] = block.transpose(0, 2, 1)
+            else:
+                cube[start:stop] = block
+        cube.flush()
+        del cube
+    fwhm = np.gradient(wavelengths) * 1.2
+    with open(path.with_suffix('.hdr'), 'w') as dst:
+        dst.write("ENVI\n")
+        dst.write(f"description = {{Synthetic HySpex cube {path.name}}}\n")
+        dst.write(f"samples = {samples}\nlines = {lines}\nbands = {bands}\n")
+        dst.write(f"header offset = 0\nfile type = ENVI Standard\ndata type = {envi_data_types[dtype]}\n")
+        dst.write(f"interleave = {interleave}\nbyte order = 0\n")
+        dst.write("map info = {UTM, 1.000, 1.000, 450000.000, 7200000.000, 1.0000000000e+000, "
+                  "1.0000000000e+000, 6, North, WGS-84, units=Meters}\n")
+        dst.write("acquisition date = 2020-07-10\nacquisition start time = 20:15:03\n")
+        dst.write("wavelength = {" + ", ".join(f"{wvl:.6f}" for wvl in wavelengths) + "}\n")
+        dst.write("wavelength units = Nanometers\n")
+        dst.write("fwhm = {" + ", ".join(f"{val:.6f}" for val in fwhm) + "}\n")
+        dst.write("band names = {" + ", ".join(f"Band {idx}" for idx in range(1, bands + 1)) + "}\n")
+    return path
+
+
+def write_sensor_cube(path, sensor, lines, **kwargs):
+    """
+    Write a synthetic cube with the samples, bands, data type and
+    wavelengths of one of sensor_presets (write_envi_cube keyword arguments
+    override the preset). Returns the path of the binary file.
+    """
+    preset = dict(sensor_presets[sensor])
+    span = preset.pop('wavelengths')
+    preset.update(kwargs)
+    if preset.get('wavelengths') is None:
+        preset['wavelengths'] = hyspex_wavelengths(preset['bands']) if span is None else np.linspace(
+            *span, preset['bands'])
+    return write_envi_cube(path, lines=lines, **preset)
+
+
+def write_nav_file(path, rows=20000, start=72000.0, lat=64.8, lon=-147.7, heading=90.0, elev=1500.0,
+                   rate=100.0, speed=60.0, wander=0.0, seed=0):
+    """
+    Write a synthetic NAV .txt file (rowid, lon, lat, elev, roll, pitch,
+    heading, timestamp) for a flightline flown at speed (m/s), with rate
+    scan lines per second starting at start (seconds of day). The track is
+    straight, or drifts sideways in a random walk with steps of wander (m).
+    """
+    path = Path(path)
+    rng = np.random.default_rng(seed)
+    rowid = np.arange(1, rows + 1)
+    distance = (rowid - 1) * speed / rate
+    drift = np.cumsum(rng.normal(0, wander, rows)) if wander else np.zeros(rows)
+    headingrad = np.radians(heading)
+    north = distance * np.cos(headingrad) - drift * np.sin(headingrad)
+    east = distance * np.sin(headingrad) + drift * np.cos(headingrad)
+    navlat = lat + north / 111320
+    navlon = lon + east / (111320 * np.cos(np.radians(lat)))
+    table = np.column_stack([rowid, navlon, navlat, elev + rng.normal(0, 5, rows), rng.normal(0, 1.5, rows),
+                             rng.normal(0, 1.0, rows), heading + rng.normal(0, 2, rows),
+                             (start + (rowid - 1) / rate) % 86400])
+    np.savetxt(path, table, fmt=['%8d'] + ['%18.10f'] * 7)
+    return path
+
+
+def write_flightline(projectdir, prefix, linenum, lines, supercube_samples=None, seed=0, kinds=flightline_kinds,
+                     header_kinds=()):
+    """
+    Write flightline {prefix}_{linenum:02d} of a project folder as laid out
+    in notebook 03: the NAV file (rate scan lines per second, one per cube
+    line), the VNIR and SWIR radiance cubes in RAD, the four PARGE _geo
+    files in Parge_with_offsets and the ATCOR supercube in ATCOR, all with
+    the same nodata wedges. The supercube and _geo files have
+    supercube_samples samples (default: the supercube preset). Only the
+    files of kinds are written (default: all, see flightline_kinds), and
+    of the cubes of header_kinds only the .hdr files. Returns a dict of
+    the paths by kind: nav, vnir, swir, supercube and the _geo file names
+    (vnir_geo, swir_geo, vnir_geo_sca, swir_geo_sca).
+    """
+    name = f"{prefix}_{linenum:02d}"
+    linedir = Path(projectdir) / name
+    for subdir in ('NAV', 'RAD', 'Parge_with_offsets', 'ATCOR'):
+        (linedir / subdir).mkdir(parents=True, exist_ok=True)
+    paths = {}
+    if 'nav' in kinds:
+        paths['nav'] = write_nav_file(linedir / 'NAV' / f"{name}_VNIR_1800_SN00812_FOVx2_raw.txt", rows=lines,
+                                      start=72000.0 + 900 * linenum, seed=seed)
+    written = [kind for kind in flightline_kinds if kind in kinds or kind in header_kinds]
+    for sensor, rawname in (('vnir', 'VNIR_1800_SN00812_FOVx2'), ('swir', 'SWIR_384me_SN3107_FOVx2')):
+        if sensor in written:
+            paths[sensor] = write_sensor_cube(linedir / 'RAD' / f"{name}_{rawname}_raw_rad_bsq_float32.bsq",
+                                              sensor, lines, seed=seed, header_only=sensor not in kinds)
+        for suffix in ('geo', 'geo_sca'):
+            kind = f"{sensor}_{suffix}"
+            if kind in written:
+                paths[kind] = write_envi_cube(
+                    linedir / 'Parge_with_offsets' / f"{name}_{rawname}_raw_rad_bsq_float32_{suffix}.bsq", lines,
+                    supercube_samples or sensor_presets['supercube']['samples'], bands=4, dtype='float32',
+                    seed=seed, header_only=kind not in kinds)
+    if 'supercube' in written:
+        paths['supercube'] = write_sensor_cube(linedir / 'ATCOR' / f"{name}_VNIR_SWIR_rad_geo_atm_bcor.bsq",
+                                               'supercube', lines, seed=seed, header_only='supercube' not in kinds,
+                                               **({'samples': supercube_samples} if supercube_samples else {}))
+    return paths
+
+
+def dem_surface(x, y):
+    """Smooth synthetic terrain elevation (m) at Alaska Albers coordinates"""
+    return 400 + 150 * np.sin(x / 3000) * np.cos(y / 4000) + 0.002 * (x - y)
+
+
+def write_dem_tiles(tilesdir, layout='tnm', tilerows=4, tilecols=4, tilesize=200, resolution=5.0,
+                    origin=(297000.0, 1667000.0), tiles_per_folder=4):
+    """
+    Write a tree of synthetic IFSAR-like DEM GeoTIFF tiles (EPSG:3338,
+    float32) with footprint Shapefiles in one of the two layouts of notebook
+    04: 'earthexplorer' (one folder with one GeoTIFF and one Shapefile per
+    tile) or 'tnm' (tiles_per_folder GeoTIFFs per folder with a gdaltindex
+    style Shapefile with a 'location' attribute). origin is the upper left
+    corner of the tile grid. Returns the list of GeoTIFF paths.
+    """
+    import geopandas as gp
+    import rasterio as rio
+    from rasterio.transform import from_origin
+    from shapely.geometry import box
+
+    tilesdir = Path(tilesdir)
+    extent = tilesize * resolution
+    tiffiles, footprints = [], []
+    for idx in range(tilerows * tilecols):
+        row, col = divmod(idx, tilecols)
+        left, top = origin[0] + col * extent, origin[1] - row * extent
+        name = f"IFSARAKD_{row:03d}{col:03d}"
+        folder = tilesdir / (name if layout == 'earthexplorer' else f"TNM_{idx // tiles_per_folder:03d}")
+        folder.mkdir(parents=True, exist_ok=True)
+        tiffile = folder / f"{name}.tif"
+        centres = (np.arange(tilesize) + 0.5) * resolution
+        elevation = dem_surface(left + centres[np.newaxis, :], top - centres[:, np.newaxis]).astype('float32')
+        with rio.open(tiffile, 'w', driver='GTiff', width=tilesize, height=tilesize, count=1, dtype='float32',
+                      crs="EPSG:3338", transform=from_origin(left, top, resolution, resolution),
+                      nodata=-32767, tiled=True) as dst:
+            dst.write(elevation, 1)
+        tiffiles.append(tiffile)
+        footprint = box(left, top - extent, left + extent, top)
+        if layout == 'earthexplorer':
+            gp.GeoDataFrame({'name': [name]}, geometry=[footprint], crs="EPSG:3338").to_file(
+                folder / f"{name}.shp")
+        else:
+            footprints.append((folder, tiffile.name, footprint))
+    for folder in sorted({folder for folder, _, _ in footprints}):
+        locations = [(location, footprint) for tilefolder, location, footprint in footprints if tilefolder == folder]
+        gp.GeoDataFrame({'location': [location for location, _ in locations]},
+                        geometry=[footprint for _, footprint in locations], crs="EPSG:3338").to_file(
+            folder / "tileindex.shp")
+    return tiffiles
+
+
+def write_solar_spectrum(path, step=0.0001, seed=0):
+    """
+    Write a synthetic high-resolution solar irradiance spectrum (micrometers,
+    mW/cm2 micron) from 0.3 to 2.6 micrometers: a 5778 K black body at 1 AU
+    with narrow absorption lines. Returns the path of the text file.
+    """
+    path = Path(path)
+    rng = np.random.default_rng(seed)
+    wavelengths = np.arange(0.3, 2.6, step)
+    # Planck radiance (W/m2/sr/m) times pi (R_sun / AU)^2, converted to mW/cm2 micron
+    planck = 2 * 6.626e-34 * 2.998e8 ** 2 / (wavelengths * 1e-6) ** 5 / np.expm1(
+        6.626e-34 * 2.998e8 / (wavelengths * 1e-6 * 1.381e-23 * 5778))
+    e0 = planck * np.pi * (6.957e8 / 1.496e11) ** 2 * 1e-7
+    for centre in rng.uniform(0.3, 2.6, 300):
+        e0 *= 1 - rng.uniform(0.1, 0.6) * np.exp(-((wavelengths - centre) / 0.0003) ** 2)
+    np.savetxt(path, np.column_stack([wavelengths, e0]), fmt='%10.5f %12.4f',
+               header='wavelength [micron]  E0 [mW/cm2 micron]')
+    return path
+
+
+def timed(label, func):
+    """Runs func once and prints its wall time after the label, returns its result"""
+    start = time.perf_counter()
+    result = func()
+    print(f"\t{label:44s} {time.perf_counter() - start:8.3f} s")
+    return result
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Script for generating a complete ATCOR-4 sensor model folder          #
+#       (band .rsp files, .dat, .cal, e0_solar .spc, pressure.dat and the     #
+#       .wvl file of notebook 09) from the wavelengths of an ENVI header or   #
+#       from the .rsp files of an existing sensor model.                      #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      numpy                                                                  #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+import parsing  # noqa: F401 (makes the notebook helper modules importable)
+import sensormodel
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='This is a script for generating an ATCOR-4 sensor model.')
+    parser.add_argument('source', type=Path,
+                        help='ENVI .hdr file with the band wavelengths (e.g. of a radiance supercube), '
+                             'or a sensor model folder with .rsp files')
+    parser.add_argument('name', help='Sensor model name (e.g. HySpex_459_FoV2_Husky)')
+    parser.add_argument('-o', '--outdir', default=Path('.'), type=Path, dest='outdir',
+                        help='Folder in which the sensor model folder is written (default: current folder)')
+    parser.add_argument('--solar', default=None, type=Path, dest='solar',
+                        help='Solar irradiance spectrum (wavelength, E0 in mW/cm2 micron) for e0_solar_*.spc, '
+                             'e.g. from the sun folder of the ATCOR-4 installation')
+    parser.add_argument('--fov', default=33.0, type=float, dest='fov',
+                        help='Across-track FOV in degree (default: 33)')
+    parser.add_argument('--pixels', default=1800, type=int, dest='pixels',
+                        help='Pixels per line (default: 1800)')
+    parser.add_argument('--order', default=2, type=int, dest='order',
+                        help='Order of the Butterworth band responses generated for an ENVI header (default: 2)')
+    parser.add_argument('--two-column', action='store_true', dest='twocolumn',
+                        help='Write the .wvl file with wavelength and FWHM only (older ATCOR-4 versions)')
+    args = parser.parse_args()
+
+    if args.source.is_dir():
+        responses = [sensormodel.read_rsp(fp) for fp in sensormodel.find_rsp_files(args.source)]
+        if not responses:
+            parser.error(f"No .rsp files in {args.source}")
+    else:
+        centres, fwhm = sensormodel.wavelengths_from_hdr(args.source)
+        responses = list(zip(*sensormodel.butterworth_responses(centres, fwhm, args.order)))
+    solar = None if args.solar is None else sensormodel.read_solar_spectrum(args.solar)
+    modeldir = sensormodel.write_sensor_model(args.outdir, args.name, responses, solar, args.fov, args.pixels,
+                                              wvl_columns=2 if args.twocolumn else 3)
+    print(f"Done writing the {len(responses)} band sensor model {modeldir}")
+    if solar is None:
+        print("No solar spectrum given (--solar), e0_solar_*.spc not written")
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Script for evaluating roll, pitch and heading boresight offsets       #
+#       against the ground control points of PARGE .gcs files (boresight      #
+#       folder): least-squares fit per file, files in parallel, optional      #
+#       grid search of the offsets around the fit.                            #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      numpy, scipy                                                           #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+import csv
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+
+import parsing  # noqa: F401 (makes the notebook helper modules importable)
+import boresight
+
+fields = ['file', 'image', 'gcps', 'rms_initial', 'roll', 'pitch', 'heading', 'rms']
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='This is a script for evaluating boresight offsets against the GCPs of '
+                                        'PARGE .gcs files.')
+    parser.add_argument('gcsfiles', nargs='*', type=Path,
+                        help='PARGE .gcs files (default: all files in the boresight folder)')
+    parser.add_argument('--nav', nargs='+', default=None, type=Path, dest='navfiles',
+                        help='NAV files whose attitude replaces the one in the .gcs files, one per .gcs file')
+    parser.add_argument('--sensormodel', default=None, type=Path, dest='sensormodel',
+                        help='Sensor model file (sensormodel/*_FOVexp*.txt) whose view angles replace the ones '
+                             'in the .gcs files')
+    parser.add_argument('--swaplatlon', action='store_true', dest='swaplatlon',
+                        help='The NAV files have the lat and lon columns exchanged')
+    parser.add_argument('--all-gcps', action='store_true', dest='allgcps',
+                        help='Use the GCPs that are switched off in PARGE as well')
+    parser.add_argument('--grid', nargs=2, type=float, default=None, metavar=('RANGE', 'STEP'), dest='grid',
+                        help='Also search the offsets within +/- RANGE degrees of the fit, in steps of STEP '
+                             'degrees, and report the best grid point')
+    parser.add_argument('-w', '--workers', default=None, type=int, dest='workers',
+                        help='Number of worker processes (default: number of CPUs)')
+    parser.add_argument('-o', '--output', default=None, type=Path, dest='output',
+                        help='CSV file for the results')
+    args = parser.parse_args()
+
+    gcsfiles = args.gcsfiles or sorted(boresight.boresight_dir.glob('*.gcs'))
+    if args.navfiles and len(args.navfiles) != len(gcsfiles):
+        parser.error(f"{len(args.navfiles)} NAV files for {len(gcsfiles)} .gcs files")
+    sensormodels = [args.sensormodel] * len(gcsfiles) if args.sensormodel else None
+    results = boresight.evaluate_campaigns(gcsfiles, args.navfiles, sensormodels, args.workers,
+                                           active_only=not args.allgcps, swaplatlon=args.swaplatlon)
+
+    print(f"{'file':44s} {'GCPs':>5s} {'RMS 0':>8s} {'roll':>8s} {'pitch':>8s} {'heading':>8s} {'RMS':>8s}")
+    for result in results:
+        print(f"{result['file']:44s} {result['gcps']:5d} {result['rms_initial']:8.2f} {result['roll']:8.3f} "
+              f"{result['pitch']:8.3f} {result['heading']:8.3f} {result['rms']:8.2f}")
+    print("Offsets in degrees, RMS errors in m (RMS 0: without offsets)")
+
+    if args.grid:
+        span, step = args.grid
+        steps = np.arange(-span, span + step / 2, step)
+        for idx, result in enumerate(results):
+            if np.isnan(result['rms']):
+                continue
+            gcpset = boresight.load_gcpset(gcsfiles[idx], args.navfiles and args.navfiles[idx], args.sensormodel,
+                                           not args.allgcps, args.swaplatlon)
+            rms, best = boresight.grid_search(gcpset, result['roll'] + steps, result['pitch'] + steps,
+                                              result['heading'] + steps, args.workers)
+            print(f"{result['file']}: best of {rms.size} grid points roll {best[0]:.3f}, pitch {best[1]:.3f}, "
+                  f"heading {best[2]:.3f} deg, RMS {rms.min():.2f} m")
+
+    if args.output:
+        with open(args.output, 'w', newline='') as dst:
+            writer = csv.DictWriter(dst, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(results)
+        print(f"Done writing {args.output}")
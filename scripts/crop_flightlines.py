@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Script for cropping the swath edges of all bands of a series of      #
+#       flightline rasters (as notebook 05), with the crop bounds of one      #
+#       reference band and alternating left and right proportions.            #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      numpy                                                                  #
+#      rasterio                                                               #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+from argparse import ArgumentParser
+import glob
+
+from parsing import add_instrumentation_args  # (also makes the notebook helper modules importable)
+import cropping
+import instrumentation
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Crop the swath edges of all bands of a series of flightline rasters.')
+    parser.add_argument('inputs', nargs='+', help='Input rasters, in flight order (glob patterns allowed)')
+    parser.add_argument('-o', '--outdir', default=None, dest='outdir',
+                        help='Output directory (default: next to the input)')
+    parser.add_argument('-l', '--lprop', type=float, default=0.005, dest='lprop',
+                        help='Proportion to crop on the left of the first flightline')
+    parser.add_argument('-r', '--rprop', type=float, default=0.20, dest='rprop',
+                        help='Proportion to crop on the right of the first flightline')
+    parser.add_argument('--refband', type=int, default=1, dest='refband', help='Band used to find the data bounds')
+    parser.add_argument('--blocklines', type=int, default=256, dest='blocklines', help='Lines per block')
+    parser.add_argument('-w', '--workers', type=int, default=None, dest='workers',
+                        help='Number of worker processes')
+    parser.add_argument('--prefix', default='Clip_', dest='prefix', help='Prefix for output file names')
+    add_instrumentation_args(parser)
+    args = parser.parse_args()
+
+    inpaths = [pth for pattern in args.inputs for pth in sorted(glob.glob(pattern))]
+    if not inpaths:
+        parser.error("No input rasters found")
+    with instrumentation.session(args.report, args.profile):
+        cropping.cropflightlines(inpaths, args.outdir, args.lprop, args.rprop, outprefix=args.prefix,
+                                 refband=args.refband, blocklines=args.blocklines, workers=args.workers)
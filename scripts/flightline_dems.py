@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Script for cutting the DEMs of all flightlines of a campaign out of   #
+#       the main DEM (as notebook 04a), concurrently, each with a _meta.txt.  #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      geopandas                                                              #
+#      numpy                                                                  #
+#      rasterio                                                               #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+import json
+from argparse import ArgumentParser
+from pathlib import Path
+
+from parsing import add_instrumentation_args  # (also makes the notebook helper modules importable)
+import instrumentation
+import dem
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='This is a script for cutting the flightline DEMs out of the main DEM.')
+    parser.add_argument('projectdir', type=Path, help='Project folder with one subfolder per flightline')
+    parser.add_argument('prefix', help='Flightline prefix (e.g. 20200710-CPC)')
+    parser.add_argument('--main-dem', default=Path('01_inputs', 'DEM', 'IFSAR_crop_1m_cubic_main.bsq'), type=Path,
+                        dest='maindem', help='Main DEM, relative to the project folder (default: %(default)s)')
+    parser.add_argument('--shapefile', default=None, type=Path, dest='shpfile',
+                        help='Flightline Shapefile with a field naming the flightlines (see --name-field); '
+                             'by default the flightline tracks are taken from the NAV files')
+    parser.add_argument('--name-field', default=None, dest='namefield',
+                        help='Shapefile field with the flightline name or number')
+    parser.add_argument('--buffer', default=500, type=float, dest='buffer',
+                        help='Buffer around the flightline track in m (default: 500)')
+    parser.add_argument('-w', '--workers', default=None, type=int, dest='workers',
+                        help='Number of flightlines written at the same time')
+    add_instrumentation_args(parser)
+    args = parser.parse_args()
+    if (args.shpfile is None) != (args.namefield is None):
+        parser.error("--shapefile and --name-field must be given together")
+
+    with instrumentation.session(args.report, args.profile):
+        maindemfn = args.projectdir / args.maindem
+        mainmetafn = maindemfn.with_name(f"{maindemfn.stem}_meta.txt")
+        meta = json.loads(mainmetafn.read_text()) if mainmetafn.exists() else {}
+        fnelem = 'cubic_' if meta.get('downsampling', 'cubic' if 'cubic' in maindemfn.stem else '') == 'cubic' else ''
+
+        tracks = dem.flightline_geometries(args.projectdir, args.prefix, args.shpfile, args.namefield)
+        outpaths = {}
+        for name in tracks.index:
+            eledir = args.projectdir / name / 'ELE'
+            eledir.mkdir(parents=True, exist_ok=True)
+            outpaths[name] = eledir / f"{name.replace('-', '_')}_{fnelem}ELE.bsq"
+        written = dem.extract_line_dems(maindemfn, tracks, outpaths, args.buffer, args.workers, meta)
+        for outfn in written:
+            print(f"Done writing {outfn}")
+        for name in [name for name in tracks.index if outpaths[name] not in written]:
+            print(f"Flightline {name} is outside the main DEM")
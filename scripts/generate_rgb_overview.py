@@ -7,66 +7,243 @@
 #   Script written for Python 3.6 and higher                                  #
 #   Needs standard extension  plus:                                           #
 #      gdal                                                                   #
+#      numpy                                                                  #
 #                                                                             #
 #   Originally written by Edward Hazelton                                     #
 #   Alaska EPSCoR Fire & Ice                                                  #
 #                                                                             #
 ###############################################################################
-from typing import List
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
 
+import numpy as np
 from osgeo import gdal
 from osgeo import gdalconst
-from parsing import get_filenames, get_parser, parse_args
+from parsing import get_filenames, get_manifest_file, get_output_dir, get_parser, parse_args, run_batch
+import instrumentation
+import spectral
 
+# exact: full scan of the band, approx: GDAL approximate statistics (from overviews or a subsample),
+# sample: statistics of a strided sample of the band read at reduced resolution
+stats_modes = ('exact', 'approx', 'sample')
 
-# scales the parameters of bands
-def get_scale_params(dataset, output_channels,
+
+def sample_band(band, sample_fraction: float = 0.01) -> np.ndarray:
+    """
+    Reads a strided sample of about sample_fraction of the pixels of a band, as a flat float array
+    without nodata pixels. GDAL reads the sample from the overviews if the file has any.
+    Pixels equal to the nodata value of the band are dropped; if the band has none, pixels equal to 0
+    (the fill value around georeferenced flightlines) are dropped.
+    :param band: the GDAL band
+    :param sample_fraction: the fraction of pixels to read (0 < sample_fraction <= 1)
+    :return: the valid sampled pixel values
+    """
+    if not 0 < sample_fraction <= 1:
+        raise ValueError(f"The sample fraction must be between 0 and 1, not {sample_fraction}")
+    stride = max(1, int(round(1 / np.sqrt(sample_fraction))))
+    data = band.ReadAsArray(0, 0, band.XSize, band.YSize,
+                            buf_xsize=max(1, band.XSize // stride), buf_ysize=max(1, band.YSize // stride))
+    nodata = band.GetNoDataValue()
+    data = data[data != (0 if nodata is None else nodata)].astype(np.float64)
+    if not data.size:
+        raise ValueError("The band sample contains no valid pixels")
+    return data
+
+
+def get_band_stats(band, stats_mode: str = 'exact', sample_fraction: float = 0.01,
+                   percentiles: Optional[List[float]] = None) -> Dict[str, List[float]]:
+    """
+    Computes the statistics used for scaling a band.
+    :param band: the GDAL band
+    :param stats_mode: one of :data:`stats_modes`
+    :param sample_fraction: the fraction of pixels read in 'sample' mode
+    :param percentiles: if given, the low and high percentiles are computed as well (from the sample in 'approx' and
+     'sample' mode, from all pixels in 'exact' mode)
+    :return: a dict with 'stats' ([min, max, mean, stddev]) and, if requested, 'percentiles'
+    """
+    if stats_mode not in stats_modes:
+        raise ValueError(f"Unknown statistics mode {stats_mode}, must be one of {stats_modes}")
+    sample = None
+    if stats_mode == 'sample':
+        sample = sample_band(band, sample_fraction)
+        stats = [sample.min(), sample.max(), sample.mean(), sample.std()]
+    else:
+        stats = band.ComputeStatistics(stats_mode == 'approx')
+    result = {'stats': [float(val) for val in stats]}
+    if percentiles:
+        if sample is None:
+            sample = sample_band(band, 1 if stats_mode == 'exact' else sample_fraction)
+        result['percentiles'] = np.percentile(sample, percentiles).tolist()
+    return result
+
+
+def scale_from_stats(band_stats: Dict[str, List[float]],
                      scale_func=lambda min_val, max_val, mean, stddev: [min_val, mean + 2 * stddev, 0, 254]):
-    num_bands = dataset.RasterCount
-    num_channels = len(output_channels)
+    """
+    Scale parameters (src_min, src_max, dst_min, dst_max) for one band: a percentile stretch if the percentiles were
+    computed, otherwise scale_func applied to the band statistics.
+    """
+    if 'percentiles' in band_stats:
+        return [*band_stats['percentiles'], 0, 254]
+    return scale_func(*band_stats['stats'])
+
+
+def stats_settings(stats_mode: str, sample_fraction: float, percentiles: Optional[List[float]]) -> str:
+    """Key for the statistics settings in the scale cache; statistics computed with other settings are not reused"""
+    key = stats_mode if stats_mode != 'sample' else f"sample_{sample_fraction:g}"
+    return key + (f"_p{percentiles[0]:g}-{percentiles[1]:g}" if percentiles else '')
 
-    # quick index error checking
-    # TODO make this better than just cropping the top. (scale down to 1 through num_bands?)
-    if num_bands < max(output_channels):
-        output_channels = [channel if num_bands >= channel else num_bands for channel in output_channels]
 
-    scale_params = [0] * num_channels
+def load_scale_cache(cache_file) -> Dict:
+    """
+    Loads the scale cache, a JSON file with the band statistics of each input file, keyed by its absolute path.
+    :param cache_file: the path of the cache file
+    :return: the cache as a dict (empty if the file doesn't exist yet)
+    """
+    if cache_file and Path(cache_file).exists():
+        with open(cache_file) as src:
+            return json.load(src)
+    return {}
 
-    # iterate through the number of channels (should just be RGB channels but may change in the future)
-    for idx, channel in enumerate(output_channels):
-        band = dataset.GetRasterBand(channel)
 
-        # get the statistics of the specified bands for rescaling
-        stats = band.ComputeStatistics(0)
+def save_scale_cache(cache: Dict, cache_file):
+    """Writes the scale cache atomically, so that an interrupted run doesn't leave a broken file"""
+    tmp_file = Path(f"{cache_file}.tmp")
+    with open(tmp_file, 'w') as dst:
+        json.dump(cache, dst, indent=1)
+    os.replace(tmp_file, cache_file)
 
-        scale_params[idx] = scale_func(*stats)
 
-    return scale_params
+def get_file_cache(cache: Dict, in_file, settings: str) -> Dict:
+    """
+    The band statistics cached for a file and statistics settings. Entries of files that changed since
+    (different modification time or size) are discarded.
+    """
+    # keyed by the absolute path, as flightlines in different folders can have the same file name
+    key = str(Path(in_file).resolve())
+    stat = Path(in_file).stat()
+    entry = cache.get(key)
+    if not entry or entry['mtime_ns'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+        entry = cache[key] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'bands': {}}
+    return entry['bands'].setdefault(settings, {})
 
 
-def generate_image(input_files: List[str], output_files: List[str], bands: List[int]):
-    for idx, in_file in enumerate(input_files):
-        print(f"Processing {idx + 1} / {len(input_files)}: {in_file}")
+@instrumentation.instrumented('rgb_stats', 'in_file')
+def get_file_stats(in_file, bands: List[int], stats_mode: str = 'exact', sample_fraction: float = 0.01,
+                   percentiles: Optional[List[float]] = None) -> Dict[str, Dict[str, List[float]]]:
+    """
+    Computes the band statistics of one file for scaling (runs in a worker process, see :func:`generate_image`).
+    :param in_file: the input raster file
+    :param bands: the band numbers to use as RGB channels
+    :return: the statistics as returned by :func:`get_band_stats`, keyed by band number
+    """
+    # gdal only likes strings
+    dataset = gdal.Open(str(in_file), gdalconst.GA_ReadOnly)
+    if not dataset:
+        raise IOError('tried to open file %s but could not.' % str(in_file))
+    # bands past the last band are clamped to the last band
+    return {str(band): get_band_stats(dataset.GetRasterBand(min(band, dataset.RasterCount)), stats_mode,
+                                      sample_fraction, percentiles)
+            for band in bands}
 
-        # gdal only likes strings
-        dataset = gdal.Open(str(in_file), gdalconst.GA_ReadOnly)
 
-        if not dataset:
-            print('tried to open file %s but could not.' % str(in_file))
-            continue
+@instrumentation.instrumented('rgb_translate', 'in_file')
+def generate_overview(in_file, out_file, bands: List[int], scale_params: List[List[float]]):
+    """
+    Writes the RGB overview image of one file (runs in a worker process, see :func:`generate_image`).
+    :param in_file: the input raster file
+    :param out_file: the output file name
+    :param bands: the band numbers to use as RGB channels
+    :param scale_params: the scale parameters (src_min, src_max, dst_min, dst_max) of each band
+    """
+    # gdal only likes strings
+    dataset = gdal.Open(str(in_file), gdalconst.GA_ReadOnly)
+    if not dataset:
+        raise IOError('tried to open file %s but could not.' % str(in_file))
 
-        scale_params = get_scale_params(dataset, bands)
+    translate_options = gdal.TranslateOptions(
+        format='GTiff',
+        bandList=bands,
+        creationOptions=['COMPRESS=JPEG', 'TILED=YES', 'PHOTOMETRIC=YCBCR'],
+        outputType=gdal.GDT_Byte,
+        scaleParams=scale_params,
+        noData=255
+    )
 
-        translate_options = gdal.TranslateOptions(
-            format='GTiff',
-            bandList=bands,
-            creationOptions=['COMPRESS=JPEG', 'TILED=YES', 'PHOTOMETRIC=YCBCR'],
-            outputType=gdal.GDT_Byte,
-            scaleParams=scale_params,
-            noData=255
-        )
+    gdal.Translate(str(out_file), dataset, options=translate_options)
 
-        gdal.Translate(output_files[idx], dataset, options=translate_options)
+
+@instrumentation.instrumented('rgb_overview')
+def generate_image(input_files: List[str], output_files: List[str], bands: List[int],
+                   wavelengths: Optional[List[float]] = None, stats_mode: str = 'exact', sample_fraction: float = 0.01,
+                   percentiles: Optional[List[float]] = None, cache_file=None, shared_scale: bool = False,
+                   workers: Optional[int] = None, gdal_cache_mb: Optional[int] = None, manifest_file=None,
+                   retries: int = 1, force: bool = False) -> Dict[str, str]:
+    """
+    Generates the RGB overview images. The band statistics, then the images are computed one flightline per
+    worker process (see :func:`run_batch`).
+    :param input_files: the input raster files
+    :param output_files: the output file names
+    :param bands: the band numbers to use as RGB channels
+    :param wavelengths: if given, the RGB bands are looked up per file as the bands nearest to these wavelengths (nm)
+    :param stats_mode: how the band statistics for scaling are computed, one of :data:`stats_modes`
+    :param sample_fraction: the fraction of pixels read in 'sample' mode
+    :param percentiles: if given (e.g. [2, 98]), a percentile stretch is used instead of min to mean + 2 * stddev
+    :param cache_file: if given, the band statistics are cached in this JSON file and reused on re-runs
+    :param shared_scale: if True, all files are scaled with the median scale parameters of the files, for consistent
+     colours across a campaign
+    :param workers: the number of worker processes (default: number of CPUs)
+    :param gdal_cache_mb: the GDAL block cache size of each worker process in MB
+    :param manifest_file: the JSON job manifest; files with up to date overviews are skipped
+    :param retries: the number of times a failed file is retried
+    :param force: if True, process all files even if their overviews are up to date
+    :return: the input files that failed, with their error messages
+    """
+    batch_options = dict(workers=workers, gdal_cache_mb=gdal_cache_mb, retries=retries)
+    cache = load_scale_cache(cache_file)
+    settings = stats_settings(stats_mode, sample_fraction, percentiles)
+
+    input_files = [str(in_file) for in_file in input_files]
+    file_bands = {}
+    for in_file in input_files:
+        if wavelengths:
+            file_bands[in_file] = spectral.get_band_numbers(f"{in_file.rsplit('.', 1)[0]}.hdr", wavelengths)
+            print(f"Using bands {file_bands[in_file]} for {in_file}")
+        else:
+            file_bands[in_file] = bands
+    file_caches = {in_file: get_file_cache(cache, in_file, settings) for in_file in input_files}
+
+    # band statistics of the files that are not in the cache yet
+    missing = [in_file for in_file in input_files
+               if not all(str(band) in file_caches[in_file] for band in file_bands[in_file])]
+    if missing:
+        print(f"Computing band statistics of {len(missing)} file(s)")
+        file_stats, failures = run_batch(get_file_stats, missing, [(file_bands[in_file],) for in_file in missing],
+                                         stats_mode=stats_mode, sample_fraction=sample_fraction,
+                                         percentiles=percentiles, **batch_options)
+        for in_file, band_stats in file_stats.items():
+            file_caches[in_file].update(band_stats)
+        if cache_file:
+            save_scale_cache(cache, cache_file)
+    else:
+        failures = {}
+
+    done = [idx for idx, in_file in enumerate(input_files) if in_file not in failures]
+    file_scales = {input_files[idx]: [scale_from_stats(file_caches[input_files[idx]][str(band)])
+                                      for band in file_bands[input_files[idx]]] for idx in done}
+    if shared_scale and file_scales:
+        shared_params = np.median(np.array(list(file_scales.values()), dtype=float), axis=0).tolist()
+        print(f"Using shared scale parameters {shared_params}")
+        file_scales = {in_file: shared_params for in_file in file_scales}
+
+    failures.update(run_batch(generate_overview, [input_files[idx] for idx in done],
+                              [(output_files[idx], file_bands[input_files[idx]], file_scales[input_files[idx]])
+                               for idx in done],
+                              [[output_files[idx]] for idx in done], manifest_file=manifest_file, force=force,
+                              **batch_options)[1])
+    return failures
 
 
 if __name__ == '__main__':
@@ -75,11 +252,40 @@ if __name__ == '__main__':
     parser.add_argument('-r', '--red', help='Red band', default=290, dest='red', type=int)
     parser.add_argument('-g', '--green', help='Green band', default=140, dest='green', type=int)
     parser.add_argument('-b', '--blue', help='Blue band', default=20, dest='blue', type=int)
+    parser.add_argument('--wavelengths', '--wl', help='Red, green and blue wavelengths in nm. The nearest bands are '
+                        'looked up in the header of each file (overrides -r, -g, -b)', default=None, nargs=3,
+                        type=float, dest='wavelengths', metavar=('RED', 'GREEN', 'BLUE'))
+    parser.add_argument('--stats', help='How the band statistics for scaling are computed: exact (full scan), '
+                        'approx (GDAL approximate statistics) or sample (strided sample, see --sample-fraction)',
+                        default='exact', choices=stats_modes, dest='stats_mode')
+    parser.add_argument('--sample-fraction', help='Fraction of pixels read for --stats sample', default=0.01,
+                        type=float, dest='sample_fraction')
+    parser.add_argument('--percentiles', help='Percentile stretch (e.g. 2 98) instead of min to mean + 2 * stddev',
+                        default=None, nargs=2, type=float, dest='percentiles', metavar=('LOW', 'HIGH'))
+    parser.add_argument('--scale-cache', help='JSON file in which the band statistics are cached for re-runs '
+                        '(default: rgb_scale_cache.json in the output directory)', default=None, dest='scale_cache')
+    parser.add_argument('--no-scale-cache', help="Don't cache the band statistics", dest='no_scale_cache',
+                        action='store_true')
+    parser.add_argument('--shared-scale', help='Scale all files with the median scale parameters of the files, for '
+                        'consistent colours across a campaign', dest='shared_scale', action='store_true')
     arguments = parse_args(parser)
 
-    # TODO possibly support different band values for individual flightlines
     bands = [arguments['red'], arguments['green'], arguments['blue']]
 
-    input_files, output_files = get_filenames(arguments, f"{'_'.join(map(str, bands))}")
+    if arguments['wavelengths']:
+        input_files, output_files = get_filenames(arguments, f"{'_'.join(f'{wvl:g}' for wvl in arguments['wavelengths'])}nm")
+    else:
+        input_files, output_files = get_filenames(arguments, f"{'_'.join(map(str, bands))}")
+
+    if arguments['no_scale_cache']:
+        scale_cache = None
+    elif arguments['scale_cache']:
+        scale_cache = arguments['scale_cache']
+    else:
+        scale_cache = get_output_dir(arguments) / 'rgb_scale_cache.json'
 
-    generate_image(input_files, output_files, bands)
+    with instrumentation.session(arguments['report'], arguments['profile']):
+        generate_image(input_files, output_files, bands, arguments['wavelengths'], arguments['stats_mode'],
+                       arguments['sample_fraction'], arguments['percentiles'], scale_cache, arguments['shared_scale'],
+                       arguments['workers'], arguments['gdal_cache_mb'], get_manifest_file(arguments, 'rgb_overview'),
+                       arguments['retries'], arguments['force'])
@@ -14,10 +14,14 @@
 #                                                                             #
 ###############################################################################
 
-from typing import List
+from typing import Dict, List, Optional
 from osgeo import gdal, gdalconst
-from parsing import parse_args, get_parser, get_filenames
+from parsing import parse_args, get_parser, get_filenames, get_manifest_file, run_batch
 import numpy as np
+import envicube
+import instrumentation
+import resampling
+import spectral
 
 indices_to_wavelengths = {
     'ndvi': [645.0, 857.0],
@@ -31,74 +35,237 @@ indices_to_wavelengths = {
 }
 
 
-def get_nearest_bands(bands: List[float], target_wavelengths: List[float]) -> List[int]:
-    band_indices = [0]*len(target_wavelengths)
-    for idx in range(len(bands)):
-        for target_idx, target_wavelength in enumerate(target_wavelengths):
-            if bands[idx] <= target_wavelength <= bands[idx + 1]:
-                band_indices[target_idx] = idx
-    return band_indices
+def get_band_info(hdr_file: str, target_wavelengths: List[float], mode: str = 'nearest') -> List[int]:
+    """
+    Looks up the bands for the target wavelengths in the wavelengths of the header.
+    :param hdr_file: the ENVI header of the input file
+    :param target_wavelengths: the wavelengths in nm
+    :param mode: 'nearest', or the closest band at or below ('lower') or at or above ('upper') the wavelength
+    :return: the 1-based band numbers
+    """
+    return spectral.get_band_numbers(hdr_file, target_wavelengths, mode)
 
 
-def get_band_info(hdr_file: str, target_wavelengths: List[float]) -> List[int]:
-    with open(hdr_file) as file:
-        for line in file.readlines():
-            if line.startswith('wavelength'):
-                bands = [float(band.strip(' {}\n')) for band in line.split('=')[1].split(',')]
-                return get_nearest_bands(bands, target_wavelengths)
+def normalized_difference(band1: np.ndarray, band2: np.ndarray, out: np.ndarray, tmp: np.ndarray) -> np.ndarray:
+    np.subtract(band1, band2, out=out)
+    np.add(band1, band2, out=tmp)
+    return np.divide(out, tmp, out=out)
 
 
-def generate_images(input_files: List[str], output_files: List[str], vi_type: str):
-    for in_file, out_file in zip(input_files, output_files):
-        generate_vi(in_file, out_file, vi_type)
+def enhanced_vi(blue: np.ndarray, red: np.ndarray, nir: np.ndarray, out: np.ndarray, tmp: np.ndarray) -> np.ndarray:
+    np.multiply(red, 6, out=tmp)
+    tmp += nir
+    np.multiply(blue, 7.5, out=out)
+    tmp -= out
+    tmp += 1
+    np.subtract(nir, red, out=out)
+    out *= 2.5
+    return np.divide(out, tmp, out=out)
 
 
-def generate_vi(input_file: str, output_file: str, vi_type: str):
+def atmospherically_resistant_vi(blue: np.ndarray, green: np.ndarray, red: np.ndarray,
+                                 out: np.ndarray, tmp: np.ndarray) -> np.ndarray:
+    np.add(green, red, out=tmp)
+    tmp -= blue
+    np.subtract(green, red, out=out)
+    return np.divide(out, tmp, out=out)
+
+
+def band_ratio(band1: np.ndarray, band2: np.ndarray, out: np.ndarray, tmp: np.ndarray) -> np.ndarray:
+    return np.divide(band1, band2, out=out)
+
+
+# each formula takes the bands in the order of indices_to_wavelengths and writes to out, using tmp as scratch space
+vi_formulas = {
+    'ndvi': lambda red, nir, out, tmp: normalized_difference(nir, red, out, tmp),
+    'evi': enhanced_vi,
+    'vig': normalized_difference,
+    'vari': atmospherically_resistant_vi,
+    'ndii6': normalized_difference,
+    'ndii7': normalized_difference,
+    'wi': band_ratio,
+    'ndwi': normalized_difference
+}
+
+# modes of choosing the input bands of the indices: a single band per wavelength (see get_band_info),
+# or the resampling of all bands to a Gaussian band at each wavelength (see resampling.get_resampler)
+band_modes = spectral.band_modes + ('resample',)
+
+default_creation_options = ['TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256',
+                            'COMPRESS=DEFLATE', 'PREDICTOR=3', 'BIGTIFF=IF_SAFER']
+
+
+def get_index_bands(hdr_file: str, vi_types: List[str], mode: str = 'nearest') -> Dict[str, List[int]]:
+    """
+    Looks up the bands needed for each of the vegetation indices in a single pass over the header.
+    :param hdr_file: the ENVI header of the input file
+    :param vi_types: the vegetation indices to calculate
+    :param mode: how to choose the band for a wavelength, see :func:`get_band_info`
+    :return: a dict mapping each index to the band numbers of its input wavelengths, in order
+    """
+    wavelengths = sorted({wavelength for vi_type in vi_types for wavelength in indices_to_wavelengths[vi_type]})
+    band_lookup = dict(zip(wavelengths, get_band_info(hdr_file, wavelengths, mode)))
+    return {vi_type: [band_lookup[wavelength] for wavelength in indices_to_wavelengths[vi_type]]
+            for vi_type in vi_types}
+
+
+def get_window_lines(band: gdal.Band, tile_lines: Optional[int] = None, min_lines: int = 256) -> int:
+    """
+    Gets the number of lines to read per window.
+    :param band: a band of the input dataset
+    :param tile_lines: the number of lines per window, overrides the native block size
+    :param min_lines: the smallest window height when using the native block size
+    :return: tile_lines, or the smallest multiple of the native block height that is at least min_lines
+    """
+    if tile_lines:
+        return tile_lines
+    block_lines = band.GetBlockSize()[1]
+    return block_lines * -(-min_lines // block_lines)
+
+
+def get_overview_levels(x_size: int, y_size: int, min_size: int = 256) -> List[int]:
+    levels = []
+    level = 2
+    while max(x_size, y_size) // level >= min_size:
+        levels.append(level)
+        level *= 2
+    return levels
+
+
+def generate_images(input_files: List[str], output_files: List[List[str]], vi_types: List[str],
+                    workers: Optional[int] = None, gdal_cache_mb: Optional[int] = None, manifest_file=None,
+                    retries: int = 1, force: bool = False, **kwargs):
+    """
+    Calculates the vegetation indices for all flightlines, one flightline per worker process (see :func:`run_batch`).
+    :param input_files: the input raster files
+    :param output_files: for each input file, the output file names as in :func:`generate_vis`
+    :param vi_types: the vegetation indices to calculate
+    :param workers: the number of worker processes (default: number of CPUs)
+    :param gdal_cache_mb: the GDAL block cache size of each worker process in MB
+    :param manifest_file: the JSON job manifest; flightlines with up to date outputs are skipped
+    :param retries: the number of times a failed flightline is retried
+    :param force: if True, process all flightlines even if their outputs are up to date
+    :param kwargs: passed on to :func:`generate_vis`
+    :return: the input files that failed, with their error messages
+    """
+    return run_batch(generate_vis, input_files, [(out_files, vi_types) for out_files in output_files], output_files,
+                     workers=workers, gdal_cache_mb=gdal_cache_mb, manifest_file=manifest_file, retries=retries,
+                     force=force, **kwargs)[1]
+
+
+def generate_vi(input_file: str, output_file: str, vi_type: str, **kwargs):
+    generate_vis(input_file, [output_file], [vi_type], **kwargs)
+
+
+def get_index_resampler(hdr_file: str, vi_types: List[str], band_width: float = 20.0):
+    """
+    Sets up the resampling of the input bands to a Gaussian band at each wavelength of the vegetation indices.
+    :param hdr_file: the ENVI header of the input file
+    :param vi_types: the vegetation indices to calculate
+    :param band_width: the FWHM of the Gaussian bands in nm
+    :return: the :class:`resampling.Resampler`, and a dict mapping each index to the resampled bands (0-based) of its
+        input wavelengths, in order
+    """
+    wavelengths = sorted({wavelength for vi_type in vi_types for wavelength in indices_to_wavelengths[vi_type]})
+    resampler = resampling.get_resampler(resampling.hdr_bandset(hdr_file),
+                                         resampling.wavelength_bandset(wavelengths, band_width))
+    return resampler, {vi_type: [wavelengths.index(wavelength) for wavelength in indices_to_wavelengths[vi_type]]
+                       for vi_type in vi_types}
+
+
+@instrumentation.instrumented('vi', 'input_file')
+def generate_vis(input_file: str, output_files: List[str], vi_types: List[str], tile_lines: Optional[int] = None,
+                 overviews: bool = False, creation_options: Optional[List[str]] = None, band_mode: str = 'nearest',
+                 band_width: float = 20.0):
+    """
+    Calculates several vegetation indices, reading each needed band only once.
+    The input is processed in windows of full lines, so memory use is bounded by the window size,
+    and all arithmetic is done in float32 in preallocated buffers. Raw ENVI inputs are read through a memory map
+    (see :class:`envicube.EnviCube`), other formats through GDAL. With band_mode 'resample', the index wavelengths
+    are resampled from all input bands they overlap, with one matrix product per window.
+    :param input_file: the input raster file
+    :param output_files: a single file name to write all indices as bands of one GeoTIFF,
+        or one file name per index
+    :param vi_types: the vegetation indices to calculate
+    :param tile_lines: the number of lines per window (default: based on the native block size)
+    :param overviews: whether to build internal overviews
+    :param creation_options: GeoTIFF creation options (default: tiled, DEFLATE compressed with predictor)
+    :param band_mode: how to choose the band for a wavelength, see :func:`get_band_info`, or 'resample'
+    :param band_width: the FWHM in nm of the resampled bands, see :func:`get_index_resampler`
+    """
     # gdal only likes strings
     dataset = gdal.Open(str(input_file), gdalconst.GA_ReadOnly)
 
     if not dataset:
-        print('tried to open file %s but could not.' % str(input_file))
-        return
-
-    global indices_to_wavelengths
-
-    target_bands = get_band_info(f"{''.join(input_file.rsplit('.', 1)[0])}.hdr", indices_to_wavelengths[vi_type])
-
-    bands = []
-    for band in target_bands:
-        bands.append(dataset.GetRasterBand(band).ReadAsArray())
-    y_size, x_size = bands[0].shape
-
-    with np.errstate(divide='ignore', invalid='ignore'):
-        if vi_type == 'ndvi':
-            vi_index = np.divide((bands[1] - bands[0]), (bands[1] + bands[0]))
-        elif vi_type == 'evi':
-            vi_index = 2.5 * np.divide(bands[2] - bands[1], bands[2] + 6 * bands[2] - 7.5 * bands[0] + 1)
-        elif vi_type == 'vig':
-            vi_index = np.divide((bands[1] - bands[0]), (bands[1] + bands[0]))
-        elif vi_type == 'vari':
-            vi_index = np.divide((bands[2] - bands[1]), (bands[2] + bands[1] - bands[0]))
-        elif vi_type == 'wi':
-            vi_index = np.divide(bands[0], bands[1])
-        elif vi_type == 'ndwi':
-            vi_index = np.divide((bands[0] - bands[1]), (bands[0] + bands[1]))
+        raise IOError('tried to open file %s but could not.' % str(input_file))
+    cube = envicube.open_cube(input_file)
+
+    hdr_file = f"{''.join(str(input_file).rsplit('.', 1)[0])}.hdr"
+    if band_mode == 'resample':
+        resampler, index_bands = get_index_resampler(hdr_file, vi_types, band_width)
+        band_numbers = (resampler.bands + 1).tolist()
+    else:
+        resampler, index_bands = None, get_index_bands(hdr_file, vi_types, band_mode)
+        band_numbers = sorted({band for target_bands in index_bands.values() for band in target_bands})
+    y_size, x_size = dataset.RasterYSize, dataset.RasterXSize
+    window_lines = min(get_window_lines(dataset.GetRasterBand(band_numbers[0]), tile_lines), y_size)
 
     driver = gdal.GetDriverByName("GTiff")
-    outdata = driver.Create(output_file, x_size, y_size, 1, gdal.GDT_Float32)
-    outdata.SetGeoTransform(dataset.GetGeoTransform())  # sets same geotransform as input
-    outdata.SetProjection(dataset.GetProjection())  # sets same projection as input
-    outdata.GetRasterBand(1).WriteArray(vi_index)
-    outdata.FlushCache()  # saves to disk
+    if creation_options is None:
+        creation_options = default_creation_options
+    if len(output_files) == 1:
+        outdatasets = [driver.Create(str(output_files[0]), x_size, y_size, len(vi_types), gdal.GDT_Float32,
+                                     options=creation_options)]
+        outbands = [outdatasets[0].GetRasterBand(idx + 1) for idx in range(len(vi_types))]
+    else:
+        outdatasets = [driver.Create(str(output_file), x_size, y_size, 1, gdal.GDT_Float32, options=creation_options)
+                       for output_file in output_files]
+        outbands = [outdata.GetRasterBand(1) for outdata in outdatasets]
+    for outdata in outdatasets:
+        outdata.SetGeoTransform(dataset.GetGeoTransform())  # sets same geotransform as input
+        outdata.SetProjection(dataset.GetProjection())  # sets same projection as input
+    for vi_type, outband in zip(vi_types, outbands):
+        outband.SetDescription(vi_type.upper())
+
+    source = np.empty((len(band_numbers), window_lines, x_size), dtype=np.float32)
+    buffers = dict(zip(band_numbers, source))
+    out = np.empty((window_lines, x_size), dtype=np.float32)
+    tmp = np.empty((window_lines, x_size), dtype=np.float32)
+
+    for yoff in range(0, y_size, window_lines):
+        lines = min(window_lines, y_size - yoff)
+        bands = {}
+        for band in band_numbers:
+            if cube is not None:
+                bands[band] = buffers[band][:lines]
+                np.copyto(bands[band], cube.band(band - 1)[yoff:yoff + lines])
+            else:
+                # gdal converts to float32 while reading into the buffer
+                bands[band] = dataset.GetRasterBand(band).ReadAsArray(0, yoff, x_size, lines,
+                                                                      buf_obj=buffers[band][:lines])
+        if resampler is not None:
+            resampled = resampler.weights @ source[:, :lines].reshape(len(band_numbers), -1)
+            bands = dict(enumerate(resampled.reshape(len(resampler), lines, x_size)))
+        for vi_type, outband in zip(vi_types, outbands):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                vi_index = vi_formulas[vi_type](*[bands[band] for band in index_bands[vi_type]],
+                                                out=out[:lines], tmp=tmp[:lines])
+            outband.WriteArray(vi_index, 0, yoff)
+
+    for outdata in outdatasets:
+        if overviews:
+            outdata.BuildOverviews('AVERAGE', get_overview_levels(x_size, y_size))
+        outdata.FlushCache()  # saves to disk
 
 
 if __name__ == '__main__':
     # getting the arguments
     parser = get_parser('This is a script for generating an overview of various vegetation indices of raster data.')
-    parser.add_argument('-v', '--veg-idx', '--vegetation-index', default='ndvi', type=str.lower, dest='vi_type',
-                        choices=['ndvi', 'evi', 'vig', 'vari', 'ndii6', 'ndii7', 'wi', 'ndwi'],
+    parser.add_argument('-v', '--veg-idx', '--vegetation-index', default=['ndvi'], type=str.lower, dest='vi_types',
+                        choices=list(indices_to_wavelengths), nargs='+',
                         help='''
-                        Specify what vegetation index to calculate.
+                        Specify what vegetation indices to calculate. All indices are calculated in a single
+                        pass over the input and written as bands of one GeoTIFF (see also --separate).
                         NDVI: Normalized Difference Vegetation Index
                         EVI: Enhanced Vegetation Index
                         VIg: Visible Green Index
@@ -108,9 +275,33 @@ if __name__ == '__main__':
                         WI: Water Index
                         NDWI: Normalized Difference Water Index
                         ''')
+    parser.add_argument('-s', '--separate', help='Write one GeoTIFF per vegetation index', dest='separate',
+                        action='store_true')
+    parser.add_argument('-t', '--tile-lines', help='Number of lines to process at a time (default: based on the '
+                        'block size of the input)', default=None, type=int, dest='tile_lines')
+    parser.add_argument('--overviews', help='Build internal overviews in the output GeoTIFFs', dest='overviews',
+                        action='store_true')
+    parser.add_argument('--band-mode', help='Use the nearest band to each index wavelength (default), the closest '
+                        'band below (lower) or above (upper) it, or resample all bands to a Gaussian band at the '
+                        'wavelength (resample, see --band-width)', default='nearest', choices=band_modes,
+                        dest='band_mode')
+    parser.add_argument('--band-width', help='FWHM of the resampled bands in nm (default: 20)', default=20.0,
+                        type=float, dest='band_width')
 
     arguments = parse_args(parser)
+    vi_types = list(dict.fromkeys(arguments['vi_types']))
 
-    input_files, output_files = get_filenames(arguments, f"{arguments['vi_type']}")
+    if arguments['separate'] and len(vi_types) > 1:
+        if arguments['output'].suffix == '.tif':
+            parser.error('Cannot specify an output file for --separate, please specify a directory!')
+        input_files = get_filenames(arguments, vi_types[0])[0]
+        output_files = list(zip(*[get_filenames(arguments, vi_type)[1] for vi_type in vi_types]))
+    else:
+        input_files, output_files = get_filenames(arguments, '_'.join(vi_types))
+        output_files = [[output_file] for output_file in output_files]
 
-    generate_images(input_files, output_files, arguments['vi_type'])
+    with instrumentation.session(arguments['report'], arguments['profile']):
+        generate_images(input_files, output_files, vi_types, arguments['workers'], arguments['gdal_cache_mb'],
+                        get_manifest_file(arguments, 'vi'), arguments['retries'], arguments['force'],
+                        tile_lines=arguments['tile_lines'], overviews=arguments['overviews'],
+                        band_mode=arguments['band_mode'], band_width=arguments['band_width'])
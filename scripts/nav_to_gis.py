@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Script for converting the HySpex NAV files of a campaign to one       #
+#       flightline GIS file (as notebook 02), with simplified tracks and      #
+#       per-line attributes.                                                  #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      geopandas                                                              #
+#      numpy                                                                  #
+#      shapely                                                                #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+from parsing import add_instrumentation_args  # (also makes the notebook helper modules importable)
+import instrumentation
+import navgis
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='This is a script for converting HySpex NAV files to a flightline GIS file.')
+    parser.add_argument('projectdir', type=Path, help='Project folder')
+    parser.add_argument('prefix', help='Flightline prefix (e.g. 20210911-DC)')
+    parser.add_argument('--navdir', default=None, type=Path, dest='navdir',
+                        help='Folder with all NAV files (e.g. 00_aux/Software/HySpex_NAV_20200402_latest in the '
+                             'project folder); by default the NAV folders of the flightline folders are searched')
+    parser.add_argument('-o', '--output', default=None, type=Path, dest='output',
+                        help='GeoPackage or Shapefile (.shp) to write (default: 00_aux/GIS/Flightline/{prefix}.gpkg '
+                             'in the project folder)')
+    parser.add_argument('-t', '--tolerance', default=1.0, type=float, dest='tolerance',
+                        help='Douglas-Peucker tolerance in m: no scan line position is further than this from the '
+                             'simplified track (default: 1)')
+    parser.add_argument('-n', '--every', default=None, type=int, dest='step',
+                        help='Keep every Nth position instead of simplifying')
+    parser.add_argument('--all-sensors', help='One flightline per NAV file of each sensor, not only VNIR',
+                        dest='all_sensors', action='store_true')
+    add_instrumentation_args(parser)
+    args = parser.parse_args()
+    with instrumentation.session(args.report, args.profile):
+        navdir = None if args.navdir is None else args.projectdir / args.navdir
+        navpaths = navgis.find_nav_files(args.projectdir, args.prefix, not args.all_sensors, navdir)
+        if not navpaths:
+            parser.error(f"No NAV files for {args.prefix} found")
+        print(f"There are {len(navpaths)} files to be processed.")
+
+        output = args.output
+        if output is None:
+            output = args.projectdir / '00_aux' / 'GIS' / 'Flightline' / f"{args.prefix}.gpkg"
+        output.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            flightlines = navgis.nav_to_gis(navpaths, output, args.tolerance, args.step)
+        except ValueError as err:
+            parser.error(str(err))
+        print(f"Done writing {len(flightlines)} flightlines with {flightlines['vertices'].sum()} vertices "
+              f"({flightlines['scanlines'].sum()} scan lines) to {output}")
@@ -1,7 +1,17 @@
 # This is a central module for shared code in the image generation scripts.
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from argparse import ArgumentParser
-from typing import Dict, List, Tuple, Any, Optional
+from typing import Callable, Dict, List, Tuple, Any, Optional, Sequence
+
+# the helper modules shared with the notebooks (metadata, navigation, ...) live in Jupyter_notebooks
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'Jupyter_notebooks'))
+
+from instrumentation import profilers  # noqa: E402 (needs the helper module path)
 
 
 def is_valid_raster_file(parser: ArgumentParser, arg: str) -> Path:
@@ -24,16 +34,15 @@ def is_valid_raster_file(parser: ArgumentParser, arg: str) -> Path:
 def is_valid_tif_filename(parser: ArgumentParser, arg: str) -> Path:
     """
     Checks if the filename is valid.
-    The filename is valid if its path doesn't already exist and has the .tif extension.
+    The filename is valid if it has the .tif extension. An existing file is overwritten,
+    unless it is up to date according to the job manifest (see :func:`run_batch`).
     Errors and exits the program if it fails.
     :param parser: The argument parser
     :param arg: the string representation of a path to verify
     :return: the verified path as a :class:`pathlib.Path`
     """
     path = Path(arg)
-    if path.exists():
-        parser.error("The file %s already exists!" % arg)
-    elif path.suffix != '.tif':
+    if path.suffix != '.tif':
         parser.error("The file %s must be a .tif file!" % path)
     else:
         return path
@@ -75,10 +84,11 @@ def is_valid_output(parser: ArgumentParser, arg: str) -> Path:
 
 def get_parser(desc: str) -> ArgumentParser:
     """
-    Creates an :class:`argparse.ArgumentParser` and adds 5 premade optional flags.
+    Creates an :class:`argparse.ArgumentParser` and adds premade optional flags.
     An input file flag, an input directory flag, an output path flag, a prefix flag,
-    and a flag to change what processing level of supercube was used
-    (revert to Atmospheric correction. Default is BRDF correction).
+    a flag to change what processing level of supercube was used
+    (revert to Atmospheric correction. Default is BRDF correction),
+    and the flags for the batch runner (see :func:`run_batch`).
     :param desc: The description for the parser
     :return: An :class:`argparse.ArgumentParser` with premade flags.
     """
@@ -94,10 +104,33 @@ def get_parser(desc: str) -> ArgumentParser:
                         help='Flightline prefix (e.g. 20200710-CPC)')
     parser.add_argument('--atm', help='Specifies to look for *atm.bsq files rather than *atm_bcor.bsq files',
                         dest='atm_only', action='store_true')
+    parser.add_argument('-w', '--workers', help='Number of flightlines to process in parallel (default: number of '
+                        'CPUs)', default=None, type=int, dest='workers')
+    parser.add_argument('--gdal-cache', help='GDAL block cache size per worker process in MB', default=None,
+                        type=int, dest='gdal_cache_mb')
+    parser.add_argument('--manifest', help='JSON job manifest recording the completed outputs (default: in the '
+                        'output directory)', default=None, type=Path, dest='manifest')
+    parser.add_argument('--retries', help='Number of times a failed flightline is retried', default=1, type=int,
+                        dest='retries')
+    parser.add_argument('--force', help='Process all flightlines, even if their outputs are up to date',
+                        dest='force', action='store_true')
+    add_instrumentation_args(parser)
 
     return parser
 
 
+def add_instrumentation_args(parser: ArgumentParser):
+    """
+    Adds the flags for instrumenting a run (see :func:`instrumentation.session`): a report of the wall time,
+    bytes read and written, throughput and peak memory of each processing stage per flightline, and a profiler.
+    :param parser: The argument parser
+    """
+    parser.add_argument('--report', help='JSON or CSV file for the timing, I/O and memory report of the processing '
+                        'stages', default=None, type=Path, dest='report')
+    parser.add_argument('--profile', help='Profile each process with cProfile (.prof files) or pyinstrument (.html '
+                        'files), written to {report}_profiles', default=None, choices=profilers, dest='profile')
+
+
 def parse_args(parser: ArgumentParser) -> Dict[str, Any]:
     """
     Wraps around the regular :func:`~argparse.ArgumentParser.parse_args` call to provide custom handling for
@@ -142,3 +175,148 @@ def get_filenames(args: Dict, addtl_info: Optional[str]) -> Tuple[List[str], Lis
         if len(in_files) != len(out_files):
             raise IndexError(f"The Number of input files {in_files} and output files {out_files} do not match!")
         return in_files, out_files
+
+
+def get_output_dir(args: Dict) -> Path:
+    """
+    Gets the output directory, which is the parent directory if an output file was given.
+    :param args: The command line arguments as a dict
+    :return: the output directory
+    """
+    return args['output'] if args['output'].suffix == '' else args['output'].parent
+
+
+def get_manifest_file(args: Dict, name: str) -> Path:
+    """
+    Gets the path of the job manifest: the --manifest argument, or <name>_manifest.json in the output directory.
+    :param args: The command line arguments as a dict
+    :param name: the name of the script's jobs, so that different scripts writing to one directory don't share a manifest
+    :return: the path of the manifest file
+    """
+    return args['manifest'] if args['manifest'] else get_output_dir(args) / f"{name}_manifest.json"
+
+
+def load_manifest(manifest_file) -> Dict[str, Dict]:
+    """
+    Loads a job manifest, a JSON file with an entry for each completed job keyed by input file.
+    :param manifest_file: the path of the manifest
+    :return: the manifest as a dict (empty if the file doesn't exist yet)
+    """
+    if manifest_file and Path(manifest_file).exists():
+        with open(manifest_file) as src:
+            return json.load(src)
+    return {}
+
+
+def save_manifest(manifest: Dict[str, Dict], manifest_file):
+    """
+    Writes a job manifest atomically, so that an interrupted run doesn't leave a broken file.
+    :param manifest: the manifest as a dict
+    :param manifest_file: the path of the manifest
+    """
+    tmp_file = Path(f"{manifest_file}.tmp")
+    with open(tmp_file, 'w') as dst:
+        json.dump(manifest, dst, indent=1)
+    os.replace(tmp_file, manifest_file)
+
+
+def get_job_entry(input_file, outputs: Sequence, settings: str) -> Dict[str, Any]:
+    """
+    Creates the manifest entry of a job.
+    :param input_file: the input file of the job
+    :param outputs: the output files of the job
+    :param settings: a digest of the job arguments
+    :return: the entry, with the modification time and size of the input file
+    """
+    stat = Path(input_file).stat()
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'outputs': [str(out) for out in outputs],
+            'settings': settings}
+
+
+def is_up_to_date(manifest: Dict[str, Dict], input_file, outputs: Sequence, settings: str) -> bool:
+    """
+    Checks if a job is recorded as completed in the manifest, with the same input file (modification time and size),
+    outputs and arguments, and all of its outputs still exist.
+    """
+    entry = manifest.get(str(Path(input_file).resolve()))
+    return (entry is not None and entry == get_job_entry(input_file, outputs, settings)
+            and all(Path(out).exists() for out in outputs))
+
+
+def _init_batch_worker(gdal_cache_mb: Optional[int]):
+    if gdal_cache_mb:
+        from osgeo import gdal
+        gdal.SetCacheMax(gdal_cache_mb * 2**20)
+
+
+def run_batch(func: Callable, input_files: Sequence, job_args: Optional[Sequence[tuple]] = None,
+              output_files: Optional[Sequence[Sequence]] = None, workers: Optional[int] = None,
+              gdal_cache_mb: Optional[int] = None, manifest_file=None, retries: int = 1, force: bool = False,
+              **kwargs) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """
+    Runs one job per flightline in a process pool: func(input_file, *job_args[idx], **kwargs).
+    With a manifest, each completed job is recorded with the modification time and size of its input file,
+    its outputs and a digest of its arguments, and jobs that are up to date are skipped on re-runs.
+    A failed job doesn't abort the batch; it is retried in a new pool up to retries times, then skipped.
+    :param func: the function to run, must be defined at module level so it can be pickled
+    :param input_files: the input file of each job
+    :param job_args: the additional positional arguments of each job
+    :param output_files: the output files of each job; a job only counts as completed if they all exist afterwards
+    :param workers: the number of worker processes (default: number of CPUs)
+    :param gdal_cache_mb: the GDAL block cache size of each worker process in MB (default: GDAL's default)
+    :param manifest_file: the path of the JSON job manifest (default: no manifest)
+    :param retries: the number of times a failed job is retried
+    :param force: if True, run all jobs even if they are up to date
+    :param kwargs: keyword arguments passed on to func for every job
+    :return: the return values of the completed jobs and the error messages of the failed jobs, keyed by input file
+    """
+    input_files = [str(in_file) for in_file in input_files]
+    job_args = [tuple(args) for args in job_args] if job_args is not None else [()] * len(input_files)
+    output_files = output_files if output_files is not None else [[] for _ in input_files]
+    if not len(input_files) == len(job_args) == len(output_files):
+        raise IndexError("The number of input files, job arguments and output files do not match!")
+    manifest = load_manifest(manifest_file)
+    settings = [hashlib.sha1(repr((args, sorted(kwargs.items()))).encode()).hexdigest() for args in job_args]
+
+    pending = []
+    for idx, in_file in enumerate(input_files):
+        if manifest_file and not force and is_up_to_date(manifest, in_file, output_files[idx], settings[idx]):
+            print(f"Skipping {in_file}, outputs are up to date")
+        else:
+            pending.append(idx)
+
+    results, failures = {}, {}
+    for attempt in range(retries + 1):
+        if not pending:
+            break
+        if attempt:
+            print(f"Retrying {len(pending)} failed job(s), attempt {attempt} of {retries}")
+        failed = []
+        # a new pool for each attempt, so that a crashed worker doesn't break the retries
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                 initargs=(gdal_cache_mb,)) as pool:
+            futures = {pool.submit(func, input_files[idx], *job_args[idx], **kwargs): idx for idx in pending}
+            for future in as_completed(futures):
+                idx = futures[future]
+                in_file = input_files[idx]
+                try:
+                    result = future.result()
+                    missing = [str(out) for out in output_files[idx] if not Path(out).exists()]
+                    if missing:
+                        raise IOError(f"Outputs {missing} were not written")
+                except Exception as err:
+                    print(f"Failed {in_file}: {err!r}")
+                    failures[in_file] = repr(err)
+                    failed.append(idx)
+                    continue
+                results[in_file] = result
+                failures.pop(in_file, None)
+                print(f"Done with {in_file}")
+                if manifest_file:
+                    manifest[str(Path(in_file).resolve())] = get_job_entry(in_file, output_files[idx], settings[idx])
+                    save_manifest(manifest, manifest_file)
+        pending = failed
+
+    if failures:
+        print(f"{len(failures)} of {len(input_files)} job(s) failed: {', '.join(failures)}")
+    return results, failures
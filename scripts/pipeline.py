@@ -0,0 +1,218 @@
+# This is the shared code of the pipeline runner (see run_pipeline.py): tasks with declared inputs and outputs,
+# a JSON state file recording what each completed task was run with, and a scheduler that runs the tasks whose
+# dependencies are done in a process pool.
+import hashlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from parsing import _init_batch_worker, load_manifest, save_manifest
+import instrumentation
+
+# input files up to this size (MB) are hashed, so that a new modification time with unchanged content doesn't
+# re-run a task; larger files (the image cubes) are compared by modification time and size only
+hash_limit_mb = 64
+
+
+class Task:
+    """
+    One step of the pipeline: func(*args, **kwargs) reads the input files and writes the output files.
+    func must be defined at module level so it can be pickled. deps are the names of the tasks that must
+    be done first, usually the ones writing some of the inputs.
+    """
+
+    def __init__(self, name: str, func: Callable, args: Sequence = (), kwargs: Optional[Dict[str, Any]] = None,
+                 inputs: Sequence = (), outputs: Sequence = (), deps: Sequence[str] = ()):
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.kwargs = kwargs or {}
+        self.inputs = [str(fp) for fp in inputs]
+        self.outputs = [str(fp) for fp in outputs]
+        self.deps = list(deps)
+
+    def __repr__(self):
+        return f"Task({self.name!r}, {len(self.inputs)} inputs, {len(self.outputs)} outputs, deps={self.deps})"
+
+    def settings(self) -> str:
+        """Digest of the function and its arguments; a task with other settings is not up to date"""
+        return hashlib.sha1(repr((self.func.__module__, self.func.__qualname__, self.args,
+                                  sorted(self.kwargs.items()))).encode()).hexdigest()
+
+
+def file_sha1(fp, blocksize: int = 2**20) -> str:
+    """SHA-1 of the content of a file, read blocksize bytes at a time"""
+    digest = hashlib.sha1()
+    with open(fp, 'rb') as src:
+        for block in iter(lambda: src.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_entry(fp, previous: Optional[Dict[str, Any]] = None, hash_limit: int = hash_limit_mb) -> Dict[str, Any]:
+    """
+    State entry of an input file: modification time, size and, up to hash_limit MB, the SHA-1 of the content.
+    The hash of the previous entry is reused if the modification time and size are the same.
+    """
+    stat = Path(fp).stat()
+    entry = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+    if stat.st_size <= hash_limit * 2**20:
+        if previous and previous.get('sha1') and previous['mtime_ns'] == stat.st_mtime_ns \
+                and previous['size'] == stat.st_size:
+            entry['sha1'] = previous['sha1']
+        else:
+            entry['sha1'] = file_sha1(fp)
+    return entry
+
+
+def is_unchanged(previous: Optional[Dict[str, Any]], entry: Dict[str, Any]) -> bool:
+    """Same modification time and size, or same content if both entries have a hash"""
+    if previous is None or previous['size'] != entry['size']:
+        return False
+    if previous['mtime_ns'] == entry['mtime_ns']:
+        return True
+    return 'sha1' in previous and previous['sha1'] == entry.get('sha1')
+
+
+def check_task(state: Dict[str, Dict], task: Task, hash_limit: int = hash_limit_mb) -> Tuple[bool, Dict, List[str]]:
+    """
+    Checks if a task is recorded as completed in the state with the same settings, outputs and unchanged inputs
+    (see :func:`is_unchanged`), and all of its outputs still exist.
+    :return: whether the task is up to date, the current entries of its inputs and the missing inputs
+    """
+    missing = [fp for fp in task.inputs if not Path(fp).exists()]
+    if missing:
+        return False, {}, missing
+    recorded = state.get(task.name, {})
+    previous = recorded.get('inputs', {})
+    inputs = {fp: file_entry(fp, previous.get(fp), hash_limit) for fp in task.inputs}
+    up_to_date = (recorded.get('settings') == task.settings() and recorded.get('outputs') == task.outputs
+                  and set(previous) == set(inputs) and all(is_unchanged(previous[fp], inputs[fp]) for fp in inputs)
+                  and all(Path(out).exists() for out in task.outputs))
+    return up_to_date, inputs, []
+
+
+def task_order(tasks: Sequence[Task]) -> List[str]:
+    """Names of the tasks in an order where each task comes after its dependencies"""
+    bynames = {task.name: task for task in tasks}
+    if len(bynames) != len(tasks):
+        raise ValueError("Task names are not unique")
+    order, visiting = [], set()
+
+    def visit(name, path):
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle: {' -> '.join(path + [name])}")
+        if name not in bynames:
+            raise ValueError(f"Unknown dependency {name} of {path[-1]}")
+        visiting.add(name)
+        for dep in bynames[name].deps:
+            visit(dep, path + [name])
+        visiting.discard(name)
+        order.append(name)
+
+    for task in tasks:
+        visit(task.name, [])
+    return order
+
+
+def _run_task(name: str, func: Callable, args: tuple, kwargs: Dict[str, Any]):
+    stage, _, target = name.partition(':')
+    with instrumentation.stage(f"task:{stage}", flightline=instrumentation.flightline_from_path(target)):
+        return func(*args, **kwargs)
+
+
+def run_tasks(tasks: Sequence[Task], state_file=None, workers: Optional[int] = None, force: bool = False,
+              dry_run: bool = False, retries: int = 0, hash_limit: int = hash_limit_mb,
+              gdal_cache_mb: Optional[int] = None) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    Runs the tasks in a process pool, each as soon as its dependencies are done, so independent flightlines are
+    processed concurrently. Whether a task is up to date (see :func:`check_task`) is decided when its dependencies
+    are done, so a task whose inputs were rewritten with the same content is still skipped. Each completed task is
+    recorded in the JSON state file. A failed task is retried up to retries times; the tasks depending on it are
+    not run.
+    :param tasks: the tasks
+    :param state_file: the path of the JSON state file (default: no state, all tasks are run)
+    :param workers: the number of worker processes (default: number of CPUs)
+    :param force: if True, run all tasks even if they are up to date
+    :param dry_run: if True, only report which tasks would run
+    :param retries: the number of times a failed task is retried
+    :param hash_limit: input files up to this size in MB are compared by content, see :func:`file_entry`
+    :param gdal_cache_mb: the GDAL block cache size of each worker process in MB
+    :return: the status of each task (done, up to date, would run, failed or blocked) and the error messages
+        of the failed and blocked tasks, keyed by task name
+    """
+    bynames = {task.name: task for task in tasks}
+    order = task_order(tasks)
+    state = load_manifest(state_file)
+    status, failures, attempts = {}, {}, {}
+    pending, running = list(order), {}
+
+    pool = None if dry_run else ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                                    initargs=(gdal_cache_mb,))
+    try:
+        while pending or running:
+            for name in [name for name in pending if all(dep in status for dep in bynames[name].deps)]:
+                pending.remove(name)
+                task = bynames[name]
+                blocking = [dep for dep in task.deps if status[dep] in ('failed', 'blocked')]
+                if blocking:
+                    status[name], failures[name] = 'blocked', f"Dependencies {blocking} failed"
+                    print(f"Not running {name}: {failures[name]}")
+                    continue
+                if dry_run and any(status[dep] == 'would run' for dep in task.deps):
+                    status[name] = 'would run'
+                    print(f"Would run {name} (after its dependencies)")
+                    continue
+                up_to_date, inputs, missing = check_task(state, task, hash_limit)
+                if missing and not dry_run:
+                    status[name], failures[name] = 'failed', f"Inputs {missing} do not exist"
+                    print(f"Failed {name}: {failures[name]}")
+                elif up_to_date and not force:
+                    status[name] = 'up to date'
+                    print(f"Skipping {name}, outputs are up to date")
+                    if state_file and not dry_run and inputs != state[name]['inputs']:
+                        # same content with a new modification time: record it to skip the hashing next time
+                        state[name]['inputs'] = inputs
+                        save_manifest(state, state_file)
+                elif dry_run:
+                    status[name] = 'would run'
+                    print(f"Would run {name}" + (f" (missing inputs {missing})" if missing else ''))
+                else:
+                    attempts[name] = 1
+                    running[pool.submit(_run_task, name, task.func, task.args, task.kwargs)] = (name, inputs)
+                    print(f"Started {name}")
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, inputs = running.pop(future)
+                task = bynames[name]
+                try:
+                    future.result()
+                    missing = [out for out in task.outputs if not Path(out).exists()]
+                    if missing:
+                        raise IOError(f"Outputs {missing} were not written")
+                except Exception as err:
+                    print(f"Failed {name}: {err!r}")
+                    if attempts[name] <= retries:
+                        print(f"Retrying {name}, attempt {attempts[name]} of {retries}")
+                        attempts[name] += 1
+                        running[pool.submit(_run_task, name, task.func, task.args, task.kwargs)] = (name, inputs)
+                    else:
+                        status[name], failures[name] = 'failed', repr(err)
+                    continue
+                status[name] = 'done'
+                print(f"Done with {name}")
+                if state_file:
+                    state[name] = {'settings': task.settings(), 'outputs': task.outputs, 'inputs': inputs}
+                    save_manifest(state, state_file)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if failures:
+        print(f"{len(failures)} of {len(tasks)} task(s) failed or were not run: {', '.join(failures)}")
+    return status, failures
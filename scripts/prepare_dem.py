@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Script for preparing the main DEM of a campaign from IFSAR tiles      #
+#       (as notebook 04): the tiles under the flightline enclosure are found  #
+#       in the tile index and warped to the target CRS, extent and            #
+#       resolution in one step. Writes the ENVI DEM and its _meta.txt.        #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      geopandas                                                              #
+#      rasterio                                                               #
+#      shapely                                                                #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+import geopandas as gp
+
+from parsing import add_instrumentation_args  # (also makes the notebook helper modules importable)
+import instrumentation
+import dem
+
+
+def dem_filename(resolution: float, resampling: str) -> str:
+    """Main DEM file name of notebook 04, e.g. IFSAR_crop_1m_cubic_main.bsq"""
+    return f"IFSAR_crop_{resolution:g}m_{'cubic_' if resampling == 'cubic' else ''}main.bsq"
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='This is a script for preparing the main DEM of a campaign from DEM tiles.')
+    parser.add_argument('projectdir', type=Path, help='Project folder (e.g. Z:/fihyper/cwaigl/20190826_BC)')
+    parser.add_argument('tilesdir', type=Path, help='Folder with the DEM tiles (either layout of notebook 04)')
+    parser.add_argument('--gis-subdir', default=Path('00_aux', 'GIS', 'Flightline'), type=Path, dest='gis_subdir',
+                        help='Folder of the *useable.shp flightline Shapefile in the project folder')
+    parser.add_argument('--dem-subdir', default=Path('01_inputs', 'DEM'), type=Path, dest='dem_subdir',
+                        help='Output folder in the project folder')
+    parser.add_argument('--index', default=None, type=Path, dest='index',
+                        help=f'Tile index (default: {dem.tile_index_name} in the tile folder)')
+    parser.add_argument('-r', '--resampling', default='cubic', choices=dem.resampling_methods, dest='resampling',
+                        help='Resampling method (default: cubic)')
+    parser.add_argument('--resolution', default=1.0, type=float, dest='resolution',
+                        help='Target resolution in m (default: 1)')
+    parser.add_argument('--crs', default="EPSG:32606", dest='dst_crs', help='Target CRS (default: UTM 6N)')
+    parser.add_argument('-b', '--blocklines', default=1024, type=int, dest='blocklines',
+                        help='Rows warped and written at a time')
+    parser.add_argument('--author', default=None, dest='author', help='Author for the metadata file')
+    add_instrumentation_args(parser)
+    args = parser.parse_args()
+    with instrumentation.session(args.report, args.profile):
+
+        flightlinedf = gp.read_file(next((args.projectdir / args.gis_subdir).glob("*useable.shp")))
+        enclosure = dem.flightline_enclosure(flightlinedf)
+        tiles = dem.query_tiles(dem.update_tile_index(args.tilesdir, args.index), enclosure)
+        if tiles.empty:
+            parser.error(f"No DEM tiles in {args.tilesdir} cover the flightlines")
+        print(f"{len(tiles)} DEM tiles cover the flightlines")
+
+        outfn = args.projectdir / args.dem_subdir / dem_filename(args.resolution, args.resampling)
+        outfn.parent.mkdir(parents=True, exist_ok=True)
+        dem.warp_dem(list(tiles['tiffile']), enclosure, outfn, args.dst_crs, args.resolution, args.resampling,
+                     blocklines=args.blocklines)
+        print(f"Done writing {outfn}")
+
+        global_meta = {}
+        if args.author:
+            global_meta['author'] = args.author
+        global_meta['downsampling'] = args.resampling
+        global_meta['DEM_tile_IDs'] = dem.tile_id_string(tiles)
+        print(f"Done writing {dem.write_dem_meta(global_meta, outfn)}")
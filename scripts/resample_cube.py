@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Script for resampling supercubes to the bands of another sensor       #
+#       (Landsat 8, Sentinel-2, custom bands), with a cached sparse weight    #
+#       matrix per sensor pair, flightlines processed in parallel.            #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      numpy                                                                  #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+from pathlib import Path
+from typing import List, Optional
+
+from parsing import parse_args, get_parser, get_filenames, get_manifest_file, get_output_dir, run_batch
+import instrumentation
+import resampling
+
+
+def get_target(sensor: Optional[str] = None, srf_dir: Optional[str] = None,
+               wavelengths: Optional[List[float]] = None, band_width: float = 20.0) -> resampling.BandSet:
+    """
+    Gets the target bands: those of an ATCOR sensor model folder, of custom Gaussian bands, or of a sensor in
+    :data:`resampling.sensor_bands`, in this order of precedence.
+    """
+    if srf_dir is not None:
+        return resampling.model_bandset(srf_dir)
+    if wavelengths:
+        return resampling.wavelength_bandset(wavelengths, band_width)
+    return resampling.sensor_bandset(sensor)
+
+
+def resampled_name(in_file: str, tag: str) -> str:
+    """
+    Gets the file name of a resampled cube: the input name with the tag before the _atm_bcor or _atm suffix, so
+    that the resampled cubes are valid input of generate_vi.py.
+    """
+    path = Path(in_file)
+    for suffix in ('_atm_bcor', '_atm'):
+        if path.stem.endswith(suffix):
+            return f"{path.stem[:-len(suffix)]}_{tag}{suffix}{path.suffix}"
+    return f"{path.stem}_{tag}{path.suffix}"
+
+
+def is_resampled(in_file: str) -> bool:
+    """Checks if a file is a resampled cube, named with the tag of its sensor folder (see :func:`resampled_name`)"""
+    path = Path(in_file)
+    return f"_{path.parent.name}_atm" in path.stem
+
+
+@instrumentation.instrumented('resample', 'input_file')
+def resample_flightline(input_file: str, output_file: str, sensor: Optional[str] = None,
+                        srf_dir: Optional[str] = None, wavelengths: Optional[List[float]] = None,
+                        band_width: float = 20.0, source_model: Optional[str] = None, block_lines: int = 256):
+    """
+    Resamples one flightline, see :func:`resampling.resample_cube`.
+    :param input_file: the input supercube (raw ENVI)
+    :param output_file: the output cube, written as ENVI float32 in the interleave of the input
+    :param source_model: an ATCOR sensor model folder with the responses of the input bands
+        (default: Butterworth responses at the header wavelengths)
+    """
+    source = None if source_model is None else resampling.model_bandset(source_model)
+    resampling.resample_cube(input_file, output_file, get_target(sensor, srf_dir, wavelengths, band_width), source,
+                             block_lines)
+
+
+if __name__ == '__main__':
+    parser = get_parser('This is a script for resampling supercubes to the bands of another sensor.')
+    parser.add_argument('-s', '--sensor', default='sentinel2', choices=list(resampling.sensor_bands), dest='sensor',
+                        help='Target sensor, with Gaussian band responses (default: sentinel2)')
+    parser.add_argument('--srf-dir', default=None, type=Path, dest='srf_dir',
+                        help='Folder with bandNNN.rsp responses of the target sensor (as the ATCOR sensor models), '
+                             'instead of --sensor')
+    parser.add_argument('--wavelengths', default=None, type=float, nargs='+', dest='wavelengths',
+                        help='Custom target band wavelengths in nm, instead of --sensor (see --band-width)')
+    parser.add_argument('--band-width', default=20.0, type=float, dest='band_width',
+                        help='FWHM of the custom target bands in nm (default: 20)')
+    parser.add_argument('--source-model', default=None, type=Path, dest='source_model',
+                        help='ATCOR sensor model folder with the responses of the input bands (e.g. '
+                             'sensormodel_for_ATCOR/HySpex_459_FoV2_Husky); by default Butterworth responses at the '
+                             'header wavelengths and FWHM')
+    parser.add_argument('-t', '--tile-lines', default=256, type=int, dest='tile_lines',
+                        help='Number of lines to process at a time (default: 256)')
+
+    arguments = parse_args(parser)
+    if arguments['output'].suffix != '':
+        parser.error('Please specify an output directory!')
+    tag = (arguments['srf_dir'].name if arguments['srf_dir'] else
+           'custom' if arguments['wavelengths'] else arguments['sensor'])
+    # the resampled cubes of earlier runs are also found by -d if they were written into the input directory
+    input_files = [in_file for in_file in get_filenames(arguments, tag)[0] if not is_resampled(in_file)]
+    outdir = get_output_dir(arguments) / tag
+    outdir.mkdir(parents=True, exist_ok=True)
+    output_files = [str(outdir / resampled_name(in_file, tag)) for in_file in input_files]
+    with instrumentation.session(arguments['report'], arguments['profile']):
+        run_batch(resample_flightline, input_files, [(out_file,) for out_file in output_files],
+                  [[out_file] for out_file in output_files], arguments['workers'], arguments['gdal_cache_mb'],
+                  get_manifest_file(arguments, f"resample_{tag}"), arguments['retries'], arguments['force'],
+                  sensor=arguments['sensor'], srf_dir=arguments['srf_dir'] and str(arguments['srf_dir']),
+                  wavelengths=arguments['wavelengths'], band_width=arguments['band_width'],
+                  source_model=arguments['source_model'] and str(arguments['source_model']),
+                  block_lines=arguments['tile_lines'])
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Script for running the processing chain of a campaign from a JSON     #
+#       project configuration: NAV to GIS (notebook 02), main DEM (04),       #
+#       flightline DEMs (04a), masks (06), navigation metadata (07), RGB      #
+#       overviews and vegetation indices. Each stage is a task per project    #
+#       or per flightline with declared inputs and outputs; tasks whose       #
+#       inputs are unchanged are skipped, flightlines run in parallel.        #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      gdal                                                                   #
+#      geopandas                                                              #
+#      rasterio                                                               #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+import json
+from argparse import ArgumentParser
+from pathlib import Path
+
+import geopandas as gp
+import rasterio as rio
+
+from parsing import add_instrumentation_args  # (also makes the notebook helper modules importable)
+from pipeline import Task, hash_limit_mb, run_tasks
+import dem
+import instrumentation
+import masking
+import navgis
+import navigation
+import spectral
+import generate_rgb_overview
+import generate_vi
+from prepare_dem import dem_filename
+
+stages = ('nav_gis', 'main_dem', 'line_dems', 'masks', 'flightdata', 'overviews', 'vis')
+
+# options of each stage and their defaults; paths are relative to the project folder
+stage_defaults = {
+    'nav_gis': {'navdir': None, 'output': None, 'tolerance': 1.0, 'every': None, 'all_sensors': False},
+    'main_dem': {'tilesdir': None, 'index': None, 'flightlines': None, 'dem_subdir': '01_inputs/DEM',
+                 'resolution': 1.0, 'resampling': 'cubic', 'crs': "EPSG:32606", 'blocklines': 1024, 'author': None},
+    'line_dems': {'main_dem': None, 'buffer': 500, 'nav_pattern': "_VNIR_1800_SN00812_FOVx2_raw.txt"},
+    'masks': {'subdir': 'Parge_with_offsets', 'extra': '_rad', 'lprop': 0.0, 'rprop': 0.0},
+    'flightdata': {'nav_pattern': "_VNIR_1800_SN00812_FOVx2_raw.txt",
+                   'ref_pattern': "_VNIR_1800_SN00812_FOVx2_raw_rad_bsq_float32.hdr", 'utc_offset': 8,
+                   'every': None, 'table': None, 'outfile_pattern': "VNIR_SWIR_rad_geo_flightdata.txt"},
+    'overviews': {'bands': [290, 140, 20], 'wavelengths': None, 'stats': 'exact', 'sample_fraction': 0.01,
+                  'percentiles': None, 'atm': False, 'outdir': None},
+    'vis': {'vi_types': ['ndvi'], 'band_mode': 'nearest', 'band_width': 20.0, 'tile_lines': None,
+            'overviews': False, 'atm': False, 'outdir': None},
+}
+
+# sensor file names of the PARGE outputs used for the masks (see notebook 06)
+vnir_sensor = "VNIR_1800_SN00812_FOVx2"
+swir_sensor = "SWIR_384me_SN3107_FOVx2"
+
+
+def nav_gis_task(navpaths, output, tolerance, step):
+    """NAV files to the flightline GeoPackage or Shapefile (see nav_to_gis.py)"""
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    return len(navgis.nav_to_gis(navpaths, output, tolerance, step))
+
+
+def main_dem_task(flightlines, tilesdir, index, outfn, dst_crs, resolution, resampling, blocklines, author):
+    """Main DEM of the flightlines from the DEM tiles, with its _meta.txt (see prepare_dem.py)"""
+    enclosure = dem.flightline_enclosure(gp.read_file(flightlines))
+    tiles = dem.query_tiles(dem.update_tile_index(tilesdir, index), enclosure)
+    if tiles.empty:
+        raise ValueError(f"No DEM tiles in {tilesdir} cover the flightlines")
+    Path(outfn).parent.mkdir(parents=True, exist_ok=True)
+    dem.warp_dem(list(tiles['tiffile']), enclosure, outfn, dst_crs, resolution, resampling, blocklines=blocklines)
+    meta = {'author': author} if author else {}
+    meta.update(downsampling=resampling, DEM_tile_IDs=dem.tile_id_string(tiles))
+    dem.write_dem_meta(meta, outfn)
+
+
+def line_dem_task(maindemfn, navpath, outfn, name, buffer):
+    """DEM of one flightline cut out of the main DEM (see flightline_dems.py)"""
+    mainmetafn = Path(maindemfn).with_name(f"{Path(maindemfn).stem}_meta.txt")
+    meta = json.loads(mainmetafn.read_text()) if mainmetafn.exists() else {}
+    Path(outfn).parent.mkdir(parents=True, exist_ok=True)
+    tracks = gp.GeoSeries([dem.nav_track(navpath)], index=[name], crs="EPSG:4326")
+    if not dem.extract_line_dems(maindemfn, tracks, {name: outfn}, buffer, workers=1, meta=meta):
+        raise ValueError(f"Flightline {name} is outside the main DEM")
+
+
+def mask_task(vnirpath, swirpath, vnirscapath, swirscapath, outfn, lprop, rprop):
+    """Flightline mask from the four PARGE _geo files (see notebook 06)"""
+    outdata, outmeta = masking.getflightlinemask(vnirpath, swirpath, vnirscapath, swirscapath, lprop, rprop)
+    Path(outfn).parent.mkdir(parents=True, exist_ok=True)
+    with rio.open(outfn, "w", **outmeta) as dst:
+        dst.write(outdata, indexes=1)
+
+
+def flightdata_task(projdir, prefix, navfilepattern, reffilepattern, utc_offset, step, table, outfile_patt):
+    """Summary table and per-line navigation metadata of all flightlines (see write_flightdata.py)"""
+    summary, alongtrack = navigation.summarize_campaign(projdir, prefix, navfilepattern, reffilepattern,
+                                                        utc_offset=utc_offset, step=step)
+    navigation.write_summary_table(summary, table)
+    navigation.write_flightdata(summary, projdir, outfile_patt, utc_offset=utc_offset)
+    navigation.write_solar_along_track(summary, alongtrack, projdir)
+
+
+def overview_task(in_file, out_file, bands, wavelengths, stats_mode, sample_fraction, percentiles):
+    """RGB overview of one supercube, scaled with its own band statistics (see generate_rgb_overview.py)"""
+    if wavelengths:
+        bands = spectral.get_band_numbers(f"{str(in_file).rsplit('.', 1)[0]}.hdr", wavelengths)
+    Path(out_file).parent.mkdir(parents=True, exist_ok=True)
+    stats = generate_rgb_overview.get_file_stats(in_file, bands, stats_mode, sample_fraction, percentiles)
+    generate_rgb_overview.generate_overview(in_file, out_file, bands, [generate_rgb_overview.scale_from_stats(
+        stats[str(band)]) for band in bands])
+
+
+def vi_task(in_file, out_file, vi_types, tile_lines, overviews, band_mode, band_width):
+    """Vegetation indices of one supercube as bands of one GeoTIFF (see generate_vi.py)"""
+    Path(out_file).parent.mkdir(parents=True, exist_ok=True)
+    generate_vi.generate_vis(in_file, [out_file], vi_types, tile_lines, overviews, band_mode=band_mode,
+                             band_width=band_width)
+
+
+def project_path(projectdir: Path, path) -> Path:
+    """A configured path, relative to the project folder unless absolute"""
+    return projectdir / Path(path)
+
+
+def get_supercubes(linedir: Path, atm: bool):
+    """The ATCOR supercubes of a flightline folder, as found by generate_rgb_overview.py and generate_vi.py"""
+    return sorted(linedir.rglob(f"{linedir.name}*{'atm.bsq' if atm else 'atm_bcor.bsq'}"))
+
+
+def main_dem_path(projectdir: Path, options: dict) -> Path:
+    """Main DEM written by the main_dem stage with these options"""
+    return project_path(projectdir, options['dem_subdir']) / dem_filename(options['resolution'],
+                                                                          options['resampling'])
+
+
+def flightline_gis_path(projectdir: Path, prefix: str, options: dict) -> Path:
+    """Flightline GeoPackage or Shapefile written by the nav_gis stage with these options"""
+    return project_path(projectdir, options['output'] or Path('00_aux', 'GIS', 'Flightline', f"{prefix}.gpkg"))
+
+
+def nav_gis_tasks(projectdir, prefix, linedirs, config):
+    options = config['nav_gis']
+    navdir = None if options['navdir'] is None else project_path(projectdir, options['navdir'])
+    navpaths = navgis.find_nav_files(projectdir, prefix, not options['all_sensors'], navdir)
+    if not navpaths:
+        print(f"No NAV files for {prefix} found, skipping nav_gis")
+        return []
+    output = flightline_gis_path(projectdir, prefix, options)
+    return [Task('nav_gis', nav_gis_task, (navpaths, output, options['tolerance'], options['every']),
+                 inputs=navpaths, outputs=[output])]
+
+
+def main_dem_tasks(projectdir, prefix, linedirs, config):
+    options = config['main_dem']
+    if options['tilesdir'] is None:
+        raise ValueError("The main_dem stage needs the folder of the DEM tiles (tilesdir)")
+    tilesdir = project_path(projectdir, options['tilesdir'])
+    index = None if options['index'] is None else project_path(projectdir, options['index'])
+    if options['flightlines']:
+        flightlines, deps = project_path(projectdir, options['flightlines']), []
+    else:
+        flightlines, deps = flightline_gis_path(projectdir, prefix, config['nav_gis']), ['nav_gis']
+    outfn = main_dem_path(projectdir, options)
+    return [Task('main_dem', main_dem_task, (flightlines, tilesdir, index, outfn, options['crs'],
+                                             options['resolution'], options['resampling'], options['blocklines'],
+                                             options['author']),
+                 inputs=[flightlines] + sorted(dem.find_tile_shapefiles(tilesdir)),
+                 outputs=[outfn, outfn.with_name(f"{outfn.stem}_meta.txt")], deps=deps)]
+
+
+def line_dem_tasks(projectdir, prefix, linedirs, config):
+    options = config['line_dems']
+    if options['main_dem']:
+        maindemfn = project_path(projectdir, options['main_dem'])
+    else:
+        maindemfn = main_dem_path(projectdir, config['main_dem'])
+    fnelem = 'cubic_' if config['main_dem']['resampling'] == 'cubic' else ''
+    tasks = []
+    for linedir in linedirs:
+        navpath = linedir / 'NAV' / f"{linedir.name}{options['nav_pattern']}"
+        if not navpath.exists():
+            print(f"No NAV file in {linedir}, skipping its DEM")
+            continue
+        outfn = linedir / 'ELE' / f"{linedir.name.replace('-', '_')}_{fnelem}ELE.bsq"
+        tasks.append(Task(f"line_dem:{linedir.name}", line_dem_task,
+                          (maindemfn, navpath, outfn, linedir.name, options['buffer']),
+                          inputs=[maindemfn, navpath], outputs=[outfn], deps=['main_dem']))
+    return tasks
+
+
+def mask_tasks(projectdir, prefix, linedirs, config):
+    options = config['masks']
+    tasks = []
+    for linedir in linedirs:
+        lineno = linedir.name[-2:]
+        inputs = [linedir / options['subdir'] / f"{linedir.name}_{sensor}_raw{options['extra']}_bsq_float32_{suffix}"
+                  for sensor, suffix in ((vnir_sensor, 'geo.bsq'), (swir_sensor, 'geo.bsq'),
+                                         (vnir_sensor, 'geo_sca.bsq'), (swir_sensor, 'geo_sca.bsq'))]
+        if not all(fp.exists() for fp in inputs):
+            print(f"Not all PARGE files in {linedir / options['subdir']}, skipping its mask")
+            continue
+        outfn = linedir / 'ATCOR' / f"vnir_swir_{lineno}_mask.bsq"
+        tasks.append(Task(f"mask:{linedir.name}", mask_task, (*inputs, outfn, options['lprop'], options['rprop']),
+                          inputs=inputs, outputs=[outfn]))
+    return tasks
+
+
+def flightdata_tasks(projectdir, prefix, linedirs, config):
+    options = config['flightdata']
+    # the summary covers all flightlines of the project, also with --lines
+    alllines = sorted(projectdir.glob(f"{prefix}_??"))
+    inputs = [fp for linedir in alllines for fp in (linedir / 'NAV' / f"{linedir.name}{options['nav_pattern']}",
+                                                    linedir / 'RAD' / f"{linedir.name}{options['ref_pattern']}")]
+    table = project_path(projectdir, options['table'] or f"{prefix}_flightdata.csv")
+    outputs = [table] + [linedir / 'NAV' / f"{linedir.name}_{options['outfile_pattern']}" for linedir in alllines]
+    if options['every']:
+        outputs += [linedir / 'NAV' / f"{linedir.name}_solar_along_track.csv" for linedir in alllines]
+    return [Task('flightdata', flightdata_task,
+                 (projectdir, prefix, options['nav_pattern'], options['ref_pattern'], options['utc_offset'],
+                  options['every'], table, options['outfile_pattern']), inputs=inputs, outputs=outputs)]
+
+
+def overview_tasks(projectdir, prefix, linedirs, config):
+    options = config['overviews']
+    if options['wavelengths']:
+        info = f"{'_'.join(f'{wvl:g}' for wvl in options['wavelengths'])}nm"
+    else:
+        info = '_'.join(map(str, options['bands']))
+    tasks = []
+    for linedir in linedirs:
+        for in_file in get_supercubes(linedir, options['atm']):
+            outdir = project_path(projectdir, options['outdir']) if options['outdir'] else in_file.parent
+            out_file = outdir / f"{in_file.stem}_{info}_overview.tif"
+            tasks.append(Task(f"overview:{in_file.relative_to(projectdir).as_posix()}", overview_task,
+                              (in_file, out_file, options['bands'], options['wavelengths'], options['stats'],
+                               options['sample_fraction'], options['percentiles']),
+                              inputs=[in_file, in_file.with_suffix('.hdr')], outputs=[out_file]))
+    return tasks
+
+
+def vi_tasks(projectdir, prefix, linedirs, config):
+    options = config['vis']
+    vi_types = list(dict.fromkeys(vi_type.lower() for vi_type in options['vi_types']))
+    tasks = []
+    for linedir in linedirs:
+        for in_file in get_supercubes(linedir, options['atm']):
+            outdir = project_path(projectdir, options['outdir']) if options['outdir'] else in_file.parent
+            out_file = outdir / f"{in_file.stem}_{'_'.join(vi_types)}_overview.tif"
+            tasks.append(Task(f"vi:{in_file.relative_to(projectdir).as_posix()}", vi_task,
+                              (in_file, out_file, vi_types, options['tile_lines'], options['overviews'],
+                               options['band_mode'], options['band_width']),
+                              inputs=[in_file, in_file.with_suffix('.hdr')], outputs=[out_file]))
+    return tasks
+
+
+stage_builders = {'nav_gis': nav_gis_tasks, 'main_dem': main_dem_tasks, 'line_dems': line_dem_tasks,
+                  'masks': mask_tasks, 'flightdata': flightdata_tasks, 'overviews': overview_tasks,
+                  'vis': vi_tasks}
+
+
+def read_config(fp) -> dict:
+    """
+    Project configuration from a JSON file: projectdir, prefix, the stages to run and the options of each stage
+    (see stage_defaults), merged with the defaults. Unknown stages and options are errors.
+    """
+    with open(fp) as src:
+        config = json.load(src)
+    for key in ('projectdir', 'prefix'):
+        if key not in config:
+            raise ValueError(f"{fp} has no {key}")
+    config.setdefault('stages', list(stages))
+    unknown = [stage for stage in config['stages'] if stage not in stages]
+    if unknown:
+        raise ValueError(f"Unknown stages {unknown}, must be some of {stages}")
+    for stage, defaults in stage_defaults.items():
+        options = config.get(stage, {})
+        unknown = [key for key in options if key not in defaults]
+        if unknown:
+            raise ValueError(f"Unknown {stage} options {unknown}, must be some of {list(defaults)}")
+        config[stage] = dict(defaults, **options)
+    return config
+
+
+def build_tasks(config: dict, selected=None, lines=None):
+    """
+    Tasks of the selected stages (default: the stages of the configuration), for the flightlines with the
+    given numbers (default: all). Dependencies on tasks of stages that aren't run are dropped, their outputs
+    are then inputs that must exist.
+    """
+    projectdir, prefix = Path(config['projectdir']), config['prefix']
+    linedirs = sorted(projectdir.glob(f"{prefix}_??"))
+    if lines:
+        linedirs = [linedir for linedir in linedirs if linedir.name[-2:] in lines]
+    tasks = []
+    for stage in stages:
+        if stage in (selected or config['stages']):
+            tasks += stage_builders[stage](projectdir, prefix, linedirs, config)
+    names = {task.name for task in tasks}
+    for task in tasks:
+        task.deps = [dep for dep in task.deps if dep in names]
+    return tasks
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='This is a script for running the processing chain of a campaign.')
+    parser.add_argument('config', type=Path, help='JSON project configuration (see pipeline_config_example.json)')
+    parser.add_argument('-s', '--stages', nargs='+', default=None, choices=stages, dest='stages',
+                        help='Stages to run (default: the stages in the configuration)')
+    parser.add_argument('-l', '--lines', nargs='+', default=None, dest='lines',
+                        help='Flightline numbers to process (e.g. 01 05; default: all)')
+    parser.add_argument('-w', '--workers', default=None, type=int, dest='workers',
+                        help='Number of tasks to run in parallel (default: the configuration, or number of CPUs)')
+    parser.add_argument('--gdal-cache', default=None, type=int, dest='gdal_cache_mb',
+                        help='GDAL block cache size per worker process in MB')
+    parser.add_argument('--state', default=None, type=Path, dest='state',
+                        help='JSON file recording the completed tasks (default: pipeline_state.json in the project '
+                             'folder)')
+    parser.add_argument('--retries', default=0, type=int, dest='retries',
+                        help='Number of times a failed task is retried')
+    parser.add_argument('--force', help='Run all tasks, even if their outputs are up to date', dest='force',
+                        action='store_true')
+    parser.add_argument('-n', '--dry-run', help='Only list the tasks that would run', dest='dry_run',
+                        action='store_true')
+    add_instrumentation_args(parser)
+    args = parser.parse_args()
+
+    try:
+        config = read_config(args.config)
+        tasks = build_tasks(config, args.stages, [line.zfill(2) for line in args.lines] if args.lines else None)
+    except ValueError as err:
+        parser.error(str(err))
+    print(f"There are {len(tasks)} tasks")
+
+    state = args.state or Path(config['projectdir']) / config.get('state', 'pipeline_state.json')
+    with instrumentation.session(args.report, args.profile):
+        status, failures = run_tasks(tasks, state, args.workers or config.get('workers'), args.force,
+                                     args.dry_run, args.retries, config.get('hash_limit_mb', hash_limit_mb),
+                                     args.gdal_cache_mb or config.get('gdal_cache_mb'))
+    for result in ('done', 'up to date', 'would run', 'failed', 'blocked'):
+        count = sum(value == result for value in status.values())
+        if count:
+            print(f"{count} task(s) {result}")
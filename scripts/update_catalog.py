@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Script for building and updating the flightline catalog of all        #
+#       campaigns (as notebook DM01), exporting it and querying it.           #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      geopandas                                                              #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+import parsing  # noqa: F401 (makes the notebook helper modules importable)
+import catalog
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='This is a script for updating the flightline catalog of all campaigns.')
+    parser.add_argument('basedir', type=Path, help='Folder with the campaign folders (e.g. Z:/fihyper/cwaigl)')
+    parser.add_argument('--catalog', default=None, type=Path, dest='catalog',
+                        help='Catalog GeoPackage (default: ArchivePrep/GIS/HySpexBF_Catalog.gpkg in basedir)')
+    parser.add_argument('--kinds', default=None, type=Path, dest='kinds',
+                        help='JSON file mapping campaign folder names to their kind (purpose)')
+    parser.add_argument('--files', default=None, type=Path, dest='files',
+                        help='JSON file mapping campaign folder names to their flightline file, relative to basedir')
+    parser.add_argument('--rebuild', help='Read all campaigns again', dest='rebuild', action='store_true')
+    parser.add_argument('--export', nargs='+', default=[], type=Path, dest='exports',
+                        help='Also write the catalog to these .csv, .shp or .gpkg files')
+    parser.add_argument('--bbox', nargs=4, type=float, default=None, dest='bbox',
+                        metavar=('MINLON', 'MINLAT', 'MAXLON', 'MAXLAT'), help='List the flightlines in this box')
+    parser.add_argument('--start', default=None, dest='start', help='List the flightlines from this date (YYYY-MM-DD)')
+    parser.add_argument('--end', default=None, dest='end', help='List the flightlines up to this date (YYYY-MM-DD)')
+    parser.add_argument('--kind', nargs='+', default=None, dest='kind', help='List the flightlines of these kinds')
+    args = parser.parse_args()
+
+    catalogpath = args.catalog if args.catalog else args.basedir / 'ArchivePrep' / 'GIS' / 'HySpexBF_Catalog.gpkg'
+    if any(export.resolve() == catalogpath.resolve() for export in args.exports):
+        parser.error(f"Cannot export the catalog {catalogpath} to itself")
+    catalogpath.parent.mkdir(parents=True, exist_ok=True)
+    changed, removed = catalog.update_catalog(args.basedir, catalogpath,
+                                              catalog.read_kinds(args.kinds) if args.kinds else None, args.rebuild,
+                                              catalog.read_files(args.files) if args.files else None)
+    print(f"Updated {catalogpath}: {len(changed)} campaigns read ({', '.join(changed)}), "
+          f"{len(removed)} removed ({', '.join(removed)})")
+
+    for export in args.exports:
+        print(f"Done writing {catalog.export_catalog(catalogpath, export)}")
+
+    if args.bbox or args.start or args.end or args.kind:
+        try:
+            flightlines = catalog.query_catalog(catalogpath, args.bbox, args.start, args.end, args.kind)
+        except ValueError as err:
+            parser.error(f"Dates must be YYYY-MM-DD: {err}")
+        for label, group in flightlines.groupby('label'):
+            print(f"{label} ({group['kind'].iloc[0]}): flightlines {', '.join(map(str, group['FlightlineID']))}")
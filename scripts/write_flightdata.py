@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Script for writing the navigation and solar parameters of all         #
+#       flightlines of a campaign: one summary table plus the per-line        #
+#       _flightdata.txt files (as notebook 07).                               #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      numpy                                                                  #
+#      pytz                                                                   #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+from parsing import add_instrumentation_args  # (also makes the notebook helper modules importable)
+import instrumentation
+import navigation
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='This is a script for writing the navigation and solar parameters of all '
+                                        'flightlines in a project folder.')
+    parser.add_argument('projdir', type=Path, help='Project folder with one subfolder per flightline')
+    parser.add_argument('prefix', help='Flightline prefix (e.g. 20210803-BC)')
+    parser.add_argument('--nav-pattern', default="_VNIR_1800_SN00812_FOVx2_raw.txt", dest='navfilepattern',
+                        help='NAV file name after {prefix}_{lineno}')
+    parser.add_argument('--ref-pattern', default="_VNIR_1800_SN00812_FOVx2_raw_rad_bsq_float32.hdr",
+                        dest='reffilepattern', help='Reference ENVI header file name after {prefix}_{lineno}')
+    parser.add_argument('--utc-offset', default=8, type=float, dest='utc_offset',
+                        help='Hours to add to the ENVI header acquisition time to get UTC (default: 8, AKDT)')
+    parser.add_argument('-n', '--every', default=None, type=int, dest='step',
+                        help='Also compute the solar position at every Nth scan line and write it per line')
+    parser.add_argument('--table', default=None, type=Path, dest='table',
+                        help='Summary table (default: {prefix}_flightdata.csv in the project folder)')
+    parser.add_argument('--outfile-pattern', default="VNIR_SWIR_rad_geo_flightdata.txt", dest='outfile_patt',
+                        help='Per-line file name after {prefix}_{lineno}_')
+    parser.add_argument('--no-line-files', help="Only write the summary table", dest='no_line_files',
+                        action='store_true')
+    add_instrumentation_args(parser)
+    args = parser.parse_args()
+    with instrumentation.session(args.report, args.profile):
+        summary, alongtrack = navigation.summarize_campaign(
+            args.projdir, args.prefix, args.navfilepattern, args.reffilepattern,
+            utc_offset=args.utc_offset, step=args.step)
+        print(f"There are {len(summary)} flightlines")
+
+        table = args.table if args.table else args.projdir / f"{args.prefix}_flightdata.csv"
+        navigation.write_summary_table(summary, table)
+        print(f"Done writing {table}")
+
+        if not args.no_line_files:
+            for outfp in navigation.write_flightdata(summary, args.projdir, args.outfile_patt,
+                                                     utc_offset=args.utc_offset):
+                print(f"Done writing {outfp}")
+            for outfp in navigation.write_solar_along_track(summary, alongtrack, args.projdir):
+                print(f"Done writing {outfp}")
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+###############################################################################
+#                                                                             #
+#       Script for writing the per-pixel view geometry and the per-scan       #
+#       line solar geometry of all flightlines of a campaign in raw           #
+#       (sensor) geometry, from the NAV files and the sensor model files.     #
+#                                                                             #
+#   Script written for Python 3.6 and higher                                  #
+#   Needs standard extension  plus:                                           #
+#      numpy                                                                  #
+#      pytz                                                                   #
+#                                                                             #
+#   Alaska EPSCoR Fire & Ice                                                  #
+#                                                                             #
+###############################################################################
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+from parsing import add_instrumentation_args  # (also makes the notebook helper modules importable)
+import geometry
+import instrumentation
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='This is a script for writing per-pixel view geometry and per-scan line '
+                                        'solar geometry rasters for all flightlines in a project folder.')
+    parser.add_argument('projdir', type=Path, help='Project folder with one subfolder per flightline')
+    parser.add_argument('prefix', help='Flightline prefix (e.g. 20210803-BC)')
+    parser.add_argument('-s', '--sensors', nargs='+', default=['VNIR', 'SWIR'], choices=list(geometry.sensors),
+                        dest='sensors', help='Sensors to process (default: VNIR SWIR)')
+    parser.add_argument('--unrotated', help='Use the sensor models for cameras that are not installed 180 degrees '
+                        'rotated', dest='unrotated', action='store_true')
+    parser.add_argument('--float16', help='Write float16 .npy instead of float32 ENVI files', dest='float16',
+                        action='store_true')
+    parser.add_argument('-b', '--blocklines', default=512, type=int, dest='blocklines',
+                        help='Scan lines per block (default: 512)')
+    parser.add_argument('-w', '--workers', default=None, type=int, dest='workers',
+                        help='Number of worker processes (default: number of CPUs)')
+    parser.add_argument('--utc-offset', default=8, type=float, dest='utc_offset',
+                        help='Hours to add to the ENVI header acquisition time to get UTC (default: 8, AKDT)')
+    add_instrumentation_args(parser)
+    args = parser.parse_args()
+    with instrumentation.session(args.report, args.profile):
+        jobs = geometry.campaign_jobs(args.projdir, args.prefix, args.sensors, not args.unrotated,
+                                      utc_offset=args.utc_offset)
+        if not jobs:
+            parser.error(f"No flightlines {args.prefix}_?? found in {args.projdir}")
+        print(f"There are {len(jobs)} NAV files to be processed.")
+
+        for viewstem, solarstem in geometry.write_geometries(jobs, args.workers, blocklines=args.blocklines,
+                                                             dtype='float16' if args.float16 else 'float32'):
+            print(f"Done writing {viewstem}, {solarstem}")